@@ -0,0 +1,255 @@
+"""
+Mood analytics over arbitrary date ranges.
+
+Everything here reads the JournalDaily rollup (one row per user per day,
+kept up to date by triggers on Journal), never Journal itself. A range of
+several years is a few hundred rows per year to aggregate in Python.
+"""
+import math
+from collections import deque
+from datetime import date, timedelta
+
+import queries
+
+BUCKETS = ("day", "week", "month")
+MOOD_LEVELS = 4
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366 * 10
+MAX_WINDOW = 365
+# The rolling average looks back up to MAX_WINDOW - 1 days before a range
+FIRST_DAY = date.min + timedelta(days=MAX_WINDOW)
+LAST_DAY = date.max
+
+ROLLUP_SQL = """
+    SELECT day, entry_count, mood_count, mood_sum, sleep_count, sleep_sum
+    FROM JournalDaily
+    WHERE user_username = ? AND day >= ? AND day <= ?
+    ORDER BY day
+"""
+
+
+def parse_range(start, end, today=None):
+    """
+    Resolves ?start= and ?end= (YYYY-MM-DD, inclusive) into dates. Missing
+    values default to the DEFAULT_RANGE_DAYS ending today; ranges are capped
+    at MAX_RANGE_DAYS and kept between FIRST_DAY and LAST_DAY.
+    """
+    today = today or date.today()
+    end_day = min(max(queries.parse_day(end) or today, FIRST_DAY), LAST_DAY)
+    start_day = queries.parse_day(start) or max(end_day - timedelta(days=DEFAULT_RANGE_DAYS - 1), FIRST_DAY)
+    start_day = min(max(start_day, FIRST_DAY), LAST_DAY)
+    if start_day > end_day:
+        start_day, end_day = end_day, start_day
+    if (end_day - start_day).days >= MAX_RANGE_DAYS:
+        start_day = end_day - timedelta(days=MAX_RANGE_DAYS - 1)
+    return start_day, end_day
+
+
+def load_rollups(conn, username, start_day, end_day):
+    return conn.execute(
+        ROLLUP_SQL, (username, start_day.isoformat(), end_day.isoformat())
+    ).fetchall()
+
+
+def _average(total, count):
+    return round(total / count, 2) if count else None
+
+
+def daily_series(rows, start_day, window):
+    """
+    Per-day points for days with entries, each with a rolling mood average
+    over the `window` calendar days ending that day. `rows` must start
+    window - 1 days before start_day so the first points have full windows.
+    """
+    series = []
+    in_window = deque()  # (day, mood_sum, mood_count) inside the rolling window
+    window_sum = 0.0
+    window_count = 0
+    for row in rows:
+        day = date.fromisoformat(row["day"])
+        in_window.append((day, row["mood_sum"], row["mood_count"]))
+        window_sum += row["mood_sum"]
+        window_count += row["mood_count"]
+        while in_window[0][0] <= day - timedelta(days=window):
+            _, old_sum, old_count = in_window.popleft()
+            window_sum -= old_sum
+            window_count -= old_count
+        if day < start_day:
+            continue
+        series.append({
+            "day": row["day"],
+            "entries": row["entry_count"],
+            "avg_mood": _average(row["mood_sum"], row["mood_count"]),
+            "avg_sleep": _average(row["sleep_sum"], row["sleep_count"]),
+            "rolling_mood": _average(window_sum, window_count),
+        })
+    return series
+
+
+def _period(day, bucket):
+    if bucket == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{day.year}-{day.month:02d}"
+
+
+def bucket_series(rows, bucket):
+    """Weekly (ISO week) or monthly aggregates of the daily rollups."""
+    periods = {}
+    for row in rows:
+        key = _period(date.fromisoformat(row["day"]), bucket)
+        totals = periods.setdefault(key, [0, 0, 0, 0.0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += row["entry_count"]
+        totals[2] += row["mood_count"]
+        totals[3] += row["mood_sum"]
+        totals[4] += row["sleep_count"]
+        totals[5] += row["sleep_sum"]
+    return [
+        {
+            "period": key,
+            "days_logged": days,
+            "entries": entries,
+            "avg_mood": _average(mood_sum, mood_count),
+            "avg_sleep": _average(sleep_sum, sleep_count),
+        }
+        for key, (days, entries, mood_count, mood_sum, sleep_count, sleep_sum) in periods.items()
+    ]
+
+
+def mood_sleep_correlation(rows):
+    """Pearson correlation between daily average mood and daily average sleep."""
+    pairs = [
+        (row["mood_sum"] / row["mood_count"], row["sleep_sum"] / row["sleep_count"])
+        for row in rows
+        if row["mood_count"] and row["sleep_count"]
+    ]
+    n = len(pairs)
+    if n < 3:
+        return None
+    mean_mood = sum(mood for mood, _ in pairs) / n
+    mean_sleep = sum(sleep for _, sleep in pairs) / n
+    covariance = sum((mood - mean_mood) * (sleep - mean_sleep) for mood, sleep in pairs)
+    spread_mood = math.sqrt(sum((mood - mean_mood) ** 2 for mood, _ in pairs))
+    spread_sleep = math.sqrt(sum((sleep - mean_sleep) ** 2 for _, sleep in pairs))
+    if not spread_mood or not spread_sleep:
+        return None
+    return round(covariance / (spread_mood * spread_sleep), 3)
+
+
+def longest_streak(rows):
+    """Longest run of consecutive days with at least one entry in `rows`."""
+    longest = current = 0
+    previous = None
+    for row in rows:
+        day = date.fromisoformat(row["day"])
+        current = current + 1 if previous and day - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return longest
+
+
+def current_streak(conn, username, today=None):
+    """
+    Consecutive days with entries ending today (or yesterday, so the streak
+    isn't shown as broken before today's check-in). Reads newest-first and
+    stops at the first gap.
+    """
+    today = today or date.today()
+    cursor = conn.execute(
+        "SELECT day FROM JournalDaily WHERE user_username = ? AND day <= ? ORDER BY day DESC",
+        (username, today.isoformat()),
+    )
+    expected = None
+    streak = 0
+    for (day,) in cursor:
+        day = date.fromisoformat(day)
+        if expected is None:
+            if day < today - timedelta(days=1):
+                break
+        elif day != expected:
+            break
+        streak += 1
+        expected = day - timedelta(days=1)
+    cursor.close()
+    return streak
+
+
+def mood_level(avg_mood):
+    """Heatmap intensity: 0 without a mood rating, else 1 (low) to MOOD_LEVELS."""
+    if avg_mood is None:
+        return 0
+    return min(MOOD_LEVELS, 1 + int((avg_mood - 1) / 9 * MOOD_LEVELS))
+
+
+def calendar_year(conn, username, year):
+    """
+    Heatmap data for a whole year from one range read of the rollup: a
+    cell per day with entries, keyed 'YYYY-MM-DD', and totals per month
+    (months[0] is January).
+    """
+    days = {}
+    months = [[0, 0, 0, 0.0] for _ in range(12)]  # days, entries, mood_count, mood_sum
+    for row in load_rollups(conn, username, date(year, 1, 1), date(year, 12, 31)):
+        avg_mood = _average(row["mood_sum"], row["mood_count"])
+        days[row["day"]] = {
+            "entries": row["entry_count"],
+            "avg_mood": avg_mood,
+            "avg_sleep": _average(row["sleep_sum"], row["sleep_count"]),
+            "level": mood_level(avg_mood),
+        }
+        totals = months[int(row["day"][5:7]) - 1]
+        totals[0] += 1
+        totals[1] += row["entry_count"]
+        totals[2] += row["mood_count"]
+        totals[3] += row["mood_sum"]
+    return {
+        "year": year,
+        "days": days,
+        "months": [
+            {"days_logged": days_logged, "entries": entries, "avg_mood": _average(mood_sum, mood_count)}
+            for days_logged, entries, mood_count, mood_sum in months
+        ],
+    }
+
+
+def mood_analytics(conn, username, start_day, end_day, bucket="day", window=7):
+    """Builds the analytics payload for one user and date range."""
+    rows = load_rollups(conn, username, start_day - timedelta(days=window - 1), end_day)
+    in_range = [row for row in rows if row["day"] >= start_day.isoformat()]
+    mood_count = sum(row["mood_count"] for row in in_range)
+    sleep_count = sum(row["sleep_count"] for row in in_range)
+    length = (end_day - start_day).days + 1
+
+    if bucket == "day":
+        series = daily_series(rows, start_day, window)
+    else:
+        series = bucket_series(in_range, bucket)
+
+    return {
+        "today": date.today().isoformat(),
+        "start": start_day.isoformat(),
+        "end": end_day.isoformat(),
+        "bucket": bucket,
+        "window": window,
+        "series": series,
+        "summary": {
+            "days_logged": len(in_range),
+            "entries": sum(row["entry_count"] for row in in_range),
+            "avg_mood": _average(sum(row["mood_sum"] for row in in_range), mood_count),
+            "avg_sleep": _average(sum(row["sleep_sum"] for row in in_range), sleep_count),
+            "mood_sleep_correlation": mood_sleep_correlation(in_range),
+            "longest_streak": longest_streak(in_range),
+            "current_streak": current_streak(conn, username),
+        },
+        # Same-length ranges either side, for paging through the chart;
+        # None past FIRST_DAY or LAST_DAY
+        "previous": {
+            "start": (start_day - timedelta(days=length)).isoformat(),
+            "end": (start_day - timedelta(days=1)).isoformat(),
+        } if (start_day - FIRST_DAY).days >= length else None,
+        "next": {
+            "start": (end_day + timedelta(days=1)).isoformat(),
+            "end": (end_day + timedelta(days=length)).isoformat(),
+        } if (LAST_DAY - end_day).days >= length else None,
+    }
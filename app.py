@@ -1,204 +1,90 @@
-from flask import Flask, render_template, request, session, redirect, url_for, flash
+import time
+
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, jsonify, make_response, render_template, stream_template, request, session, redirect, url_for, flash
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import calendar
 import secrets
-import random
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from db import get_db
+import analytics
+import assets
+import assistant
+import auth
+import db
+import http_cache
+import instrumentation
+import lifecycle
+import maintenance
+import portability
+import queries
+import ratelimit
+import recommendations
+import rendering
+import search
+import sessions
+import startup
+import summary
+import tags
+import validation
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "a_strong_and_unique_key_for_eira_app")
-DATABASE = "userdata.db"
+DATABASE = os.environ.get("DATABASE", "userdata.db")
+app.config["DATABASE"] = DATABASE
+app.config["HISTORY_PAGE_SIZE"] = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+app.config["HISTORY_MAX_PAGE_SIZE"] = 500
+# When set, /history streams every entry instead of paginating
+# (either mode can be picked per request with ?stream=1 or ?stream=0)
+app.config["HISTORY_STREAM"] = os.environ.get("HISTORY_STREAM", "0") == "1"
+# Number of reverse proxies in front of the app (e.g. 1 behind nginx or
+# Vercel). Per-client limits need the real client address, which only
+# they can supply in X-Forwarded-For; 0 trusts no forwarded headers.
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+db.init_app(app)
+instrumentation.init_app(app)
+startup.init_app(app, _import_started)
+sessions.init_app(app)
+auth.init_app(app)
+http_cache.init_app(app)
+assets.init_app(app)
+rendering.init_app(app)
+summary.init_app(app)
+recommendations.init_app(app)
+assistant.init_app(app)
+ratelimit.init_app(app)
+lifecycle.init_app(app)
+maintenance.init_app(app)
 
-def get_db_connection():
-    """Returns a new database connection."""
-    conn = sqlite3.connect(DATABASE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Helper function to check login status
+def is_logged_in():
+    return sessions.current_user() is not None
 
-def init_db():
-    """Initializes the database and creates all necessary tables."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # User Table (updated with email)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS User
-        (
-            username VARCHAR(20) NOT NULL PRIMARY KEY,
-            password VARCHAR(128) NOT NULL,
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    
-    # Journal Table with mood_rating
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS Journal (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_username VARCHAR(20) NOT NULL,
-            title VARCHAR(100) NOT NULL,
-            content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            sleep_hours FLOAT,
-            mood TEXT,
-            mood_rating REAL,
-            tags TEXT,
-            FOREIGN KEY (user_username) REFERENCES User(username) ON DELETE CASCADE
-        )
-        """
-    )
-    
-    # Resources Table (for recommendations)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS Resources
-        (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category TEXT NOT NULL,
-            title TEXT NOT NULL,
-            url TEXT NOT NULL,
-            description TEXT,
-            tags TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    
-    # Password Reset Tokens Table
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS PasswordResetTokens
-        (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username VARCHAR(20) NOT NULL,
-            token TEXT NOT NULL UNIQUE,
-            expiry TIMESTAMP NOT NULL,
-            used INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (username) REFERENCES User(username) ON DELETE CASCADE
-        )
-        """
-    )
-    
-    conn.commit()
-    
-    # Insert sample resources if table is empty
-    count = conn.execute("SELECT COUNT(*) FROM Resources").fetchone()[0]
-    if count == 0:
-        sample_resources = [
-            # Depression support resources
-            ("depression_support", "National Suicide Prevention Lifeline", "https://988lifeline.org/", "24/7 crisis support", "crisis,depression"),
-            ("depression_support", "SAMHSA National Helpline", "https://www.samhsa.gov/find-help/national-helpline", "Free, confidential, 24/7 treatment referral", "support,depression"),
-            
-            # Crisis helpline
-            ("crisis_helpline", "Crisis Text Line", "https://www.crisistextline.org/", "Text HOME to 741741 for 24/7 crisis support", "crisis,text"),
-            ("crisis_helpline", "988 Suicide & Crisis Lifeline", "https://988lifeline.org/", "Call or text 988 for immediate help", "crisis,suicide"),
-            
-            # Stress management
-            ("stress_management", "Headspace: Stress Management", "https://www.headspace.com/stress", "Guided meditation for stress relief", "stress,meditation"),
-            ("stress_management", "Mayo Clinic: Stress Relief", "https://www.mayoclinic.org/healthy-lifestyle/stress-management", "Science-based stress reduction techniques", "stress,health"),
-            ("stress_management", "APA: Stress Management Tips", "https://www.apa.org/topics/stress/tips", "Psychological tips for managing stress", "stress,psychology"),
-            
-            # Motivation
-            ("motivation", "TED: How to Stay Motivated", "https://www.ted.com/topics/motivation", "Inspiring talks on motivation", "motivation,inspiration"),
-            ("motivation", "Tiny Habits by BJ Fogg", "https://tinyhabits.com/", "Build motivation through small wins", "motivation,habits"),
-            
-            # Sleep hygiene
-            ("sleep_hygiene", "Sleep Foundation", "https://www.sleepfoundation.org/sleep-hygiene", "Evidence-based sleep improvement tips", "sleep,health"),
-            ("sleep_hygiene", "CDC: Sleep Hygiene Tips", "https://www.cdc.gov/sleep/about_sleep/sleep_hygiene.html", "Healthy sleep habits", "sleep,hygiene"),
-            ("sleep_hygiene", "Calm: Sleep Stories", "https://www.calm.com/sleep-stories", "Relaxing bedtime stories", "sleep,meditation"),
-            
-            # Relaxation techniques
-            ("relaxation_techniques", "4-7-8 Breathing Exercise", "https://www.drweil.com/health-wellness/body-mind-spirit/stress-anxiety/breathing-three-exercises/", "Simple breathing for relaxation", "breathing,relaxation"),
-            ("relaxation_techniques", "Progressive Muscle Relaxation", "https://www.anxietycanada.com/articles/progressive-muscle-relaxation/", "Physical relaxation technique", "relaxation,anxiety"),
-            
-            # General wellness
-            ("general_wellness", "MindTools: Wellbeing Resources", "https://www.mindtools.com/pages/main/newMN_TCS.htm", "Mental wellness strategies", "wellness,mental-health"),
-            ("general_wellness", "Mental Health America", "https://www.mhanational.org/", "Mental health information and support", "wellness,support"),
-            
-            # Gratitude exercises
-            ("gratitude_exercises", "Greater Good Science Center: Gratitude", "https://greatergood.berkeley.edu/topic/gratitude", "Science of gratitude", "gratitude,positive"),
-            ("gratitude_exercises", "5-Minute Gratitude Journal", "https://www.intelligentchange.com/blogs/read/gratitude-journal-prompts", "Daily gratitude prompts", "gratitude,journal"),
-            
-            # Positive psychology
-            ("positive_psychology", "Positive Psychology Center", "https://ppc.sas.upenn.edu/", "Research-based positive psychology", "positive,psychology"),
-            ("positive_psychology", "Action for Happiness", "https://actionforhappiness.org/", "Evidence-based actions for happiness", "positive,happiness"),
-            
-            # Energy boosting
-            ("energy_boosting", "Natural Energy Boosters", "https://www.health.harvard.edu/staying-healthy/9-tips-to-boost-your-energy-naturally", "Science-backed energy tips", "energy,health"),
-            ("energy_boosting", "Movement for Energy", "https://www.mayoclinic.org/healthy-lifestyle/fitness/in-depth/exercise/art-20048389", "Exercise for better energy", "energy,exercise"),
-        ]
-        
-        for resource in sample_resources:
-            conn.execute(
-                "INSERT INTO Resources (category, title, url, description, tags) VALUES (?, ?, ?, ?, ?)",
-                resource
-            )
-        conn.commit()
-    
-    conn.close()
 
-init_db()
+def auth_busy(error, template, **context):
+    """Response for when password hashing is saturated (503) or throttled (429)."""
+    flash("We're handling a lot of sign-ins right now. Please try again in a moment.", "error")
+    return render_template(template, **context), error.status_code
 
-# Helper function to check login status
-def is_logged_in():
-    return "Username" in session
 
+def rate_limited(error, template, **context):
+    """429 with Retry-After for a client that has used up its attempts."""
+    flash("Too many attempts. Please wait a moment and try again.", "error")
+    response = make_response(render_template(template, **context), error.status_code)
+    response.headers["Retry-After"] = error.retry_after_header
+    return response
 
-def get_resource_recommendations(mood_rating, sleep_hours):
-    """
-    Rule-based recommendation system.
-    Returns list of recommended resources based on mood and sleep.
-    """
-    conn = get_db_connection()
-    recommended_categories = []
-    
-    # Analyze mood
-    if mood_rating <= 3:
-        recommended_categories.extend(["depression_support", "crisis_helpline"])
-    elif mood_rating <= 5:
-        recommended_categories.extend(["stress_management", "motivation"])
-    elif mood_rating <= 7:
-        recommended_categories.append("general_wellness")
-    else:
-        recommended_categories.extend(["gratitude_exercises", "positive_psychology"])
-    
-    # Analyze sleep
-    if sleep_hours < 5:
-        recommended_categories.extend(["sleep_hygiene", "relaxation_techniques"])
-    elif sleep_hours > 10:
-        recommended_categories.extend(["energy_boosting", "sleep_hygiene"])
-    
-    # Remove duplicates
-    recommended_categories = list(set(recommended_categories))
-    
-    # Fetch resources
-    resources = []
-    for category in recommended_categories:
-        category_resources = conn.execute(
-            """
-            SELECT title, url, description, category 
-            FROM Resources 
-            WHERE category = ? 
-            ORDER BY RANDOM() 
-            LIMIT 2
-            """,
-            (category,)
-        ).fetchall()
-        resources.extend(category_resources)
-    
-    conn.close()
-    
-    # Limit to 6 total recommendations
-    if len(resources) > 6:
-        resources = random.sample(resources, 6)
-    
-    return resources
+
+def journal_changed(username):
+    """Drops cached data derived from a user's journal after a write."""
+    summary.invalidate(username)
 
 
 # --- Routes ---
@@ -211,68 +97,38 @@ def index():
 
 
 @app.route("/dashboard", methods=["GET"])
+@http_cache.conditional
 def dashboard():
-    if is_logged_in():
-        username = session["Username"]
-        conn = get_db_connection()
-        
-        # Get last 10 mood ratings for chart
-        recent_entries = conn.execute(
-            """
-            SELECT strftime('%Y-%m-%d', timestamp) as timestamp, mood_rating
-            FROM Journal 
-            WHERE user_username = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 10
-            """,
-            (username,),
-        ).fetchall()
-        
-        recent_dates = [entry["timestamp"] for entry in recent_entries]
-        recent_moods = [
-            float(entry["mood_rating"]) if entry["mood_rating"] else 5.0
-            for entry in recent_entries
-        ]
-
-        # NEW: get the most recent mood rating for "current mood"
-        latest_entry = conn.execute(
-            """
-            SELECT mood_rating
-            FROM Journal
-            WHERE user_username = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (username,)
-        ).fetchone()
-
-        if latest_entry and latest_entry["mood_rating"] is not None:
-            current_mood = float(latest_entry["mood_rating"])
-        else:
-            # Fallback if no entries exist yet
-            current_mood = None  # or 5.0 as a neutral default
-
-        # Check if user has completed today's check-in
-        today = datetime.now().strftime('%Y-%m-%d')
-        todays_checkin = conn.execute(
-            "SELECT id FROM Journal WHERE user_username = ? AND timestamp = ?",
-            (username, today)
-        ).fetchone()
-        
-        conn.close()
-        
+    user = sessions.current_user()
+    if user is not None:
+        # Chart data, current mood and today's check-in, from one query or the cache
         return render_template(
             "dashboard.html",
-            username=username,
-            recent_dates=recent_dates,
-            recent_moods=recent_moods,
-            checkin_complete=todays_checkin is not None,
-            current_mood=current_mood,      # ⬅ pass to template
+            username=user.username,
+            **user.summary,
         )
     else:
         return redirect(url_for("index"))
 
 
+@app.route("/api/analytics/mood", methods=["GET"])
+@http_cache.conditional
+def mood_analytics():
+    """Rolling averages, weekly/monthly aggregates, correlation and streaks as JSON."""
+    if not is_logged_in():
+        return jsonify(error="Login required"), 401
+    
+    username = session["Username"]
+    start_day, end_day = analytics.parse_range(request.args.get("start"), request.args.get("end"))
+    bucket = request.args.get("bucket", "day")
+    if bucket not in analytics.BUCKETS:
+        return jsonify(error=f"bucket must be one of {', '.join(analytics.BUCKETS)}"), 400
+    window = request.args.get("window", 7, type=int)
+    window = max(1, min(window, analytics.MAX_WINDOW))
+    
+    return jsonify(analytics.mood_analytics(get_db(), username, start_day, end_day, bucket, window))
+
+
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
     if request.method == "POST":
@@ -288,22 +144,21 @@ def signup():
             flash("Password must be at least 4 characters", "error")
             return render_template("signup.html")
         
-        password_hash = generate_password_hash(password)
+        try:
+            password_hash = auth.hash_password(password, request.remote_addr)
+        except auth.AuthBusy as e:
+            return auth_busy(e, "signup.html")
         
-        conn = get_db_connection()
         try:
-            conn.execute(
+            db.write(lambda conn: conn.execute(
                 "INSERT INTO User (username, password, email) VALUES (?, ?, ?)",
                 (username, password_hash, email),
-            )
-            conn.commit()
+            ))
             flash("Account created successfully! Please log in.", "success")
             return redirect(url_for("login"))
         except sqlite3.IntegrityError:
             flash("Username already exists", "error")
             return render_template("signup.html")
-        finally:
-            conn.close()
     
     return render_template("signup.html")
 
@@ -314,22 +169,36 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
         
-        conn = get_db_connection()
+        try:
+            ratelimit.check("login_ip", request.remote_addr)
+            # Only failed attempts spend the username's tokens (see below)
+            ratelimit.check("login_user", ratelimit.username_key(username), cost=0)
+        except ratelimit.RateLimited as e:
+            return rate_limited(e, "login.html")
+        
+        conn = get_db()
         user_data = conn.execute(
-            "SELECT username, password FROM User WHERE username = ?", (username,)
+            "SELECT username, password FROM User WHERE username = ? AND deleted_at IS NULL", (username,)
         ).fetchone()
-        conn.close()
         
         if user_data:
             stored_hash = user_data["password"]
-            if check_password_hash(stored_hash, password):
+            try:
+                valid = auth.verify_password(stored_hash, password, request.remote_addr)
+            except auth.AuthBusy as e:
+                return auth_busy(e, "login.html")
+            if valid:
                 session["Username"] = user_data["username"]
+                # Upgrade hashes made with an older method/cost, off the request path
+                auth.upgrade_hash_if_needed(user_data["username"], stored_hash, password)
                 flash(f"Welcome back, {username}!", "success")
                 return redirect(url_for("dashboard"))
             else:
+                ratelimit.spend("login_user", ratelimit.username_key(username))
                 flash("Invalid username or password", "error")
                 return render_template("login.html")
         else:
+            ratelimit.spend("login_user", ratelimit.username_key(username))
             flash("Invalid username or password", "error")
             return render_template("login.html")
     
@@ -342,20 +211,27 @@ def forgot_password():
     if request.method == "POST":
         username = request.form.get("username")
         
-        conn = get_db_connection()
-        user = conn.execute("SELECT username, email FROM User WHERE username = ?", (username,)).fetchone()
+        try:
+            ratelimit.check("forgot_ip", request.remote_addr)
+            ratelimit.check("forgot_user", ratelimit.username_key(username))
+        except ratelimit.RateLimited as e:
+            return rate_limited(e, "forgot_password.html")
+        
+        conn = get_db()
+        user = conn.execute(
+            "SELECT username, email FROM User WHERE username = ? AND deleted_at IS NULL", (username,)
+        ).fetchone()
         
         if user:
             # Generate secure token
             token = secrets.token_urlsafe(32)
-            expiry = datetime.now() + timedelta(hours=1)
+            expiry = queries.format_timestamp(datetime.now() + timedelta(hours=1))
             
             # Store token in database
-            conn.execute(
+            db.write(lambda conn: conn.execute(
                 "INSERT INTO PasswordResetTokens (username, token, expiry) VALUES (?, ?, ?)",
                 (username, token, expiry)
-            )
-            conn.commit()
+            ))
             
             # In a real app, you would send an email here
             # For NEA purposes, we'll display the reset link
@@ -366,7 +242,6 @@ def forgot_password():
             # Don't reveal whether username exists (security)
             flash("If that username exists, a reset link has been sent", "info")
         
-        conn.close()
         return redirect(url_for("login"))
     
     return render_template("forgot_password.html")
@@ -376,6 +251,12 @@ def forgot_password():
 def reset_password(token):
     """Complete password reset with token"""
     if request.method == "POST":
+        # Limits token guessing and the password hashing each attempt costs
+        try:
+            ratelimit.check("reset_ip", request.remote_addr)
+        except ratelimit.RateLimited as e:
+            return rate_limited(e, "reset_password.html", token=token)
+        
         new_password = request.form.get("new_password")
         confirm_password = request.form.get("confirm_password")
         
@@ -387,41 +268,43 @@ def reset_password(token):
             flash("Password must be at least 8 characters", "error")
             return render_template("reset_password.html", token=token)
         
-        conn = get_db_connection()
+        conn = get_db()
         
-        # Validate token
+        # Validate token (expiry compares as text, like Journal.timestamp)
         reset_request = conn.execute(
-            "SELECT username, expiry FROM PasswordResetTokens WHERE token = ? AND used = 0",
-            (token,)
+            "SELECT username FROM PasswordResetTokens WHERE token = ? AND used = 0 AND expiry > ?",
+            (token, queries.now_timestamp())
         ).fetchone()
         
         if not reset_request:
             flash("Invalid or expired reset link", "error")
-            conn.close()
-            return redirect(url_for("login"))
-        
-        # Check expiry
-        expiry_time = datetime.strptime(reset_request["expiry"], '%Y-%m-%d %H:%M:%S.%f')
-        if expiry_time < datetime.now():
-            flash("Reset link has expired", "error")
-            conn.close()
             return redirect(url_for("forgot_password"))
         
         # Update password
-        password_hash = generate_password_hash(new_password)
-        conn.execute(
-            "UPDATE User SET password = ? WHERE username = ?",
-            (password_hash, reset_request["username"])
-        )
-        
-        # Mark token as used
-        conn.execute(
-            "UPDATE PasswordResetTokens SET used = 1 WHERE token = ?",
-            (token,)
-        )
+        try:
+            password_hash = auth.hash_password(new_password, request.remote_addr)
+        except auth.AuthBusy as e:
+            return auth_busy(e, "reset_password.html", token=token)
+
+        def apply_reset(conn):
+            # Mark token as used; only one of two concurrent resets gets it
+            claimed = conn.execute(
+                "UPDATE PasswordResetTokens SET used = 1 WHERE token = ? AND used = 0",
+                (token,)
+            ).rowcount
+            if claimed:
+                conn.execute(
+                    "UPDATE User SET password = ? WHERE username = ? AND deleted_at IS NULL",
+                    (password_hash, reset_request["username"])
+                )
+            return claimed
+        
+        if not db.write(apply_reset):
+            flash("Invalid or expired reset link", "error")
+            return redirect(url_for("forgot_password"))
         
-        conn.commit()
-        conn.close()
+        # Whoever knew the old password is signed out everywhere
+        sessions.revoke_user(reset_request["username"])
         
         flash("Password reset successfully! Please log in.", "success")
         return redirect(url_for("login"))
@@ -433,46 +316,43 @@ def reset_password(token):
 @app.route("/daily-checkin", methods=["GET", "POST"])
 def daily_checkin():
     """Daily mood check-in with recommendations"""
-    if not is_logged_in():
+    user = sessions.current_user()
+    if user is None:
         return redirect(url_for("index"))
     
-    username = session["Username"]
-    today = datetime.now().strftime('%Y-%m-%d')
+    username = user.username
+    today = queries.checkin_timestamp()
     
     if request.method == "POST":
-        mood_rating = float(request.form.get("mood_rating", 5.0))
-        sleep_hours = int(request.form.get("sleep_hours", 7))
         notes = request.form.get("content", "")
         
-        # Validate inputs
-        if not (1 <= mood_rating <= 10):
-            flash("Mood rating must be between 1 and 10", "error")
-            return render_template("daily_checkin.html")
-        
-        if not (0 <= sleep_hours <= 24):
-            flash("Sleep hours must be between 0 and 24", "error")
+        # Validate inputs (same rules as the bulk import)
+        try:
+            mood_rating = validation.validate_mood_rating(request.form.get("mood_rating", 5.0))
+            sleep_hours = validation.validate_sleep_hours(request.form.get("sleep_hours", 7))
+        except validation.ValidationError as e:
+            flash(str(e), "error")
             return render_template("daily_checkin.html")
         
-        conn = get_db_connection()
-        
-        # Check if entry already exists for today
-        existing = conn.execute(
-            "SELECT id FROM Journal WHERE user_username = ? AND timestamp = ?",
-            (username, today)
-        ).fetchone()
-        
-        if existing:
-            # Update existing entry
-            conn.execute(
-                """
-                UPDATE Journal 
-                SET mood_rating = ?, sleep_hours = ?, content = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_username = ? AND timestamp = ?
-                """,
-                (mood_rating, sleep_hours, notes, username, today)
-            )
-            flash("Check-in updated successfully!", "success")
-        else:
+        def save_checkin(conn):
+            # Check if entry already exists for today
+            existing = conn.execute(
+                "SELECT id FROM Journal WHERE user_username = ? AND timestamp = ?",
+                (username, today)
+            ).fetchone()
+            
+            if existing:
+                # Update existing entry
+                conn.execute(
+                    """
+                    UPDATE Journal 
+                    SET mood_rating = ?, sleep_hours = ?, content = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_username = ? AND timestamp = ?
+                    """,
+                    (mood_rating, sleep_hours, notes, username, today)
+                )
+                return True
+            
             # Insert new entry; decide on a title
             title = "Daily check-in"
             conn.execute(
@@ -482,30 +362,27 @@ def daily_checkin():
                 """,
                 (username, today, mood_rating, sleep_hours, notes, title)
             )
+            return False
+        
+        updated = db.write(save_checkin)
+        journal_changed(username)
+        if updated:
+            flash("Check-in updated successfully!", "success")
+        else:
             flash("Check-in saved successfully!", "success")
-            
-        conn.commit()
-        conn.close()
         
         # Get recommendations
-        recommendations = get_resource_recommendations(mood_rating, sleep_hours)
+        resources = recommendations.get_resource_recommendations(mood_rating, sleep_hours)
         
         return render_template(
             "checkin_complete.html",
             mood_rating=mood_rating,
             sleep_hours=sleep_hours,
-            recommendations=recommendations
+            recommendations=resources
         )
     
     # GET request - check if already completed today
-    conn = get_db_connection()
-    todays_entry = conn.execute(
-        "SELECT mood_rating, sleep_hours, title FROM Journal WHERE user_username = ? AND timestamp = ?",
-        (username, today)
-    ).fetchone()
-    conn.close()
-    
-    return render_template("daily_checkin.html", existing_entry=todays_entry)
+    return render_template("daily_checkin.html", existing_entry=user.todays_checkin)
 
 
 @app.route("/delete-account", methods=["GET", "POST"])
@@ -520,21 +397,28 @@ def delete_account():
         password_confirmation = request.form.get("password")
         
         # Verify password
-        conn = get_db_connection()
+        conn = get_db()
         user = conn.execute(
-            "SELECT password FROM User WHERE username = ?",
+            "SELECT password FROM User WHERE username = ? AND deleted_at IS NULL",
             (username,)
         ).fetchone()
         
-        if not user or not check_password_hash(user["password"], password_confirmation):
+        try:
+            valid = user is not None and auth.verify_password(
+                user["password"], password_confirmation, request.remote_addr
+            )
+        except auth.AuthBusy as e:
+            return auth_busy(e, "delete_account.html")
+        
+        if not valid:
             flash("Incorrect password", "error")
-            conn.close()
             return render_template("delete_account.html")
         
-        # Delete all user data (CASCADE should handle foreign keys)
+        # Large journals are finished off in batches by the purge job
         try:
-            conn.execute("DELETE FROM User WHERE username = ?", (username,))
-            conn.commit()
+            lifecycle.delete_account(username)
+            sessions.revoke_user(username)
+            journal_changed(username)
             
             # Clear session
             session.clear()
@@ -543,26 +427,25 @@ def delete_account():
             return redirect(url_for("index"))
         
         except Exception as e:
-            conn.rollback()
             flash(f"Error deleting account: {str(e)}", "error")
             return render_template("delete_account.html")
-        finally:
-            conn.close()
     
     return render_template("delete_account.html")
 
 
 @app.route("/calendar", methods=["GET"])
+@http_cache.conditional
 def calendar_view():
-    if not is_logged_in():
+    user = sessions.current_user()
+    if user is None:
         return redirect(url_for("index"))
     
-    username = session["Username"]
+    username = user.username
     
     try:
         current_year = int(request.args.get("year", datetime.now().year))
         current_month = int(request.args.get("month", datetime.now().month))
-        if not 1 <= current_month <= 12:
+        if not 1 <= current_month <= 12 or not 1 < current_year < 9999:
             raise ValueError
     except ValueError:
         current_year = datetime.now().year
@@ -573,35 +456,38 @@ def calendar_view():
     next_dt = first_day_of_month + timedelta(days=32)
     next_dt = datetime(next_dt.year, next_dt.month, 1)
     
-    conn = get_db_connection()
-    sql = """
-        SELECT DISTINCT strftime('%Y-%m-%d', timestamp) AS entry_date 
-        FROM Journal 
-        WHERE user_username = ? 
-        AND strftime('%Y-%m', timestamp) = ?
-    """
-    month_filter = f"{current_year}-{current_month:02d}"
-    entries = conn.execute(sql, (username, month_filter)).fetchall()
-    conn.close()
-    
-    entries_by_date = {row["entry_date"]: True for row in entries}
+    # The whole year is one cheap read of the rollup; the page keeps it so
+    # moving between months of the same year needs no request at all.
+    # Deferred: skipped when the template has the fragments cached.
+    load_heatmap = rendering.deferred(lambda: analytics.calendar_year(get_db(), username, current_year))
     
     cal = calendar.Calendar(firstweekday=calendar.SUNDAY)
-    month_days = cal.monthdayscalendar(current_year, current_month)
-    calendar_days = [day if day != 0 else None for week in month_days for day in week]
     
     return render_template(
         "calendar.html",
-        calendar_days=calendar_days,
-        entries_by_date=entries_by_date,
+        weeks=cal.monthdayscalendar(current_year, current_month),
+        load_heatmap=load_heatmap,
         current_month=current_month,
         current_year=current_year,
         month_name=calendar.month_name[current_month],
+        month_names=list(calendar.month_name),
         prev_month={"year": prev_dt.year, "month": prev_dt.month},
         next_month={"year": next_dt.year, "month": next_dt.month},
     )
 
 
+@app.route("/api/calendar/<int:year>", methods=["GET"])
+@http_cache.conditional
+def calendar_heatmap(year):
+    """Per-day entry counts and mood/sleep averages for a whole year."""
+    if not is_logged_in():
+        return jsonify(error="Login required"), 401
+    if not 1 <= year <= 9999:
+        return jsonify(error="Invalid year"), 400
+    
+    return jsonify(analytics.calendar_year(get_db(), session["Username"], year))
+
+
 @app.route("/journal_entry", methods=["GET", "POST"])
 def journal_entry():
     """Create new journal entry with mood and tags."""
@@ -612,72 +498,216 @@ def journal_entry():
         title = request.form.get("title")
         content = request.form.get("content")
         mood = request.form.get("mood") or None
-        tags = request.form.get("tags") or None  # "school,friends" or empty
+        entry_tags = tags.parse_tags(request.form.get("tags"))  # "school,friends" or None
         username = session["Username"]
 
         if not title or not content:
             flash("Title and content are required", "error")
             return render_template("journal_entry.html")
 
-        conn = get_db_connection()
         try:
-            conn.execute(
-                "INSERT INTO Journal (user_username, title, content, mood, tags) "
-                "VALUES (?, ?, ?, ?, ?)",
-                (username, title, content, mood, tags),
-            )
-            conn.commit()
+            db.write(lambda conn: conn.execute(
+                "INSERT INTO Journal (user_username, title, content, timestamp, mood, tags) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (username, title, content, queries.now_timestamp(), mood, entry_tags),
+            ))
+            journal_changed(username)
             flash("Journal entry saved successfully!", "success")
             return redirect(url_for("history"))
         except Exception as e:
             print(f"Database error on journal entry: {e}")
             flash("An error occurred while saving the entry", "error")
             return render_template("journal_entry.html")
-        finally:
-            conn.close()
 
     return render_template("journal_entry.html")
 
 
+@app.route("/journal/export", methods=["GET"])
+def export_journal():
+    """Download every journal entry as NDJSON (default) or CSV."""
+    if not is_logged_in():
+        return redirect(url_for("index"))
+    
+    username = session["Username"]
+    fmt = portability.detect_format(request.args.get("format"))
+    filename = f"eira-journal-{datetime.now():%Y-%m-%d}.{fmt}"
+    return Response(
+        portability.export(username, fmt),
+        mimetype=portability.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route("/journal/import", methods=["POST"])
+def import_journal():
+    """Bulk-import entries from an uploaded NDJSON or CSV file (or the raw body)."""
+    if not is_logged_in():
+        return redirect(url_for("index"))
+    
+    username = session["Username"]
+    requested = request.args.get("format") or request.form.get("format")
+    upload = request.files.get("file")
+    if upload:
+        fmt = portability.detect_format(requested, upload.filename, upload.mimetype)
+        stream = upload.stream
+    else:
+        fmt = portability.detect_format(requested, mimetype=request.mimetype)
+        stream = request.stream
+    
+    report = portability.import_entries(username, stream, fmt)
+    if report["imported"]:
+        journal_changed(username)
+    status = 400 if report["errors"] and not report["imported"] else 200
+    return jsonify(report), status
+
+
+@app.route("/api/tags", methods=["GET"])
+@http_cache.conditional
+def tag_counts():
+    """The user's most used tags with entry counts (?limit=, default 10)."""
+    if not is_logged_in():
+        return jsonify(error="Login required"), 401
+    
+    limit = request.args.get("limit", tags.TOP_TAGS_LIMIT, type=int)
+    return jsonify(tags=tags.top_tags(get_db(), session["Username"], limit))
+
+
 @app.route("/history", methods=["GET"])
+@http_cache.conditional
 def history():
     if not is_logged_in():
         return redirect(url_for("index"))
     
     username = session["Username"]
-    date_filter = request.args.get("timestamp")
-    
-    conn = get_db_connection()
+    # ?timestamp= is the old name of ?date=; keep old links working
+    date_filter = queries.parse_day(request.args.get("date") or request.args.get("timestamp"))
+    tag = (request.args.get("tag") or "").strip()
+    cursor = queries.decode_cursor(request.args.get("after"))
+    stream = request.args.get("stream", "1" if app.config["HISTORY_STREAM"] else "0") == "1"
+    page_size = request.args.get("size", app.config["HISTORY_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, app.config["HISTORY_MAX_PAGE_SIZE"]))
+    
+    where = ["user_username = ?"]
+    params = [username]
+    filters = {}
     if date_filter:
-        sql = """
-            SELECT id, title, strftime('%Y-%m-%d %H:%M', timestamp) AS timestamp, mood, mood_rating
-            FROM Journal 
-            WHERE user_username = ? AND strftime('%Y-%m-%d', timestamp) = ?
-            ORDER BY timestamp DESC
-        """
-        entries = conn.execute(sql, (username, date_filter)).fetchall()
-        page_title = f"Entries for {date_filter}"
+        day_filter, day_params = queries.range_filter(
+            queries.day_range(date_filter), column="Journal.timestamp"
+        )
+        where.append(day_filter)
+        params += day_params
+        filters["date"] = f"{date_filter:%Y-%m-%d}"
+        page_title = f"Entries for {date_filter:%Y-%m-%d}"
     else:
-        sql = """
-            SELECT id, title, strftime('%Y-%m-%d %H:%M', timestamp) AS timestamp, mood, mood_rating
-            FROM Journal 
-            WHERE user_username = ?
-            ORDER BY timestamp DESC
-        """
-        entries = conn.execute(sql, (username,)).fetchall()
         page_title = "Your Journal History"
+    if tag:
+        tag_sql, tag_params = tags.tag_filter(username, tag)
+        where.append(tag_sql)
+        params += tag_params
+        filters["tag"] = tag
+    
+    conn = get_db()
+    count_where, count_params = list(where), list(params)
+    
+    # Deferred: skipped when the template has the fragments cached
+    @rendering.deferred
+    def load_counts():
+        if tag and not date_filter:
+            # Maintained by triggers, so no need to count the entries
+            entry_count = tags.tag_count(conn, username, tag)
+        else:
+            entry_count = conn.execute(
+                f"SELECT COUNT(*) FROM Journal WHERE {' AND '.join(count_where)}", count_params
+            ).fetchone()[0]
+        return {"entry_count": entry_count, "top_tags": tags.top_tags(conn, username)}
+    
+    # Keyset pagination: continue after the last (timestamp, id) shown
+    if cursor:
+        after_filter, after_params = queries.keyset_filter(cursor)
+        where.append(after_filter)
+        params += after_params
+    
+    sql = f"""
+        SELECT id, title, strftime('%Y-%m-%d %H:%M', timestamp) AS timestamp,
+               Journal.timestamp AS sort_timestamp, mood, mood_rating
+        FROM Journal 
+        WHERE {' AND '.join(where)}
+        ORDER BY Journal.timestamp DESC, Journal.id DESC
+    """
+    if stream:
+        # Rows are pulled from SQLite while the page is being sent
+        return stream_template(
+            "history.html",
+            stream=True,
+            entries=db.stream_query(sql, params),
+            load_counts=load_counts,
+            page_title=page_title,
+            filters=filters,
+        )
+    
+    @rendering.deferred
+    def load_page():
+        entries = conn.execute(sql + " LIMIT ?", [*params, page_size + 1]).fetchall()
+        next_cursor = None
+        if len(entries) > page_size:
+            entries = entries[:page_size]
+            last = entries[-1]
+            next_cursor = queries.encode_cursor(last["sort_timestamp"], last["id"])
+        return {"entries": entries, "next_cursor": next_cursor}
+    
+    return render_template(
+        "history.html",
+        stream=False,
+        load_counts=load_counts,
+        load_page=load_page,
+        page_title=page_title,
+        page_size=page_size,
+        filters=filters,
+    )
+
+
+def run_search(username, prefix=False):
+    return search.search_entries(
+        get_db(),
+        username,
+        request.args.get("q", ""),
+        tag=request.args.get("tag") or None,
+        page=request.args.get("page", 1, type=int),
+        per_page=request.args.get("per_page", search.PER_PAGE, type=int),
+        prefix=prefix,
+    )
+
+
+@app.route("/search", methods=["GET"])
+@http_cache.conditional
+def search_page():
+    if not is_logged_in():
+        return redirect(url_for("index"))
+    
+    return render_template("search.html", search=run_search(session["Username"]))
+
+
+@app.route("/api/search", methods=["GET"])
+@http_cache.conditional
+def search_api():
+    """
+    Ranked full-text search with ?q=, ?tag=, ?page= and ?per_page=.
+    ?prefix=1 prefix-matches the last word, for search-as-you-type.
+    """
+    if not is_logged_in():
+        return jsonify(error="Login required"), 401
     
-    conn.close()
-    return render_template("history.html", entries=entries, page_title=page_title)
+    return jsonify(run_search(session["Username"], prefix=request.args.get("prefix") == "1"))
 
 
 @app.route("/entry/<int:entry_id>", methods=["GET"])
+@http_cache.conditional
 def view_entry(entry_id):
     if not is_logged_in():
         return redirect(url_for("index"))
     
     username = session["Username"]
-    conn = get_db_connection()
+    conn = get_db()
     entry = conn.execute(
         """
         SELECT id, title, content, strftime('%Y-%m-%d %H:%M:%S', timestamp) AS timestamp, 
@@ -686,7 +716,6 @@ def view_entry(entry_id):
         """,
         (entry_id, username),
     ).fetchone()
-    conn.close()
     
     if entry is None:
         flash("Entry not found", "error")
@@ -701,14 +730,12 @@ def delete_entry(entry_id):
         return redirect(url_for("index"))
     
     username = session["Username"]
-    conn = get_db_connection()
-    cursor = conn.execute(
+    deleted = db.write(lambda conn: conn.execute(
         "DELETE FROM Journal WHERE id = ? AND user_username = ?", (entry_id, username)
-    )
-    conn.commit()
-    conn.close()
+    ).rowcount)
+    journal_changed(username)
     
-    if cursor.rowcount > 0:
+    if deleted > 0:
         flash("Entry deleted successfully", "success")
         return redirect(url_for("history"))
     else:
@@ -724,6 +751,29 @@ def ai_assistant():
     return render_template('ai_assistant.html', username=username)
 
 
+@app.route("/api/assistant", methods=["POST"])
+def assistant_api():
+    """Streams a reply to {"message": ...} as server-sent events."""
+    if not is_logged_in():
+        return jsonify(error="Login required"), 401
+    
+    payload = request.get_json(silent=True) or request.form
+    message = (payload.get("message") or "").strip()
+    if not message:
+        return jsonify(error="Message is required"), 400
+    
+    try:
+        ratelimit.check("assistant_user", session["Username"])
+        return assistant.reply(session["Username"], message)
+    except ratelimit.RateLimited as e:
+        response = jsonify(error="You're sending messages very quickly. Please wait a moment.")
+        response.status_code = e.status_code
+        response.headers["Retry-After"] = e.retry_after_header
+        return response
+    except assistant.AssistantBusy as e:
+        return jsonify(error="The assistant is busy right now. Please try again in a moment."), e.status_code
+
+
 @app.route("/logout")
 def logout():
     session.pop("Username", None)
@@ -731,5 +781,8 @@ def logout():
     return redirect(url_for("index"))
 
 
+app.extensions["startup"].imported()
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,258 @@
+"""
+ASGI entry point, served next to the WSGI app (app:app):
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 asgi:application
+    uvicorn asgi:application
+    hypercorn asgi:application
+
+Under WSGI each request holds a worker (a gthread thread) from its first
+byte to its last, while it waits for SQLite, a password hash or a slow
+client included. Here the event loop owns the connections, so reading a
+request, waiting and sending a response take no thread; only the work
+does.
+
+- The hot read routes (ASYNC_ENDPOINTS) have async versions, made from
+  their sync views by async_view(): the ETag check (http_cache) and the
+  view are awaited one after the other on the database executor
+  (db.run), and so are the before_request hooks with the session and
+  finishing the response. The views render in the same step as their
+  queries because templates query as they render (rendering.deferred).
+  The executor has DB_POOL_SIZE threads and steps return their
+  connection, so these routes never wait for the pool.
+- Every other route is one call of the unchanged WSGI app on a thread of
+  its own executor (ASGI_THREADS), so password hashes, writes and the
+  assistant's streamed replies can't occupy the hot routes' threads.
+- Responses of a known length are read in the same call; a streamed body
+  (history?stream=1, the assistant) is read a chunk at a time on the
+  ASGI_THREADS executor, and holds its own connection as under WSGI.
+
+Request bodies are spooled to a temporary file past SPOOL_SIZE before
+the app sees them. TRUSTED_PROXIES applies as under WSGI. Needs Python
+3.11 (asyncio tasks started in a given context).
+
+benchmarks/concurrency.py compares the two as concurrent clients grow.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request_started
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import db
+import http_cache
+from app import app
+
+THREADS = 16
+SPOOL_SIZE = 1024 * 1024
+
+ASYNC_ENDPOINTS = ("dashboard", "history", "calendar_view", "view_entry")
+
+
+def async_view(view):
+    """Async version of a sync view, @http_cache.conditional or not."""
+    view = getattr(view, "__wrapped__", view)
+
+    @http_cache.conditional
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        return await db.run(functools.partial(view, *args, **kwargs))
+
+    return wrapper
+
+
+def _environ(scope, body):
+    """The WSGI environ of an ASGI HTTP request."""
+    root = scope.get("root_path", "")
+    path = scope["path"]
+    if root and path.startswith(root):
+        path = path[len(root):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root.encode().decode("latin-1"),
+        "PATH_INFO": path.encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # Spooled in full, so a body without Content-Length (chunked) can be read to the end
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = f"HTTP_{key}"
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call(wsgi_app, environ):
+    """Calls a WSGI app (or response); returns (status, headers, body), reading a body of known length."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    body = wsgi_app(environ, start_response)
+    status, headers = started
+    if environ["REQUEST_METHOD"] == "HEAD" or any(name.lower() == "content-length" for name, _ in headers):
+        chunks = body
+        try:
+            body = list(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+    return int(status[:3]), [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers], body
+
+
+class ASGIApp:
+    def __init__(self, app):
+        app.config.setdefault("ASGI_THREADS", int(os.environ.get("ASGI_THREADS", THREADS)))
+        self.app = app
+        self.views = {endpoint: async_view(app.view_functions[endpoint]) for endpoint in ASYNC_ENDPOINTS}
+        self.threads = ThreadPoolExecutor(app.config["ASGI_THREADS"], thread_name_prefix="eira-asgi")
+        self.fix_environ = None
+        if app.config["TRUSTED_PROXIES"]:
+            # The async views don't go through app.wsgi_app and its ProxyFix
+            self.fix_environ = ProxyFix(lambda environ, start_response: environ, x_for=app.config["TRUSTED_PROXIES"])
+        self._lock = threading.Lock()
+        self._stats = {"async": 0, "wsgi": 0, "in_flight": 0}
+        app.extensions["asgi"] = self
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.threads.shutdown(wait=False)
+                self.app.extensions["db_executor"].shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            environ = _environ(scope, body)
+            view = self._match(environ)
+            with self._lock:
+                self._stats["async" if view else "wsgi"] += 1
+                self._stats["in_flight"] += 1
+            try:
+                if view is None:
+                    loop = asyncio.get_running_loop()
+                    status, headers, chunks = await loop.run_in_executor(self.threads, _call, self.app, environ)
+                else:
+                    status, headers, chunks = await self._dispatch(environ, view)
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await self._send_body(chunks, send)
+            finally:
+                with self._lock:
+                    self._stats["in_flight"] -= 1
+        finally:
+            body.close()
+
+    def _match(self, environ):
+        """The async view for this request, or None to run the WSGI app."""
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:  # 404, 405 and redirects are the WSGI app's to answer
+            return None
+        return self.views.get(endpoint)
+
+    def _step(self, cx, fn, *args):
+        """fn(*args) on the database executor, in the request's context."""
+        executor = self.app.extensions["db_executor"]
+        return asyncio.get_running_loop().run_in_executor(executor, cx.run, db.step, fn, *args)
+
+    def _begin(self, ctx):
+        ctx.push()
+        request_started.send(self.app, _async_wrapper=self.app.ensure_sync)
+        return self.app.preprocess_request()
+
+    async def _dispatch(self, environ, view):
+        """Flask's wsgi_app and full_dispatch_request, awaiting `view`."""
+        app = self.app
+        if self.fix_environ is not None:
+            environ = self.fix_environ(environ, None)
+        cx = contextvars.copy_context()
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            try:
+                try:
+                    rv = await self._step(cx, self._begin, ctx)
+                    if rv is None:
+                        rv = await asyncio.create_task(view(**ctx.request.view_args), context=cx)
+                except Exception as e:
+                    rv = await self._step(cx, app.handle_user_exception, e)
+                response = await self._step(cx, app.finalize_request, rv)
+            except Exception as e:
+                error = e
+                response = await self._step(cx, app.handle_exception, e)
+            return await self._step(cx, _call, response, environ)
+        finally:
+            if error is not None and app.should_ignore_error(error):
+                error = None
+            await self._step(cx, ctx.pop, error)
+
+    async def _send_body(self, chunks, send):
+        if isinstance(chunks, list):
+            for chunk in chunks:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        else:
+            loop = asyncio.get_running_loop()
+            iterator = iter(chunks)
+            # One context for the whole body: stream_with_context pushes
+            # the request context on the first chunk and pops it after the last.
+            cx = contextvars.Context()
+            try:
+                while (chunk := await loop.run_in_executor(self.threads, cx.run, next, iterator, None)) is not None:
+                    if chunk:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                if hasattr(chunks, "close"):
+                    await loop.run_in_executor(self.threads, cx.run, chunks.close)
+        await send({"type": "http.response.body", "body": b""})
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+application = ASGIApp(app)
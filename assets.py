@@ -0,0 +1,330 @@
+"""
+Build-time static asset pipeline, and serving of the variants it builds.
+
+`flask --app app assets build` writes to static/dist/:
+
+- minified CSS, plus .gz and .br siblings of every text asset
+- images scaled down to ASSET_IMAGE_MAX_WIDTH (twice the largest size a
+  template shows them at), recompressed, plus a WebP variant
+- manifest.json, listing each source file's variants with their sizes
+  and the source's content fingerprint
+
+and prints how many bytes each asset saves (`flask --app app assets report`
+prints it again). Pillow and brotli are optional build dependencies
+(`pip install Pillow brotli`): without Pillow images are left alone, and
+without brotli only .gz files are written. static/dist/ is not committed.
+
+At request time, /static/<file> is answered with the smallest variant
+the client accepts: WebP only when Accept lists image/webp, .br or .gz per
+Accept-Encoding, with the matching Vary header. A variant is only used
+while the manifest's fingerprint matches the file on disk, so a stale
+build falls back to the original rather than serving old content.
+"""
+import gzip
+import json
+import mimetypes
+import os
+import re
+import threading
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup, with_appcontext
+
+
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+TEXT_EXTENSIONS = (".css", ".js", ".svg", ".json")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+IMAGE_MAX_WIDTH = 256
+WEBP_QUALITY = 85
+JPEG_QUALITY = 85
+
+
+# Pillow alone takes ~25 ms to import and only `flask assets build` needs
+# it, so neither optional dependency is imported with the app.
+def _brotli():
+    try:
+        import brotli
+    except ImportError:  # optional
+        return None
+    return brotli
+
+
+def _image():
+    try:
+        from PIL import Image
+    except ImportError:  # optional
+        return None
+    return Image
+
+
+assets_cli = AppGroup("assets", help="Build and inspect precompressed static assets.")
+
+
+# --- Build ---
+
+_STRING_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+
+
+def minify_css(text):
+    """
+    Strips comments and insignificant whitespace. Quoted strings are left
+    as they are; a space before ':' is kept since `a :hover` differs from
+    `a:hover`.
+    """
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    parts = _STRING_RE.split(text)
+    for i in range(0, len(parts), 2):  # odd indexes are quoted strings
+        part = re.sub(r"\s+", " ", parts[i])
+        part = re.sub(r"\s*([{};,>])\s*", r"\1", part)
+        part = re.sub(r":\s+", ":", part)
+        parts[i] = part.replace(";}", "}")
+    return "".join(parts).strip()
+
+
+def _variant(dist, name, content_type, encoding=None):
+    return {
+        "file": name,
+        "bytes": os.path.getsize(os.path.join(dist, name)),
+        "type": content_type,
+        "encoding": encoding,
+    }
+
+
+def _precompress(dist, name, content_type):
+    """Writes .gz (and .br when available) siblings of dist/name."""
+    with open(os.path.join(dist, name), "rb") as f:
+        data = f.read()
+    variants = []
+    with open(os.path.join(dist, name + ".gz"), "wb") as f:
+        # mtime=0 keeps rebuilds byte-identical
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    variants.append(_variant(dist, name + ".gz", content_type, "gzip"))
+    brotli = _brotli()
+    if brotli is not None:
+        with open(os.path.join(dist, name + ".br"), "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+        variants.append(_variant(dist, name + ".br", content_type, "br"))
+    return variants
+
+
+def build_text(source, dist, name):
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    root, ext = os.path.splitext(name)
+    if ext == ".css":
+        with open(source, encoding="utf-8") as f:
+            minified = minify_css(f.read())
+        name = f"{root}.min{ext}"
+        with open(os.path.join(dist, name), "w", encoding="utf-8") as f:
+            f.write(minified)
+        variants = [_variant(dist, name, content_type)]
+    else:
+        with open(source, "rb") as src, open(os.path.join(dist, name), "wb") as f:
+            f.write(src.read())
+        variants = []
+    return variants + _precompress(dist, name, content_type)
+
+
+def build_image(source, dist, name, max_width):
+    root, ext = os.path.splitext(name)
+    content_type = mimetypes.guess_type(name)[0]
+    Image = _image()
+    with Image.open(source) as image:
+        image.load()
+    if image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        image = image.resize((max_width, height), Image.LANCZOS)
+
+    variants = []
+    same_format = f"{root}.min{ext}"
+    if content_type == "image/png":
+        image.save(os.path.join(dist, same_format), "PNG", optimize=True)
+    else:
+        image.convert("RGB").save(
+            os.path.join(dist, same_format), "JPEG",
+            quality=JPEG_QUALITY, optimize=True, progressive=True,
+        )
+    variants.append(_variant(dist, same_format, content_type))
+    image.save(os.path.join(dist, f"{root}.webp"), "WEBP", quality=WEBP_QUALITY, method=6)
+    variants.append(_variant(dist, f"{root}.webp", "image/webp"))
+    return variants
+
+
+def build(static_folder, fingerprints, max_width=IMAGE_MAX_WIDTH):
+    """Builds every asset under static_folder and writes the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    has_pillow = _image() is not None
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            ext = os.path.splitext(name)[1].lower()
+            if ext in TEXT_EXTENSIONS:
+                builder = build_text
+                args = ()
+            elif ext in IMAGE_EXTENSIONS and has_pillow:
+                builder = build_image
+                args = (max_width,)
+            else:
+                continue
+            os.makedirs(os.path.dirname(os.path.join(dist, name)), exist_ok=True)
+            manifest[name] = {
+                "fingerprint": fingerprints.get(name),
+                "bytes": os.path.getsize(source),
+                "type": mimetypes.guess_type(name)[0],
+                "variants": builder(source, dist, name, *args),
+            }
+
+    with open(os.path.join(dist, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def report_lines(manifest):
+    total_before = total_after = 0
+    lines = [f"{'asset':<36} {'original':>10} {'best':>10} {'saved':>7}"]
+    for name, entry in sorted(manifest.items()):
+        best = min([entry["bytes"]] + [variant["bytes"] for variant in entry["variants"]])
+        total_before += entry["bytes"]
+        total_after += best
+        lines.append(f"{name:<36} {entry['bytes']:>10,} {best:>10,} {_saved(entry['bytes'], best):>7}")
+        for variant in entry["variants"]:
+            label = variant["encoding"] or variant["type"]
+            lines.append(
+                f"  {variant['file']:<34} {'':>10} {variant['bytes']:>10,} "
+                f"{_saved(entry['bytes'], variant['bytes']):>7}  {label}"
+            )
+    lines.append(f"{'total (best per asset)':<36} {total_before:>10,} {total_after:>10,} "
+                 f"{_saved(total_before, total_after):>7}")
+    return lines
+
+
+def _saved(before, after):
+    return f"{(1 - after / before) * 100:.1f}%" if before else "-"
+
+
+@assets_cli.command("build")
+@click.option("--max-width", type=int, default=None, help="Maximum image width in pixels.")
+@with_appcontext
+def build_command(max_width):
+    """Minify, resize and precompress static assets into static/dist/."""
+    if _image() is None:
+        click.echo("Pillow is not installed; skipping images.", err=True)
+    if _brotli() is None:
+        click.echo("brotli is not installed; writing .gz only.", err=True)
+    manifest = build(
+        current_app.static_folder,
+        current_app.extensions["http_cache"]["static"],
+        max_width or current_app.config["ASSET_IMAGE_MAX_WIDTH"],
+    )
+    current_app.extensions["assets"].reload()
+    for line in report_lines(manifest):
+        click.echo(line)
+
+
+@assets_cli.command("report")
+@with_appcontext
+def report_command():
+    """Print the byte savings of the last build."""
+    manifest = current_app.extensions["assets"].load()
+    if not manifest:
+        raise click.ClickException("No build found; run `flask assets build` first.")
+    for line in report_lines(manifest):
+        click.echo(line)
+
+
+# --- Serving ---
+
+class AssetManifest:
+    """The build manifest, re-read whenever the file changes."""
+
+    def __init__(self, dist):
+        self.dist = dist
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._manifest = {}
+
+    def load(self):
+        try:
+            mtime = os.stat(os.path.join(self.dist, MANIFEST)).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            with self._lock:
+                with open(os.path.join(self.dist, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+                self._mtime = mtime
+        return self._manifest
+
+    def reload(self):
+        self._mtime = None
+        return self.load()
+
+
+def _accepts_webp():
+    # Browsers that send only */* may not decode WebP, so require it by name.
+    return any(value == "image/webp" for value in request.accept_mimetypes.values())
+
+
+def choose_variant(entry):
+    """The smallest variant this request accepts, or None for the original."""
+    best = None
+    best_bytes = entry["bytes"]
+    for variant in entry["variants"]:
+        if variant["encoding"] and not request.accept_encodings[variant["encoding"]]:
+            continue
+        if variant["type"] != entry["type"] and not (variant["type"] == "image/webp" and _accepts_webp()):
+            continue
+        if variant["bytes"] < best_bytes:
+            best, best_bytes = variant, variant["bytes"]
+    return best
+
+
+def _current_entry():
+    if request.endpoint != "static":
+        return None
+    filename = (request.view_args or {}).get("filename")
+    entry = current_app.extensions["assets"].load().get(filename)
+    if entry is None:
+        return None
+    if entry["fingerprint"] != current_app.extensions["http_cache"]["static"].get(filename):
+        return None  # the source changed since the last build
+    return entry
+
+
+def _serve_variant():
+    entry = _current_entry()
+    if entry is None:
+        return None
+    variant = choose_variant(entry)
+    if variant is None:
+        return None
+    response = send_from_directory(
+        current_app.extensions["assets"].dist, variant["file"], mimetype=variant["type"]
+    )
+    if variant["encoding"]:
+        response.content_encoding = variant["encoding"]
+    return response
+
+
+def _add_vary(response):
+    entry = _current_entry()
+    if entry is None:
+        return response
+    if any(variant["encoding"] for variant in entry["variants"]):
+        response.vary.add("Accept-Encoding")
+    if any(variant["type"] != entry["type"] for variant in entry["variants"]):
+        response.vary.add("Accept")
+    return response
+
+
+def init_app(app):
+    app.config.setdefault("ASSET_IMAGE_MAX_WIDTH", int(os.environ.get("ASSET_IMAGE_MAX_WIDTH", IMAGE_MAX_WIDTH)))
+    app.extensions["assets"] = AssetManifest(os.path.join(app.static_folder, DIST_DIR))
+    app.cli.add_command(assets_cli)
+    app.before_request(_serve_variant)
+    app.after_request(_add_vary)
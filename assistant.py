@@ -0,0 +1,394 @@
+"""
+Server-side replies for the AI assistant page.
+
+POST /api/assistant with {"message": "..."} answers as server-sent
+events: one `token` event per chunk of text as the backend produces it,
+then a `done` event listing the resources the reply mentions (or an
+`error` event).
+
+Replies are grounded in a small context built from the user's last
+ASSISTANT_CONTEXT_DAYS days of JournalDaily (average mood and sleep and
+whether mood is trending up or down, rounded to halves) and resources
+picked from the recommendation index for the message's topic, or for
+the user's mood and sleep bands when no topic matches. The context never
+contains journal text.
+
+A backend is an object with a `name` and a `generate(prompt, context)`
+method yielding chunks of text. ASSISTANT_BACKEND is "local", a
+deterministic rule-based stand-in (ASSISTANT_LOCAL_DELAY seconds per
+word imitates a slow model), or "package.module:factory", a callable
+taking the app and returning a backend. Generation runs on a thread pool
+of ASSISTANT_WORKERS; at most ASSISTANT_MAX_PENDING replies may be
+running or queued per worker, beyond that callers get AssistantBusy
+(503) at once. A client that disconnects stops its generation at the
+next chunk.
+
+Under WSGI the request thread still relays every chunk from a queue
+until the reply ends, so a reply holds a gthread thread for as long as
+it generates. Keep ASSISTANT_MAX_PENDING (default 2) below the threads
+per gunicorn worker so slow replies can't take all of them, and a reply
+that isn't finished after ASSISTANT_MAX_DURATION seconds ends with an
+`error` event. Under asgi.py the relay runs on its own executor and the
+limit can be raised.
+
+Finished replies are kept in an LRU keyed by backend, normalized message
+and context. The context holds no personal text, so two users with the
+same rounded numbers asking the same thing share a reply; a cached
+reply is sent in one token event without using the pool.
+"""
+import hashlib
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from flask import Response, current_app
+
+import recommendations
+from db import get_db
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_DAYS = 14
+RESOURCES_PER_REPLY = 2
+MAX_MESSAGE_LENGTH = 1000
+
+# topic: (keywords, resource categories), checked in order
+TOPICS = {
+    "crisis": (("suicid", "kill myself", "end my life", "self harm", "self-harm", "hurt myself"),
+               ("crisis_helpline",)),
+    "stress": (("stress", "overwhelm"), ("stress_management", "relaxation_techniques")),
+    "sleep": (("sleep", "tired", "insomnia"), ("sleep_hygiene", "relaxation_techniques")),
+    "motivation": (("motivat", "lazy", "procrastin"), ("motivation", "energy_boosting")),
+    "down": (("sad", "down", "depress"), ("depression_support", "positive_psychology")),
+    "anxious": (("anx", "worry", "panic"), ("relaxation_techniques", "stress_management")),
+}
+
+
+class AssistantBusy(Exception):
+    """Raised when this worker already has ASSISTANT_MAX_PENDING replies in flight."""
+
+    status_code = 503
+
+
+def normalize_message(message):
+    """Lower-cased words only, so trivially different messages share a cache entry."""
+    return " ".join(re.sub(r"[^\w\s']", " ", message.lower()).split())
+
+
+def detect_topic(message):
+    text = message.lower()
+    for topic, (keywords, _) in TOPICS.items():
+        if any(keyword in text for keyword in keywords):
+            return topic
+    return None
+
+
+def _half(value):
+    return round(value * 2) / 2
+
+
+def load_context(conn, username, message, index, days=CONTEXT_DAYS):
+    """The grounding for a reply: recent mood and sleep, topic and resources."""
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+    rows = conn.execute(
+        """
+        SELECT mood_count, mood_sum, sleep_count, sleep_sum
+        FROM JournalDaily
+        WHERE user_username = ? AND day >= ?
+        ORDER BY day
+        """,
+        (username, since),
+    ).fetchall()
+    moods = [row["mood_sum"] / row["mood_count"] for row in rows if row["mood_count"]]
+    sleep_count = sum(row["sleep_count"] for row in rows)
+    context = {
+        "days": len(rows),
+        "mood_avg": _half(sum(moods) / len(moods)) if moods else None,
+        "sleep_avg": _half(sum(row["sleep_sum"] for row in rows) / sleep_count) if sleep_count else None,
+        "trend": None,
+        "topic": detect_topic(message),
+    }
+    if len(moods) >= 4:
+        half = len(moods) // 2
+        change = sum(moods[half:]) / (len(moods) - half) - sum(moods[:half]) / half
+        context["trend"] = "up" if change >= 1 else "down" if change <= -1 else "steady"
+
+    if context["topic"]:
+        categories = TOPICS[context["topic"]][1]
+    else:
+        mood = recommendations.mood_band(context["mood_avg"] if context["mood_avg"] is not None else 6)
+        sleep = recommendations.sleep_band(context["sleep_avg"] if context["sleep_avg"] is not None else 8)
+        categories = recommendations.MOOD_CATEGORIES[mood] + recommendations.SLEEP_CATEGORIES[sleep]
+    resources = []
+    for category in categories:
+        for resource in index.by_category.get(category, ()):
+            if len(resources) < RESOURCES_PER_REPLY and resource not in resources:
+                resources.append(resource)
+    context["resources"] = [{"title": r["title"], "url": r["url"]} for r in resources]
+    return context
+
+
+class LocalBackend:
+    """Deterministic rule-based replies, streamed word by word."""
+
+    name = "local"
+
+    OPENERS = {
+        "crisis": "I'm really glad you told me. You don't have to face this alone, and talking "
+                  "to someone right now can help. If you are in danger, please call or text 988.",
+        "stress": "Stress can feel overwhelming, but you're stronger than it feels right now. "
+                  "Try breathing in for 4 seconds, holding for 7 and breathing out for 8.",
+        "sleep": "Sleep struggles make everything harder. Writing down tomorrow's tasks before "
+                 "bed tells your brain they're handled.",
+        "motivation": "Momentum builds from tiny wins. What's the smallest possible version of "
+                      "your next task? Make it easy, then do it.",
+        "down": "It's brave to notice when you're down. What usually brings you even a tiny "
+                "bit of comfort?",
+        "anxious": "You're safe right now. Try naming three things you can see, hear and feel "
+                   "in this moment.",
+        None: "Thanks for sharing - putting feelings into words is powerful.",
+    }
+    TRENDS = {
+        "up": "and it has been improving",
+        "down": "and it has dipped recently",
+        "steady": "and it has been fairly steady",
+    }
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def compose(self, prompt, context):
+        parts = [self.OPENERS[context["topic"]]]
+        if context["mood_avg"] is not None:
+            mood = f"Over your last {context['days']} check-ins your mood averaged about {context['mood_avg']:g}/10"
+            if context["trend"]:
+                mood += f" {self.TRENDS[context['trend']]}"
+            parts.append(mood + ".")
+        if context["sleep_avg"] is not None:
+            sleep = f"You've been sleeping about {context['sleep_avg']:g} hours a night"
+            if context["sleep_avg"] < 6:
+                sleep += ", and more rest could make the hard days easier"
+            parts.append(sleep + ".")
+        if context["resources"]:
+            titles = " and ".join(resource["title"] for resource in context["resources"])
+            parts.append(f"You might find these helpful: {titles}.")
+        return " ".join(parts)
+
+    def generate(self, prompt, context):
+        for word in re.findall(r"\S+\s*", self.compose(prompt, context)):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word
+
+
+def load_backend(app, spec):
+    if spec == "local":
+        return LocalBackend(app.config["ASSISTANT_LOCAL_DELAY"])
+    module, _, factory = spec.partition(":")
+    if not factory:
+        raise ValueError(f"ASSISTANT_BACKEND must be 'local' or 'module:factory', not {spec!r}")
+    return getattr(importlib.import_module(module), factory)(app)
+
+
+class ReplyCache:
+    """Thread-safe LRU of finished replies."""
+
+    def __init__(self, max_size=512, ttl=600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_DONE = object()
+
+
+class Assistant:
+    def __init__(self, backend, cache, workers=4, max_pending=2, timeout=30.0, max_duration=60.0):
+        self.backend = backend
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_duration = max_duration
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._pending = 0
+        self.replies = 0
+        self.failures = 0
+        self.first_chunk_ms_total = 0.0
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="eira-assistant")
+                    self._pid = os.getpid()
+        return self._executor
+
+    def cache_key(self, message, context):
+        return hashlib.sha256(
+            json.dumps([self.backend.name, normalize_message(message), context], sort_keys=True).encode()
+        ).hexdigest()
+
+    def _generate(self, message, context, key, chunks, cancelled):
+        try:
+            parts = []
+            for chunk in self.backend.generate(message, context):
+                if cancelled.is_set():
+                    return
+                parts.append(chunk)
+                chunks.put(chunk)
+            self.cache.put(key, "".join(parts))
+            chunks.put(_DONE)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stream(self, message, context):
+        """Returns (cached, iterator of text chunks); the iterator raises on failure."""
+        key = self.cache_key(message, context)
+        reply = self.cache.get(key)
+        if reply is not None:
+            return True, iter((reply,))
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise AssistantBusy("The assistant is busy right now")
+            self._pending += 1
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        try:
+            self._get_executor().submit(self._generate, message, context, key, chunks, cancelled)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return False, self._relay(chunks, cancelled)
+
+    def _relay(self, chunks, cancelled):
+        started = time.perf_counter()
+        deadline = started + self.max_duration
+        first = True
+        try:
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise queue.Empty
+                chunk = chunks.get(timeout=min(self.timeout, remaining))
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if first:
+                    first = False
+                    with self._lock:
+                        self.first_chunk_ms_total += (time.perf_counter() - started) * 1000
+                yield chunk
+            with self._lock:
+                self.replies += 1
+        except GeneratorExit:
+            raise
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            # Also reached when the client disconnects mid-reply.
+            cancelled.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "replies": self.replies,
+                "failures": self.failures,
+                "first_chunk_ms_total": self.first_chunk_ms_total,
+                "cache": self.cache.stats(),
+            }
+
+
+def init_app(app):
+    app.config.setdefault("ASSISTANT_BACKEND", os.environ.get("ASSISTANT_BACKEND", "local"))
+    app.config.setdefault("ASSISTANT_LOCAL_DELAY", float(os.environ.get("ASSISTANT_LOCAL_DELAY", 0)))
+    app.config.setdefault("ASSISTANT_WORKERS", int(os.environ.get("ASSISTANT_WORKERS", 4)))
+    app.config.setdefault("ASSISTANT_MAX_PENDING", int(os.environ.get("ASSISTANT_MAX_PENDING", 2)))
+    app.config.setdefault("ASSISTANT_TIMEOUT", float(os.environ.get("ASSISTANT_TIMEOUT", 30)))
+    app.config.setdefault("ASSISTANT_MAX_DURATION", float(os.environ.get("ASSISTANT_MAX_DURATION", 60)))
+    app.config.setdefault("ASSISTANT_CACHE_SIZE", int(os.environ.get("ASSISTANT_CACHE_SIZE", 512)))
+    app.config.setdefault("ASSISTANT_CACHE_TTL", float(os.environ.get("ASSISTANT_CACHE_TTL", 600)))
+    app.config.setdefault("ASSISTANT_CONTEXT_DAYS", int(os.environ.get("ASSISTANT_CONTEXT_DAYS", CONTEXT_DAYS)))
+    app.extensions["assistant"] = Assistant(
+        load_backend(app, app.config["ASSISTANT_BACKEND"]),
+        ReplyCache(app.config["ASSISTANT_CACHE_SIZE"], app.config["ASSISTANT_CACHE_TTL"]),
+        workers=app.config["ASSISTANT_WORKERS"],
+        max_pending=app.config["ASSISTANT_MAX_PENDING"],
+        timeout=app.config["ASSISTANT_TIMEOUT"],
+        max_duration=app.config["ASSISTANT_MAX_DURATION"],
+    )
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def reply(username, message):
+    """The event-stream response for one message; raises AssistantBusy when saturated."""
+    message = message[:MAX_MESSAGE_LENGTH]
+    index = current_app.extensions["recommendations"].get_index(get_db)
+    context = load_context(get_db(), username, message, index, current_app.config["ASSISTANT_CONTEXT_DAYS"])
+    cached, chunks = current_app.extensions["assistant"].stream(message, context)
+
+    def events():
+        try:
+            for chunk in chunks:
+                yield _event("token", {"text": chunk})
+        except queue.Empty:
+            yield _event("error", {"error": "The assistant took too long to answer."})
+            return
+        except Exception:
+            logger.exception("Assistant backend failed")
+            yield _event("error", {"error": "Sorry, something went wrong."})
+            return
+        yield _event("done", {"cached": cached, "resources": context["resources"]})
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        # Tell nginx not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,227 @@
+"""
+Password hashing off the request threads.
+
+generate_password_hash and check_password_hash are deliberately slow, so
+they run on a small process pool shared by the worker. Two limits stop a
+burst of logins from eating every request thread:
+
+- at most AUTH_MAX_PENDING hashes may be running or queued per worker;
+  beyond that callers get AuthBusy straight away instead of queueing
+- one client IP may have at most AUTH_PER_IP_LIMIT hashes in flight
+
+On a successful login, a hash made with an older method or cost than
+PASSWORD_HASH_METHOD is replaced in the background.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class AuthBusy(Exception):
+    """Raised when the hashing queue for this worker is full."""
+
+    status_code = 503
+
+
+class TooManyAuthRequests(AuthBusy):
+    """Raised when one client already has too many hashes in flight."""
+
+    status_code = 429
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored_hash, password):
+    return check_password_hash(stored_hash, password)
+
+
+def hash_method(stored_hash):
+    """The 'method:params' part of a werkzeug hash, e.g. 'scrypt:32768:8:1'."""
+    return stored_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+    def __init__(self, method="scrypt", workers=2, max_pending=32, per_ip_limit=4,
+                 timeout=30.0, use_processes=True):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_ip_limit = per_ip_limit
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._pending = 0
+        self._per_ip = {}
+        self._method_prefix = None
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = self._new_executor()
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _new_executor(self):
+        if self.use_processes:
+            # Imported here: multiprocessing adds ~7 ms to every cold start.
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Never fork a process that is running request threads.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            return ProcessPoolExecutor(self.workers, mp_context=context)
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="eira-auth")
+
+    def _fall_back_to_threads(self):
+        # Some serverless sandboxes can't start worker processes.
+        logger.warning("Password hashing process pool unavailable, using threads")
+        with self._lock:
+            self.use_processes = False
+            self._executor = self._new_executor()
+            self._pid = os.getpid()
+
+    def _reserve(self, client):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise AuthBusy("Too many sign-in requests right now")
+            if client is not None:
+                if self._per_ip.get(client, 0) >= self.per_ip_limit:
+                    raise TooManyAuthRequests("Too many sign-in requests from this address")
+                self._per_ip[client] = self._per_ip.get(client, 0) + 1
+            self._pending += 1
+
+    def _release(self, client):
+        with self._lock:
+            self._pending -= 1
+            if client is not None:
+                remaining = self._per_ip.get(client, 1) - 1
+                if remaining:
+                    self._per_ip[client] = remaining
+                else:
+                    self._per_ip.pop(client, None)
+
+    def _submit(self, fn, *args):
+        try:
+            return self._get_executor().submit(fn, *args)
+        except (BrokenExecutor, OSError, NotImplementedError):
+            if not self.use_processes:
+                raise
+            self._fall_back_to_threads()
+            return self._executor.submit(fn, *args)
+
+    def _run(self, client, fn, *args):
+        self._reserve(client)
+        try:
+            future = self._submit(fn, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except BrokenExecutor:
+                self._fall_back_to_threads()
+                return self._submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            self._release(client)
+
+    def hash(self, password, client=None):
+        return self._run(client, _hash, password, self.method)
+
+    def verify(self, stored_hash, password, client=None):
+        return self._run(client, _verify, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        if self._method_prefix is None:
+            # Let werkzeug fill in its default parameters for the method once.
+            self._method_prefix = hash_method(self.hash(""))
+        return hash_method(stored_hash) != self._method_prefix
+
+    def rehash_in_background(self, password, on_done):
+        """Hashes with the current method and passes the hash to on_done."""
+        try:
+            self._reserve(None)
+        except AuthBusy:
+            return  # Not urgent; try again on the next login.
+        try:
+            future = self._submit(_hash, password, self.method)
+        except Exception:
+            self._release(None)
+            logger.exception("Could not schedule password rehash")
+            return
+
+        def done(future):
+            self._release(None)
+            if future.exception() is None:
+                on_done(future.result())
+
+        future.add_done_callback(done)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "clients": len(self._per_ip),
+                "processes": self.use_processes,
+            }
+
+
+def init_app(app):
+    app.config.setdefault("PASSWORD_HASH_METHOD", os.environ.get("PASSWORD_HASH_METHOD", "scrypt"))
+    app.config.setdefault("AUTH_WORKERS", int(os.environ.get("AUTH_WORKERS", min(4, os.cpu_count() or 1))))
+    app.config.setdefault("AUTH_MAX_PENDING", int(os.environ.get("AUTH_MAX_PENDING", 32)))
+    app.config.setdefault("AUTH_PER_IP_LIMIT", int(os.environ.get("AUTH_PER_IP_LIMIT", 4)))
+    app.config.setdefault("AUTH_USE_PROCESSES", os.environ.get("AUTH_USE_PROCESSES", "1") == "1")
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["AUTH_WORKERS"],
+        max_pending=app.config["AUTH_MAX_PENDING"],
+        per_ip_limit=app.config["AUTH_PER_IP_LIMIT"],
+        use_processes=app.config["AUTH_USE_PROCESSES"],
+    )
+
+
+def get_hasher():
+    return current_app.extensions["password_hasher"]
+
+
+def hash_password(password, client=None):
+    return get_hasher().hash(password, client)
+
+
+def verify_password(stored_hash, password, client=None):
+    return get_hasher().verify(stored_hash, password, client)
+
+
+def upgrade_hash_if_needed(username, stored_hash, password):
+    """
+    After a successful login, replaces a hash made with an outdated method
+    or cost. The new hash is computed and stored without delaying the login.
+    """
+    hasher = get_hasher()
+    try:
+        if not hasher.needs_rehash(stored_hash):
+            return
+    except AuthBusy:
+        return
+    write_queue = current_app.extensions["db_write_queue"]
+
+    def store(new_hash):
+        # Only replace the hash we verified, in case the password changed since.
+        write_queue.submit(lambda conn: conn.execute(
+            "UPDATE User SET password = ? WHERE username = ? AND password = ?",
+            (new_hash, username, stored_hash),
+        ))
+
+    hasher.rehash_in_background(password, store)
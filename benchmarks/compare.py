@@ -0,0 +1,106 @@
+"""
+Compares two benchmarks/routes.py result files, route by route.
+
+Prints p50/p95/p99 and throughput for the base and head runs with the
+change in percent, and marks a route as a regression when its p50 grew
+by more than --threshold percent and --min-ms, when its throughput dropped
+by more than --threshold percent, or when it has more errors. With --tail
+the p95 is checked the same way. Exits with status 1 when there is a
+regression, for use in CI.
+
+Two runs of the same commit on a small shared machine differ by 10-20%
+per route at the median and by much more at p95, hence the defaults and
+--tail being opt-in; on quiet hardware, with more --requests, tighter
+checks work.
+
+    python benchmarks/compare.py before.json after.json [--threshold 20] [--tail]
+"""
+import argparse
+import json
+import sys
+
+
+def _change(base, head):
+    if base in (None, 0) or head is None:
+        return None
+    return (head - base) / base * 100
+
+
+def _format_change(change):
+    return "" if change is None else f"{change:+.0f}%"
+
+
+def compare(base, head, threshold, min_ms, checked=("p50_ms",)):
+    regressions = []
+    lines = []
+    for mode in sorted(set(base["results"]) & set(head["results"])):
+        lines.append(f"\n{mode}")
+        lines.append(
+            f"  {'route':<20} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'req/s':>20}"
+        )
+        base_routes = base["results"][mode]
+        head_routes = head["results"][mode]
+        for route in base_routes:
+            if route not in head_routes:
+                lines.append(f"  {route:<20} (missing from head)")
+                continue
+            old, new = base_routes[route], head_routes[route]
+            cells = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                cells.append(f"{old[key]:>7.2f}→{new[key]:<7.2f}{_format_change(_change(old[key], new[key])):>5}")
+            rps_change = _change(old["rps"], new["rps"])
+            cells.append(f"{old['rps']:>8.1f}→{new['rps']:<8.1f}{_format_change(rps_change):>5}")
+
+            slower = any(
+                _change(old[key], new[key]) is not None
+                and _change(old[key], new[key]) > threshold
+                and new[key] - old[key] > min_ms
+                for key in checked
+            )
+            less_throughput = rps_change is not None and rps_change < -threshold
+            errors = new["errors"] > old["errors"]
+            flag = "  REGRESSION" if slower or less_throughput or errors else ""
+            if flag:
+                regressions.append(f"{mode}/{route}")
+            lines.append(f"  {route:<20} " + " ".join(cells) + flag)
+        for route in head_routes:
+            if route not in base_routes:
+                lines.append(f"  {route:<20} (new in head)")
+    return lines, regressions
+
+
+def _describe(report):
+    meta = report["meta"]
+    dirty = " (uncommitted changes)" if meta.get("dirty") else ""
+    return f"{meta.get('commit')}{dirty}, {meta.get('started_at')}, Python {meta.get('python')}, SQLite {meta.get('sqlite')}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Percent change that counts as a regression.")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="Ignore latency increases smaller than this.")
+    parser.add_argument("--tail", action="store_true", help="Also flag p95 increases.")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"base: {_describe(base)}")
+    print(f"head: {_describe(head)}")
+    if base["meta"].get("args") != head["meta"].get("args"):
+        print("warning: the runs used different arguments")
+    checked = ("p50_ms", "p95_ms") if args.tail else ("p50_ms",)
+    lines, regressions = compare(base, head, args.threshold, args.min_ms, checked)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
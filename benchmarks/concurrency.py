@@ -0,0 +1,215 @@
+"""
+Concurrency benchmark: the WSGI app against asgi.py, both under gunicorn,
+as the number of concurrent clients grows.
+
+Seeds (or reuses, --database) a database as benchmarks/routes.py does,
+then for each mode starts gunicorn with --workers processes of
+
+- wsgi: app:app on gthread workers, --threads threads each
+- asgi: asgi:application on uvicorn workers
+
+and for each of --levels sends --requests requests over that many
+concurrent keep-alive connections, spread over --routes (the hot read
+routes by default) and over --sessions signed-in users. With --logins N,
+N more connections sign in over and over meanwhile, so the hot routes
+compete with password hashing as they would in production. A request that
+fails to connect, times out or gets a 5xx counts as an error.
+
+Reports throughput and latency percentiles per level, as JSON that
+benchmarks/compare.py can diff (levels are listed as routes, c1, c16, ...):
+
+    python benchmarks/concurrency.py --levels 1 16 64 256 --output concurrency.json
+    python benchmarks/compare.py concurrency.json other.json
+
+The clients run in this process on the same machine: on a small one they
+compete with the server for CPU, so compare the modes with each other
+rather than with routes.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import routes
+from routes import ROOT, ROUTES
+
+HOT_ROUTES = ["dashboard", "history", "calendar_view", "view_entry"]
+TIMEOUT = 30.0
+
+
+def start_server(mode, port, env, workers, threads):
+    if mode == "wsgi":
+        worker = ["-k", "gthread", "--threads", str(threads), "app:app"]
+    else:
+        worker = ["-k", "uvicorn.workers.UvicornWorker", "asgi:application"]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", *worker], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            routes.login(port, "bench0")
+            return server
+        except (OSError, RuntimeError):
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection, reopened after errors."""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, form=None, cookie=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        body = urlencode(form).encode() if form is not None else b""
+        head = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1", f"Content-Length: {len(body)}"]
+        if cookie:
+            head.append(f"Cookie: {cookie}")
+        if form is not None:
+            head.append("Content-Type: application/x-www-form-urlencoded")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        try:
+            return await asyncio.wait_for(self._response(), TIMEOUT)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _response(self):
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while size := int((await self.reader.readline()).split(b";")[0], 16):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        elif status not in (204, 304):
+            await self.reader.read()
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_level(port, sessions, route_names, clients, total, seed):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    sent = 0
+
+    async def client():
+        nonlocal sent, errors
+        conn = Connection(port)
+        while sent < total:
+            i = sent
+            sent += 1
+            user, cookie = sessions[i % len(sessions)]
+            method, path, form = ROUTES[route_names[i % len(route_names)]]
+            ctx = routes._request_context(user, rng)
+            start = time.perf_counter()
+            try:
+                status = await conn.request(method, path(ctx), form(ctx) if form else None, cookie)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                status = 599
+            latencies.append(round((time.perf_counter() - start) * 1000, 3))
+            errors += status >= 500
+        conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return routes.summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def sign_in_loop(port, username, stop):
+    conn = Connection(port)
+    while not stop.is_set():
+        try:
+            await conn.request("POST", "/login", {"username": username, "password": routes.PASSWORD})
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            await asyncio.sleep(0.1)
+    conn.close()
+
+
+async def run_mode(args, port, sessions):
+    results = {}
+    for level in args.levels:
+        stop = asyncio.Event()
+        logins = [asyncio.create_task(sign_in_loop(port, user["username"], stop))
+                  for user, _ in sessions[:args.logins]]
+        await run_level(port, sessions, args.routes, level, args.warmup, args.seed)
+        results[f"c{level}"] = row = await run_level(port, sessions, args.routes, level, args.requests, args.seed)
+        stop.set()
+        await asyncio.gather(*logins)
+        routes._print_row(f"c{level}", row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", nargs="+", choices=("wsgi", "asgi"), default=["wsgi", "asgi"])
+    parser.add_argument("--levels", nargs="+", type=int, default=[1, 4, 16, 64, 256],
+                        help="Concurrent client connections.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--entries", type=float, default=1.5, help="Journal entries per user per day.")
+    parser.add_argument("--sessions", type=int, default=10, help="Users that send requests.")
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES), default=HOT_ROUTES)
+    parser.add_argument("--requests", type=int, default=1000, help="Measured requests per level.")
+    parser.add_argument("--warmup", type=int, default=100, help="Unmeasured requests per level.")
+    parser.add_argument("--logins", type=int, default=0, help="Connections signing in meanwhile.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", help="Keep (and reuse) the seeded database here.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), "bench.db")
+    report = {"meta": routes.metadata(args), "results": {}}
+    if os.path.exists(database):
+        report["seed"] = {"reused": database}
+        print(f"Reusing {database}")
+    else:
+        report["seed"] = routes.seed(database, args.users, args.years, args.entries, args.seed)
+        print("Seeded {journal_rows:,} journal rows for {users} users in {seconds}s".format(**report["seed"]))
+
+    env = dict(os.environ, DATABASE=database, RATELIMIT_ENABLED="0", MAINTENANCE_ENABLED="0")
+    users = routes.contexts(database, args.users, args.sessions)
+    header = f"  {'clients':<20} {'reqs':>6} {'errs':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    for mode in args.modes:
+        port = routes.free_port()
+        server = start_server(mode, port, env, args.workers, args.threads)
+        try:
+            sessions = [(user, routes.login(port, user["username"])) for user in users]
+            shape = f"{args.threads} threads each" if mode == "wsgi" else "asgi.py"
+            print(f"\n{mode} ({args.workers} workers, {shape}; {args.logins} sign-in loops)\n" + header)
+            report["results"][mode] = asyncio.run(run_mode(args, port, sessions))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
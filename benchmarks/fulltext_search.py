@@ -0,0 +1,149 @@
+"""
+Compares full-text search through the JournalSearch FTS5 index with the
+LIKE '%term%' scan it replaces.
+
+Builds a scratch database with N journal rows (2M by default) of generated
+text spread over many users, at the schema before full-text search. It then
+migrates to the latest schema, which builds the index, and times
+search.search_entries() against an equivalent LIKE query for single-word,
+multi-word and prefix searches. The LIKE query returns unranked,
+newest-first matches, so it can stop early on a common word; the FTS5
+query ranks every match the user has.
+
+    python benchmarks/fulltext_search.py [--rows 2000000] [--users 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import search  # noqa: E402
+
+WORDS = (
+    "today felt tired happy anxious calm school work friends family walk run "
+    "sleep dinner music read exam stress weekend morning evening rain sun "
+    "coffee talked laughed cried better worse meeting project game movie "
+    "gym park dog cat homework teacher bus train phone message plans"
+).split()
+RARE_WORDS = ["lighthouse", "marathon", "volcano", "saxophone", "origami"]
+TAGS = ["school", "family", "friends", "exercise", "sleep", "work"]
+
+# name: (query, prefix)
+PROBES = {
+    "one common word": ("friends", False),
+    "one rare word": ("lighthouse", False),
+    "two words": ("exam stress", False),
+    "prefix": ("saxo", True),
+}
+
+LIKE_SQL = """
+    SELECT id, timestamp, title, content
+    FROM Journal
+    WHERE user_username = ? AND {conditions}
+    ORDER BY Journal.timestamp DESC
+    LIMIT ?
+"""
+
+
+def seed(conn, rows, users):
+    start = datetime(2020, 1, 1)
+    span = (datetime(2026, 1, 1) - start).total_seconds()
+    rng = random.Random(42)
+
+    def sentence(length):
+        words = rng.choices(WORDS, k=length)
+        if rng.random() < 0.01:
+            words[rng.randrange(length)] = rng.choice(RARE_WORDS)
+        return " ".join(words)
+
+    def generate():
+        for i in range(rows):
+            ts = start + timedelta(seconds=rng.random() * span)
+            yield (
+                f"user{i % users}",
+                sentence(3).capitalize(),
+                sentence(rng.randint(20, 80)),
+                ts.strftime("%Y-%m-%d %H:%M:%S"),
+                ",".join(rng.sample(TAGS, rng.randint(0, 2))),
+            )
+
+    conn.executemany(
+        "INSERT INTO User (username, password) VALUES (?, '')",
+        ((f"user{i}",) for i in range(users)),
+    )
+    conn.executemany(
+        """
+        INSERT INTO Journal (user_username, title, content, timestamp, tags)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        generate(),
+    )
+    conn.commit()
+
+
+def like_search(conn, username, query, limit):
+    terms = query.split()
+    conditions = " AND ".join(
+        "(title LIKE ? OR content LIKE ? OR tags LIKE ?)" for _ in terms
+    )
+    params = [username]
+    for term in terms:
+        params.extend([f"%{term}%"] * 3)
+    return conn.execute(LIKE_SQL.format(conditions=conditions), (*params, limit)).fetchall()
+
+
+def timed(fn, probes):
+    start = time.perf_counter()
+    for args in probes:
+        fn(*args)
+    return (time.perf_counter() - start) / len(probes) * 1000
+
+
+def run(conn, users, repeat):
+    rng = random.Random(7)
+    usernames = [f"user{rng.randrange(users)}" for _ in range(repeat)]
+    print(f"  {'query':<18} {'LIKE':>12} {'FTS5':>12}")
+    for name, (query, prefix) in PROBES.items():
+        like_ms = timed(
+            lambda user: like_search(conn, user, query, search.PER_PAGE + 1),
+            [(user,) for user in usernames],
+        )
+        fts_ms = timed(
+            lambda user: search.search_entries(conn, user, query, prefix=prefix),
+            [(user,) for user in usernames],
+        )
+        print(f"  {name:<18} {like_ms:9.3f} ms {fts_ms:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.get_db_connection(os.path.join(tmp, "bench.db"))
+        migrations.migrate(conn, target=6)
+        start = time.perf_counter()
+        seed(conn, args.rows, args.users)
+        print(f"Seeded {args.rows:,} rows for {args.users:,} users in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        conn.execute("ANALYZE")
+        print(f"Built the search index in {time.perf_counter() - start:.1f}s\n")
+
+        run(conn, args.users, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
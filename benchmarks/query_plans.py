@@ -0,0 +1,140 @@
+"""
+Shows how the Journal indexes change the query plans of the per-user pages.
+
+Builds a scratch database with N journal rows (1M by default) spread over
+many users, runs the dashboard, check-in, history and calendar queries at
+schema version 2 (no indexes), then migrates to the latest schema and runs
+them again.
+
+    python benchmarks/query_plans.py [--rows 1000000] [--users 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import queries  # noqa: E402
+
+QUERIES = {
+    "dashboard recent moods": (
+        """
+        SELECT strftime('%Y-%m-%d', timestamp) AS entry_date, mood_rating
+        FROM Journal WHERE user_username = ?
+        ORDER BY timestamp DESC LIMIT 10
+        """,
+        lambda user, day: (user,),
+    ),
+    "today's check-in": (
+        "SELECT id FROM Journal WHERE user_username = ? AND timestamp = ?",
+        lambda user, day: (user, queries.checkin_timestamp(day)),
+    ),
+    "history page": (
+        """
+        SELECT id, title, timestamp, mood, mood_rating
+        FROM Journal WHERE user_username = ?
+        ORDER BY timestamp DESC
+        """,
+        lambda user, day: (user,),
+    ),
+    "calendar month": (
+        """
+        SELECT DISTINCT substr(timestamp, 1, 10) AS entry_date
+        FROM Journal WHERE user_username = ? AND timestamp >= ? AND timestamp < ?
+        """,
+        lambda user, day: (user, *queries.month_range(day.year, day.month)),
+    ),
+    "history day filter": (
+        """
+        SELECT id, title, timestamp, mood, mood_rating
+        FROM Journal WHERE user_username = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp DESC
+        """,
+        lambda user, day: (user, *queries.day_range(day)),
+    ),
+}
+
+
+def seed(conn, rows, users):
+    start = datetime(2020, 1, 1)
+    span = (datetime(2026, 1, 1) - start).total_seconds()
+    rng = random.Random(42)
+
+    def generate():
+        for i in range(rows):
+            ts = start + timedelta(seconds=rng.random() * span)
+            yield (
+                f"user{i % users}",
+                "Daily check-in",
+                "",
+                ts.strftime("%Y-%m-%d %H:%M:%S"),
+                rng.randint(3, 10),
+                rng.randint(1, 10),
+            )
+
+    conn.executemany(
+        "INSERT INTO User (username, password) VALUES (?, '')",
+        ((f"user{i}",) for i in range(users)),
+    )
+    conn.executemany(
+        """
+        INSERT INTO Journal (user_username, title, content, timestamp, sleep_hours, mood_rating)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        generate(),
+    )
+    conn.commit()
+
+
+def run(conn, users, repeat):
+    rng = random.Random(7)
+    probes = [
+        (f"user{rng.randrange(users)}", datetime(2020, 1, 1) + timedelta(days=rng.randrange(2000)))
+        for _ in range(repeat)
+    ]
+    for name, (sql, params) in QUERIES.items():
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params(*probes[0])).fetchall()
+        start = time.perf_counter()
+        for user, day in probes:
+            conn.execute(sql, params(user, day)).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        print(f"  {name:<24} {elapsed:9.3f} ms/query")
+        for row in plan:
+            print(f"      {row[3]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.get_db_connection(os.path.join(tmp, "bench.db"))
+        migrations.migrate(conn, target=2)
+        start = time.perf_counter()
+        seed(conn, args.rows, args.users)
+        print(f"Seeded {args.rows:,} rows for {args.users:,} users in {time.perf_counter() - start:.1f}s")
+
+        print(f"\nBefore (schema version {migrations.current_version(conn)}):")
+        run(conn, args.users, args.repeat)
+
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        conn.execute("ANALYZE")
+        print(f"\nMigrated in {time.perf_counter() - start:.1f}s")
+
+        print(f"\nAfter (schema version {migrations.current_version(conn)}):")
+        run(conn, args.users, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Load test: legitimate login latency while an abusive client hammers /login.
+
+Starts gunicorn on a scratch database for each of three scenarios and runs
+it for --duration seconds:
+
+- baseline: legitimate logins only
+- attack, no limiter: plus --attackers processes posting wrong passwords
+  for one account at --attack-rate requests/second in total, with the
+  rate limiter disabled
+- attack, limiter on: the same attack with the rate limiter enabled
+
+The server trusts one proxy (TRUSTED_PROXIES=1) so clients can be told
+apart by X-Forwarded-For: legitimate logins come from changing addresses
+(many real users), the attack from --attacker-ips addresses. Prints
+p50/p95/p99 latency of the legitimate logins and what the attackers got.
+
+The attack is paced rather than unbounded so that, on a small machine,
+the attack clients don't take the CPU the server needs; a real attacker's
+requests cost us nothing until they arrive.
+
+    python benchmarks/ratelimit_load.py [--duration 10] [--attack-rate 50] [--storage sqlite]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PASSWORD = "correct horse battery"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def post(conn, path, form, address):
+    conn.request(
+        "POST", path, body=urlencode(form),
+        headers={"Content-Type": "application/x-www-form-urlencoded", "X-Forwarded-For": address},
+    )
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, env, workers, threads):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread",
+         "--threads", str(threads), "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def attacker(port, address, rate, stop, results):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    statuses = Counter()
+    next_at = time.monotonic()
+    while not stop.is_set():
+        next_at += 1 / rate
+        time.sleep(max(0.0, next_at - time.monotonic()))
+        try:
+            statuses[post(conn, "/login", {"username": "victim", "password": "guess"}, address)] += 1
+        except (OSError, http.client.HTTPException):
+            statuses["error"] += 1
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    results.put(statuses)
+
+
+def run(args, attackers, limiter_enabled):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE=os.path.join(tempfile.mkdtemp(), "bench.db"),
+        TRUSTED_PROXIES="1",
+        RATELIMIT_ENABLED="1" if limiter_enabled else "0",
+        RATELIMIT_STORAGE=args.storage,
+    )
+    server = start_server(port, env, args.workers, args.threads)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        for username in ("reader", "victim"):
+            post(conn, "/signup", {"username": username, "password": PASSWORD}, "192.0.2.1")
+
+        context = multiprocessing.get_context("spawn")
+        stop = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=attacker,
+                args=(port, f"203.0.113.{i % args.attacker_ips + 1}", args.attack_rate / attackers, stop, results),
+            )
+            for i in range(attackers)
+        ]
+        for process in processes:
+            process.start()
+
+        latencies = []
+        statuses = Counter()
+        deadline = time.monotonic() + args.duration
+        i = 0
+        while time.monotonic() < deadline:
+            i += 1
+            start = time.perf_counter()
+            statuses[post(conn, "/login", {"username": "reader", "password": PASSWORD},
+                          f"198.51.100.{i % 250 + 1}")] += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(args.interval)
+
+        stop.set()
+        attack = Counter()
+        for _ in processes:
+            attack.update(results.get())
+        for process in processes:
+            process.join()
+        return latencies, statuses, attack
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--attackers", type=int, default=4)
+    parser.add_argument("--attack-rate", type=float, default=50.0, help="Attack requests per second, in total.")
+    parser.add_argument("--attacker-ips", type=int, default=1)
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--interval", type=float, default=0.05, help="Pause between legitimate logins.")
+    args = parser.parse_args()
+
+    scenarios = [
+        ("baseline", 0, True),
+        ("attack, no limiter", args.attackers, False),
+        ("attack, limiter on", args.attackers, True),
+    ]
+    print(f"{'scenario':<20} {'logins':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  legit / attacker responses")
+    for name, attackers, enabled in scenarios:
+        latencies, legit, attack = run(args, attackers, enabled)
+        print(
+            f"{name:<20} {len(latencies):>6} {percentile(latencies, 50):>8.1f} "
+            f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}  "
+            f"{dict(legit)} / {dict(attack)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Repeatable per-route benchmark: latency percentiles and throughput for
+the main pages, as JSON that benchmarks/compare.py can diff.
+
+Seeds a database with --users users, each with about --entries journal
+entries per day over the last --years years (a daily check-in plus extra
+entries with text and tags, from a fixed random seed), through the real
+schema so every trigger-maintained table is populated. Then, for each
+route in turn:
+
+- client: drives the app in-process through Flask's test client, one
+  request at a time, so the numbers are the app's own cost
+- gunicorn: starts gunicorn (--workers x --threads) and drives it from
+  --concurrency client processes over HTTP
+
+and reports requests, errors, throughput and mean/p50/p95/p99/max latency
+per route. --output writes the results together with the commit, Python
+and SQLite versions and the arguments, so two runs can be compared:
+
+    python benchmarks/routes.py --mode both --output before.json
+    (change something)
+    python benchmarks/routes.py --mode both --output after.json
+    python benchmarks/compare.py before.json after.json
+
+--database keeps the seeded database at that path and reuses it on the
+next run; by default a scratch file is seeded each time. The write routes
+(daily_checkin, journal_entry) add rows, so a reused database grows from
+run to run: compare runs seeded the same way. Rate limiting and background
+maintenance are off while measuring.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+PASSWORD = "correct horse battery"
+WORDS = (
+    "today felt tired happy anxious calm school work friends family walk run "
+    "sleep dinner music read exam stress weekend morning evening rain sun "
+    "coffee talked laughed cried better worse meeting project game movie "
+    "gym park dog cat homework teacher bus train phone message plans"
+).split()
+TAGS = ["school", "family", "friends", "exercise", "sleep", "work", "music", "gaming"]
+MOODS = ["happy", "sad", "anxious", "calm", "tired", "excited"]
+
+
+# name: (method, path, form) where path and form are built from a context
+# with the user's entry ids and today's date
+ROUTES = {
+    "dashboard": ("GET", lambda ctx: "/dashboard", None),
+    "history": ("GET", lambda ctx: "/history", None),
+    "history_stream": ("GET", lambda ctx: "/history?stream=1", None),  # every entry, not one page
+    "history_date": ("GET", lambda ctx: f"/history?date={ctx['day']}", None),
+    "history_tag": ("GET", lambda ctx: f"/history?tag={ctx['tag']}", None),
+    "calendar_view": ("GET", lambda ctx: "/calendar", None),
+    "calendar_api": ("GET", lambda ctx: f"/api/calendar/{ctx['year']}", None),
+    "mood_analytics": ("GET", lambda ctx: "/api/analytics/mood?bucket=week", None),
+    "search": ("GET", lambda ctx: f"/search?q={ctx['word']}", None),
+    "search_api": ("GET", lambda ctx: f"/api/search?q={ctx['word'][:3]}&prefix=1", None),
+    "view_entry": ("GET", lambda ctx: f"/entry/{ctx['entry_id']}", None),
+    "daily_checkin_form": ("GET", lambda ctx: "/daily-checkin", None),
+    "daily_checkin": ("POST", lambda ctx: "/daily-checkin", lambda ctx: {
+        "mood_rating": str(ctx["rng"].randint(1, 10)),
+        "sleep_hours": str(ctx["rng"].randint(4, 10)),
+        "content": "benchmark check-in",
+    }),
+    "journal_entry": ("POST", lambda ctx: "/journal_entry", lambda ctx: {
+        "title": "Benchmark entry",
+        "content": " ".join(ctx["rng"].choices(WORDS, k=40)),
+        "mood": ctx["rng"].choice(MOODS),
+        "tags": ",".join(ctx["rng"].sample(TAGS, 2)),
+    }),
+    # Dominated by the password hash; not in the default set
+    "login": ("POST", lambda ctx: "/login", lambda ctx: {"username": ctx["username"], "password": PASSWORD}),
+}
+DEFAULT_ROUTES = [name for name in ROUTES if name != "login"]
+
+
+# --- Seeding ---
+
+def seed(database, users, years, entries_per_day, rng_seed):
+    import db
+    import migrations
+    from werkzeug.security import generate_password_hash
+
+    conn = db.get_db_connection(database)
+    migrations.migrate(conn)
+    rng = random.Random(rng_seed)
+    password_hash = generate_password_hash(PASSWORD)  # one hash shared by every user
+    today = date.today()
+    first = today - timedelta(days=int(years * 365))
+
+    def journal_rows():
+        for u in range(users):
+            username = f"bench{u}"
+            day = first
+            while day < today:
+                count = int(entries_per_day) + (rng.random() < entries_per_day % 1)
+                for n in range(count):
+                    mood_rating = rng.randint(1, 10)
+                    if n == 0:  # the day's check-in, stored at midnight
+                        yield (username, "Daily check-in", "benchmark check-in",
+                               f"{day} 00:00:00", rng.randint(4, 10), None, mood_rating, None)
+                    else:
+                        at = datetime(day.year, day.month, day.day, rng.randint(7, 22), rng.randint(0, 59), n)
+                        yield (username, " ".join(rng.choices(WORDS, k=3)).capitalize(),
+                               " ".join(rng.choices(WORDS, k=rng.randint(20, 80))),
+                               at.strftime("%Y-%m-%d %H:%M:%S"), None, rng.choice(MOODS),
+                               mood_rating, ",".join(rng.sample(TAGS, rng.randint(0, 3))) or None)
+                day += timedelta(days=1)
+
+    start = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO User (username, password) VALUES (?, ?)",
+        ((f"bench{u}", password_hash) for u in range(users)),
+    )
+    conn.executemany(
+        """
+        INSERT INTO Journal (user_username, title, content, timestamp, sleep_hours, mood, mood_rating, tags)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        journal_rows(),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    rows = conn.execute("SELECT count(*) FROM Journal").fetchone()[0]
+    conn.close()
+    return {"users": users, "years": years, "entries_per_day": entries_per_day,
+            "journal_rows": rows, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def contexts(database, users, count):
+    """Per-user request context for the first `count` users."""
+    conn = sqlite3.connect(database)
+    result = []
+    for u in range(min(users, count)):
+        username = f"bench{u}"
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM Journal WHERE user_username = ? ORDER BY timestamp DESC LIMIT 50", (username,)
+        )]
+        days = [row[0] for row in conn.execute(
+            "SELECT day FROM JournalDaily WHERE user_username = ? ORDER BY day DESC LIMIT 50", (username,)
+        )]
+        result.append({"username": username, "entry_ids": ids, "days": days})
+    conn.close()
+    return result
+
+
+def _request_context(user, rng):
+    return {
+        "username": user["username"],
+        "entry_id": rng.choice(user["entry_ids"]),
+        "day": rng.choice(user["days"]),
+        "year": date.today().year,
+        "tag": rng.choice(TAGS),
+        "word": rng.choice(WORDS),
+        "rng": rng,
+    }
+
+
+# --- Measuring ---
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def summarize(latencies, errors, seconds):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rps": round(len(values) / seconds, 1) if seconds else None,
+        "mean_ms": round(sum(values) / len(values), 3) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None,
+    }
+
+
+def _is_error(status):
+    return status >= 400
+
+
+def run_client(args, users):
+    """Sequential requests through the test client, in this process."""
+    import app as eira
+
+    rng = random.Random(args.seed)
+    clients = []
+    for user in users:
+        client = eira.app.test_client()
+        response = client.post("/login", data={"username": user["username"], "password": PASSWORD})
+        assert response.status_code == 302, f"login failed for {user['username']}"
+        clients.append((client, user))
+
+    results = {}
+    for name in args.routes:
+        method, path, form = ROUTES[name]
+
+        def send(i):
+            client, user = clients[i % len(clients)]
+            ctx = _request_context(user, rng)
+            data = form(ctx) if form else None
+            start = time.perf_counter()
+            response = client.open(path(ctx), method=method, data=data)
+            response.get_data()  # a streamed body is only produced as it is read
+            response.close()
+            elapsed = (time.perf_counter() - start) * 1000
+            return elapsed, response.status_code
+
+        for i in range(args.warmup):
+            send(i)
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for i in range(args.requests):
+            elapsed, status = send(i)
+            latencies.append(round(elapsed, 3))
+            errors += _is_error(status)
+        results[name] = summarize(latencies, errors, time.perf_counter() - start)
+        _print_row(name, results[name])
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port, env, workers, threads):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread",
+         "--threads", str(threads), "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def _http(conn, method, path, form=None, cookie=None):
+    headers = {}
+    body = None
+    if cookie:
+        headers["Cookie"] = cookie
+    if form is not None:
+        body = urlencode(form)
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def login(port, username):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    response = _http(conn, "POST", "/login", {"username": username, "password": PASSWORD})
+    cookie = response.getheader("Set-Cookie", "").split(";", 1)[0]
+    if response.status != 302 or not cookie:
+        raise RuntimeError(f"login failed for {username}: {response.status}")
+    return cookie
+
+
+def http_phase(job):
+    """One client process's share of a route: `count` requests, sequential."""
+    port, name, sessions, count, warmup, seed = job
+    method, path, form = ROUTES[name]
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    latencies, errors = [], 0
+    for i in range(warmup + count):
+        user, cookie = sessions[i % len(sessions)]
+        ctx = _request_context(user, rng)
+        start = time.perf_counter()
+        try:
+            status = _http(conn, method, path(ctx), form(ctx) if form else None, cookie).status
+        except (OSError, http.client.HTTPException):
+            status = 599
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        elapsed = (time.perf_counter() - start) * 1000
+        if i >= warmup:
+            latencies.append(round(elapsed, 3))
+            errors += _is_error(status)
+    return latencies, errors
+
+
+def run_gunicorn(args, users, env):
+    port = free_port()
+    server = start_gunicorn(port, env, args.workers, args.threads)
+    try:
+        sessions = [(user, login(port, user["username"])) for user in users]
+        context = multiprocessing.get_context("spawn")
+        results = {}
+        with context.Pool(args.concurrency) as pool:
+            for name in args.routes:
+                per_client = max(1, args.requests // args.concurrency)
+                jobs = [
+                    (port, name, sessions[i::args.concurrency] or sessions, per_client,
+                     args.warmup // args.concurrency, args.seed + i)
+                    for i in range(args.concurrency)
+                ]
+                start = time.perf_counter()
+                outcomes = pool.map(http_phase, jobs)
+                seconds = time.perf_counter() - start
+                latencies = [value for values, _ in outcomes for value in values]
+                errors = sum(errors for _, errors in outcomes)
+                # Includes the warm-up requests' share of the wall time.
+                results[name] = summarize(latencies, errors, seconds * args.requests / (args.requests + args.warmup))
+                _print_row(name, results[name])
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _print_row(name, row):
+    print(
+        f"  {name:<20} {row['requests']:>6} {row['errors']:>5} {row['rps'] or 0:>9.1f} "
+        f"{row['p50_ms'] or 0:>8.2f} {row['p95_ms'] or 0:>8.2f} {row['p99_ms'] or 0:>8.2f} {row['max_ms'] or 0:>8.2f}"
+    )
+
+
+def _git(*command):
+    try:
+        return subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args):
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=("client", "gunicorn", "both"), default="client")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--entries", type=float, default=1.5, help="Journal entries per user per day.")
+    parser.add_argument("--sessions", type=int, default=10, help="Users that send requests.")
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES), default=DEFAULT_ROUTES)
+    parser.add_argument("--requests", type=int, default=300, help="Measured requests per route.")
+    parser.add_argument("--warmup", type=int, default=30, help="Unmeasured requests per route.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4, help="Client processes in gunicorn mode.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", help="Keep (and reuse) the seeded database here.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), "bench.db")
+    report = {"meta": metadata(args), "results": {}}
+    if os.path.exists(database):
+        report["seed"] = {"reused": database}
+        print(f"Reusing {database}")
+    else:
+        report["seed"] = seed(database, args.users, args.years, args.entries, args.seed)
+        print("Seeded {journal_rows:,} journal rows for {users} users in {seconds}s".format(**report["seed"]))
+
+    env = dict(os.environ, DATABASE=database, RATELIMIT_ENABLED="0", MAINTENANCE_ENABLED="0")
+    os.environ.update(env)  # read by app.py when the client mode imports it
+    users = contexts(database, args.users, args.sessions)
+
+    header = f"  {'route':<20} {'reqs':>6} {'errs':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    if args.mode in ("client", "both"):
+        print("\ntest client (sequential, in-process)\n" + header)
+        report["results"]["client"] = run_client(args, users)
+    if args.mode in ("gunicorn", "both"):
+        print(f"\ngunicorn ({args.workers} workers x {args.threads} threads, "
+              f"{args.concurrency} client processes)\n" + header)
+        report["results"]["gunicorn"] = run_gunicorn(args, users, env)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+SQLite connection handling for Eira.
+
+Routes used to open and close a brand new sqlite3 connection for every
+request. Connections are now kept in a small per-process pool and handed
+out once per Flask app context, so a request reuses one already-configured
+connection no matter how many helpers touch the database.
+
+Coroutines (the ASGI views, see asgi.py) must not block the event loop on
+SQLite: they `await db.run(fn)`, which calls fn on the app's database
+executor, DB_POOL_SIZE threads. The connection fn used goes back to the
+pool when it returns rather than at teardown, so a coroutine never holds
+one across an await and a database thread never waits for one that an
+idle coroutine holds.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_app_context
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the timeout."""
+
+
+def connect(database, setup=None, factory=sqlite3.Connection):
+    """Opens and configures a single connection (row_factory, setup hook)."""
+    conn = sqlite3.connect(database, check_same_thread=False, factory=factory)
+    conn.row_factory = sqlite3.Row
+    if setup is not None:
+        setup(conn)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    - at most `size` connections are open at once; extra callers wait up
+      to `timeout` seconds and then get PoolTimeout
+    - a thread gets back the connection it used last when that one is idle,
+      so gthread workers keep their own warm connection
+    - idle connections older than `health_check_interval` are pinged before
+      being handed out and replaced if they are broken
+    - `setup` runs once per new connection, never per checkout
+    - `factory` is the sqlite3.Connection class new connections are made
+      from (instrumentation swaps in one that times queries)
+    """
+
+    def __init__(self, database, size=5, timeout=10.0,
+                 health_check_interval=30.0, slow_wait=0.1, setup=None,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slow_wait = slow_wait
+        self.setup = setup
+        self.factory = factory
+        self._reset()
+
+    def _reset(self):
+        # Connections must never cross a fork (gunicorn preload), so a child
+        # process starts with an empty pool of its own.
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = {}  # connection -> time it was returned
+        self._open = 0
+        self._local = threading.local()
+        self._stats = {
+            "acquired": 0,
+            "created": 0,
+            "discarded": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    def _take_idle(self):
+        preferred = getattr(self._local, "conn", None)
+        if preferred is not None and preferred in self._idle:
+            return preferred, self._idle.pop(preferred)
+        if self._idle:
+            # Most recently returned first: its page cache is the warmest.
+            conn = next(reversed(self._idle))
+            return conn, self._idle.pop(conn)
+        return None, None
+
+    def acquire(self):
+        """Checks a connection out of the pool, waiting if all are busy."""
+        if os.getpid() != self._pid:
+            self._reset()
+
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                conn, returned_at = self._take_idle()
+                if conn is not None:
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No database connection free after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+                self._cond.wait(remaining)
+        waited = time.perf_counter() - start
+
+        try:
+            if conn is None:
+                conn = self._create()
+            elif time.monotonic() - returned_at > self.health_check_interval:
+                conn = self._check_health(conn)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        self._record_wait(waited)
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        if os.getpid() != self._pid:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle[conn] = time.monotonic()
+            self._cond.notify()
+
+    def _create(self):
+        conn = connect(self.database, self.setup, self.factory)
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _check_health(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except sqlite3.Error:
+            logger.warning("Replacing broken pooled connection to %s", self.database)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._cond:
+                self._stats["discarded"] += 1
+            return self._create()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def _record_wait(self, waited):
+        with self._cond:
+            stats = self._stats
+            stats["acquired"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            if waited >= self.slow_wait:
+                stats["waited"] += 1
+        if waited >= self.slow_wait:
+            logger.warning("Waited %.1f ms for a database connection", waited * 1000)
+
+    def stats(self):
+        """Snapshot of pool usage, including connection wait times in ms."""
+        with self._cond:
+            stats = dict(self._stats)
+            idle = len(self._idle)
+            open_ = self._open
+        acquired = stats["acquired"]
+        return {
+            "size": self.size,
+            "open": open_,
+            "idle": idle,
+            "in_use": open_ - idle,
+            "acquired": acquired,
+            "created": stats["created"],
+            "discarded": stats["discarded"],
+            "slow_waits": stats["waited"],
+            "timeouts": stats["timeouts"],
+            "wait_avg_ms": (stats["wait_total"] / acquired * 1000) if acquired else 0.0,
+            "wait_max_ms": stats["wait_max"] * 1000,
+            "wait_total_ms": stats["wait_total"] * 1000,
+        }
+
+    def close_all(self):
+        """Closes every idle connection (used on shutdown and in scripts)."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+def configure_connection(conn):
+    """Per-connection setup shared by pooled, standalone and writer connections."""
+    conn.row_factory = sqlite3.Row
+    storage.apply_pragmas(conn)
+
+
+def init_app(app):
+    """Creates the app's pool and returns connections at teardown."""
+    app.config.setdefault("DB_POOL_SIZE", int(os.environ.get("DB_POOL_SIZE", 5)))
+    app.config.setdefault("DB_POOL_TIMEOUT", float(os.environ.get("DB_POOL_TIMEOUT", 10)))
+    app.extensions["db_pool"] = ConnectionPool(
+        app.config["DATABASE"],
+        size=app.config["DB_POOL_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+        setup=configure_connection,
+    )
+    pool = app.extensions["db_pool"]
+    # The writer connects on first use, after every init_app has run, so it
+    # picks up a factory set later on (as the pool's own connections do).
+    app.extensions["db_write_queue"] = storage.WriteQueue(
+        lambda: connect(pool.database, configure_connection, pool.factory)
+    )
+    app.extensions["db_executor"] = ThreadPoolExecutor(
+        app.config["DB_POOL_SIZE"], thread_name_prefix="eira-db"
+    )
+    app.teardown_appcontext(close_db)
+
+
+def get_pool(app=None):
+    app = app or current_app
+    return app.extensions["db_pool"]
+
+
+def get_db():
+    """Returns this app context's connection, checking one out on first use."""
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def write(job):
+    """
+    Runs `job(conn)` on the app's writer thread and returns its result once
+    committed. Exceptions raised by the job (e.g. IntegrityError) propagate.
+    """
+    return current_app.extensions["db_write_queue"].run(job)
+
+
+def stream_query(sql, params=(), chunk_size=200):
+    """
+    Returns a generator over the rows of `sql`, fetched `chunk_size` at a
+    time. It checks out its own connection when iteration starts and
+    returns it when the generator finishes or is closed, so it can safely
+    outlive the request's app context (streamed responses).
+    """
+    pool = get_pool()
+
+    def rows():
+        conn = pool.acquire()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield from chunk
+        finally:
+            pool.release(conn)
+
+    return rows()
+
+
+async def run(fn, *args):
+    """Awaits fn(*args) run on the database executor, in a copy of the caller's context."""
+    call = functools.partial(contextvars.copy_context().run, step, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(current_app.extensions["db_executor"], call)
+
+
+def step(fn, *args):
+    """Calls fn(*args), then returns the connection it checked out to the pool."""
+    try:
+        return fn(*args)
+    finally:
+        if has_app_context():  # not after the step that pops the context
+            close_db()
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def get_db_connection(database):
+    """Returns a standalone connection for code running outside a request."""
+    return connect(database, configure_connection)
@@ -0,0 +1,181 @@
+"""
+HTTP caching for per-user pages and static files.
+
+Pages: views wrapped in @conditional get an ETag built from the user's
+UserDataVersion (bumped by triggers on every Journal write, see migration
+9), the URL, today's date and a build id covering the templates and
+static files. A matching If-None-Match is answered with 304 before the
+view runs, so an unchanged page costs one primary-key lookup instead of
+its queries and template. Responses are `private, no-cache`: browsers
+keep them but revalidate every time, and shared caches never store them.
+Only wrap views whose templates don't render flashed messages: a 304
+never consumes a pending flash. Coroutine views (asgi.py) are wrapped the
+same way, with the version read on the database executor.
+
+Static files: static_url() (a Jinja global) adds a content fingerprint,
+?v=<hash>, and requests carrying the current fingerprint are served with
+a one-year immutable Cache-Control. Plain /static URLs keep Flask's
+default revalidation.
+"""
+import hashlib
+import inspect
+import os
+import threading
+from datetime import date
+from functools import wraps
+
+from flask import current_app, request, url_for
+
+import db
+import sessions
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def _digest(*parts):
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=10).hexdigest()
+
+
+def build_id(*folders):
+    """
+    Identifies the deployed templates and static files by name, size and
+    mtime, so a deploy changes every page ETag. Identical across workers.
+    """
+    entries = []
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                entries.append(f"{os.path.join(root, name)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return _digest(*sorted(entries))
+
+
+class StaticFingerprints:
+    """Content hashes of static files, recomputed only when a file changes."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}  # filename -> (mtime_ns, size, fingerprint)
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._hashes.get(filename)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        hasher = hashlib.blake2b(digest_size=6)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                hasher.update(chunk)
+        fingerprint = hasher.hexdigest()
+        with self._lock:
+            self._hashes[filename] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+        return fingerprint
+
+
+def init_app(app):
+    app.config.setdefault("HTTP_CACHE_ENABLED", os.environ.get("HTTP_CACHE_ENABLED", "1") == "1")
+    app.config.setdefault("STATIC_MAX_AGE", int(os.environ.get("STATIC_MAX_AGE", STATIC_MAX_AGE)))
+    app.extensions["http_cache"] = {
+        "build_id": build_id(
+            os.path.join(app.root_path, app.template_folder), app.static_folder
+        ),
+        "static": StaticFingerprints(app.static_folder),
+    }
+    app.jinja_env.globals["static_url"] = static_url
+    app.after_request(_cache_static)
+
+
+def static_url(filename):
+    """URL of a static file with its content fingerprint."""
+    fingerprint = current_app.extensions["http_cache"]["static"].get(filename)
+    if fingerprint is None:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=fingerprint)
+
+
+def _cache_static(response):
+    if request.endpoint != "static" or response.status_code not in (200, 304):
+        return response
+    fingerprint = request.args.get("v")
+    filename = (request.view_args or {}).get("filename")
+    if fingerprint and fingerprint == current_app.extensions["http_cache"]["static"].get(filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["STATIC_MAX_AGE"]
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def data_version(conn, username):
+    row = conn.execute(
+        "SELECT version FROM UserDataVersion WHERE user_username = ?", (username,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def page_etag(username, version):
+    return _digest(
+        current_app.extensions["http_cache"]["build_id"],
+        username,
+        str(version),
+        date.today().isoformat(),
+        request.full_path,
+    )
+
+
+def _applies(user):
+    return request.method == "GET" and user is not None and current_app.config["HTTP_CACHE_ENABLED"]
+
+
+def _validated(response, etag):
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
+
+
+def conditional(view):
+    """Answers GETs for an unchanged page with 304 without running the view."""
+    if inspect.iscoroutinefunction(view):
+        return _conditional_async(view)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = sessions.current_user()
+        if not _applies(user):
+            return view(*args, **kwargs)
+
+        etag = page_etag(user.username, user.data_version)
+        if request.if_none_match.contains(etag):
+            return _validated(current_app.response_class(status=304), etag)
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        return _validated(response, etag)
+
+    return wrapper
+
+
+def _conditional_async(view):
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        user = sessions.current_user()
+        if not _applies(user):
+            return await view(*args, **kwargs)
+
+        # The version is a query, so it is read on the database executor
+        etag = page_etag(user.username, await db.run(lambda: user.data_version))
+        if request.if_none_match.contains(etag):
+            return _validated(current_app.response_class(status=304), etag)
+        response = current_app.make_response(await view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        return _validated(response, etag)
+
+    return wrapper
@@ -0,0 +1,566 @@
+"""
+Opt-in request profiling: where does a request's time go?
+
+With INSTRUMENTATION_ENABLED=1:
+
+- pooled and writer connections are made from InstrumentedConnection,
+  which times every execute and fetch and counts them per statement
+- template rendering is timed through Flask's render signals, and the
+  time request threads spend waiting on the write queue is recorded
+- every response gets a Server-Timing header, e.g.
+  `sql;dur=1.9;desc="6 queries", write;dur=4.2, tpl;dur=3.1, total;dur=11.0`,
+  which browser dev tools show next to the request. A streamed page
+  (/history?stream=1) renders after its headers are sent, so its
+  template time is only in /metrics
+- GET /metrics serves Prometheus text: per-route latency histograms,
+  per-route SQL/template/write time, per-statement totals, and the
+  stats of the pool, write queue, caches, assistant, rate limiter,
+  maintenance, cold start and (under asgi.py) the ASGI server
+- a sampling cProfile hook profiles PROFILE_SAMPLE_RATE of requests
+  (one at a time) into PROFILE_DIR. POST /debug/profile with rate=0.05
+  changes the rate at runtime, rate=0 stops it; GET /debug/profile lists
+  the hottest functions across the saved profiles
+
+Nothing is wrapped or registered when disabled. The numbers are per
+process: with several gunicorn workers each scrape and each
+/debug/profile request reaches one of them (the `pid` in eira_info tells
+which). /metrics and /debug/profile need `Authorization: Bearer
+<METRICS_TOKEN>`, and answer 404 when METRICS_TOKEN isn't set.
+METRICS_ALLOW_LOCAL=1 opens them to requests from 127.0.0.1 and ::1
+without a token instead; behind a reverse proxy on the same machine with
+TRUSTED_PROXIES=0 that is every request, so leave it off there.
+"""
+import cProfile
+import glob
+import hmac
+import io
+import os
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import Response, abort, current_app, request
+from flask.signals import before_render_template, template_rendered
+
+import db
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_LABEL_LENGTH = 100
+PROFILE_KEEP = 50
+PROFILE_TOP = 40
+
+# The timings of the request being handled in this context, if any
+_current = ContextVar("eira_request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.write_time = 0.0
+        self.write_count = 0
+        self.template_time = 0.0
+        self._template_starts = []
+        self.profile = None
+
+    def server_timing(self, total):
+        return ", ".join([
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f"write;dur={self.write_time * 1000:.1f}",
+            f"tpl;dur={self.template_time * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    """Whitespace-collapsed, truncated SQL, used to group query timings."""
+    return " ".join(sql.split())[:STATEMENT_LABEL_LENGTH]
+
+
+class Histogram:
+    """Cumulative-bucket histograms keyed by a tuple of label values."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.series = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+
+class Metrics:
+    """Everything instrumentation records, guarded by one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_seconds = Histogram()  # (endpoint, method)
+        self.responses = {}  # (endpoint, method, status) -> count
+        self.route_totals = {}  # endpoint -> [sql s, queries, write s, writes, template s]
+        self.statements = {}  # label -> [executions, seconds]
+        self.templates = {}  # name -> [renders, seconds]
+
+    def record_query(self, sql, elapsed, executed):
+        label = statement_label(sql)
+        with self.lock:
+            totals = self.statements.get(label)
+            if totals is None:
+                totals = self.statements[label] = [0, 0.0]
+            totals[0] += executed
+            totals[1] += elapsed
+
+    def record_template(self, name, elapsed):
+        with self.lock:
+            totals = self.templates.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def record_request(self, endpoint, method, status, total, timings):
+        with self.lock:
+            self.request_seconds.observe((endpoint, method), total)
+            key = (endpoint, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            totals = self.route_totals.setdefault(endpoint, [0.0, 0, 0.0, 0, 0.0])
+            totals[0] += timings.sql_time
+            totals[1] += timings.sql_count
+            totals[2] += timings.write_time
+            totals[3] += timings.write_count
+            totals[4] += timings.template_time
+
+
+# The app's Metrics, set by init_app. Connections have no app context to
+# look it up from, and there is one instrumented app per process.
+_metrics = None
+
+
+def _record_query(sql, elapsed, executed=1):
+    timings = _current.get()
+    if timings is not None:
+        timings.sql_time += elapsed
+        timings.sql_count += executed
+    if _metrics is not None:
+        _metrics.record_query(sql, elapsed, executed)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that times its statement, including the fetches."""
+
+    _sql = ""
+    _iter_time = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executescript(self, script):
+        self._sql = script
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            _record_query(script, time.perf_counter() - start)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            _record_query(self._sql, time.perf_counter() - start, executed=0)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        # Row-by-row iteration adds up its time and records it once at the
+        # end; a lock per row would cost more than the fetch itself.
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            _record_query(self._sql, self._iter_time + time.perf_counter() - start, executed=0)
+            self._iter_time = 0.0
+            raise
+        self._iter_time += time.perf_counter() - start
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # sqlite3.Connection.execute() would run the C cursor's execute directly,
+    # bypassing InstrumentedCursor, so these go through cursor() explicitly.
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+def _record_write_wait(elapsed):
+    timings = _current.get()
+    if timings is not None:
+        timings.write_time += elapsed
+        timings.write_count += 1
+
+
+def _template_started(app, template, context, **extra):
+    timings = _current.get()
+    if timings is not None:
+        timings._template_starts.append(time.perf_counter())
+
+
+def _template_finished(app, template, context, **extra):
+    timings = _current.get()
+    if timings is None or not timings._template_starts:
+        return
+    elapsed = time.perf_counter() - timings._template_starts.pop()
+    if not timings._template_starts:  # nested renders count once
+        timings.template_time += elapsed
+    app.extensions["instrumentation"].record_template(template.name or "<string>", elapsed)
+
+
+# --- Sampling profiler ---
+
+class Profiler:
+    """Profiles a random `rate` of requests, one at a time, into `directory`."""
+
+    def __init__(self, directory, rate=0.0, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.rate = rate
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def maybe_start(self):
+        if not self.rate or random.random() >= self.rate:
+            return None
+        # One profile at a time keeps the overhead to a single request.
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, endpoint, elapsed):
+        profile.disable()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}-{elapsed * 1000:.0f}ms.prof"
+            profile.dump_stats(os.path.join(self.directory, name))
+            for old in self.files()[:-self.keep]:
+                os.remove(old)
+        finally:
+            self._busy.release()
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.directory, "*.prof")), key=os.path.getmtime)
+
+    def report(self, limit=PROFILE_TOP):
+        files = self.files()
+        if not files:
+            return f"No profiles in {self.directory} (sample rate {self.rate:g}).\n"
+        out = io.StringIO()
+        out.write(f"{len(files)} profiles, sample rate {self.rate:g}\n")
+        stats = pstats.Stats(*files, stream=out)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+# --- Request hooks ---
+
+def _before_request():
+    timings = RequestTimings()
+    _current.set(timings)
+    timings.profile = current_app.extensions["profiler"].maybe_start()
+
+
+def _after_request(response):
+    timings = _current.get()
+    if timings is None:
+        return response
+    total = time.perf_counter() - timings.start
+    endpoint = request.endpoint or "<unmatched>"
+    current_app.extensions["instrumentation"].record_request(
+        endpoint, request.method, response.status_code, total, timings
+    )
+    if current_app.config["INSTRUMENTATION_SERVER_TIMING"]:
+        response.headers["Server-Timing"] = timings.server_timing(total)
+    return response
+
+
+def _teardown_request(exc=None):
+    timings = _current.get()
+    if timings is not None and timings.profile is not None:
+        current_app.extensions["profiler"].finish(
+            timings.profile, request.endpoint or "unmatched", time.perf_counter() - timings.start
+        )
+    _current.set(None)
+
+
+# --- Endpoints ---
+
+def _check_access():
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        given = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            abort(401)
+    elif not current_app.config["METRICS_ALLOW_LOCAL"] or request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(404)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Exposition:
+    """Builds Prometheus text exposition format."""
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, value, **labels):
+        if labels:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            name = f"{name}{{{label_text}}}"
+        self.lines.append(f"{name} {float(value):g}" if isinstance(value, float) else f"{name} {value}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(app):
+    metrics = app.extensions["instrumentation"]
+    out = _Exposition()
+    out.metric("eira_info", "gauge", "Process serving this scrape.")
+    out.sample("eira_info", 1, pid=os.getpid())
+
+    with metrics.lock:
+        histogram = metrics.request_seconds
+        series = {labels: list(values) for labels, values in histogram.series.items()}
+        responses = dict(metrics.responses)
+        route_totals = {endpoint: list(values) for endpoint, values in metrics.route_totals.items()}
+        statements = {label: list(values) for label, values in metrics.statements.items()}
+        templates = {name: list(values) for name, values in metrics.templates.items()}
+
+    out.metric("eira_request_duration_seconds", "histogram", "Time from first to last request hook, per route.")
+    for (endpoint, method), values in sorted(series.items()):
+        for bound, count in zip(histogram.buckets, values):
+            out.sample("eira_request_duration_seconds_bucket", count, endpoint=endpoint, method=method, le=f"{bound:g}")
+        out.sample("eira_request_duration_seconds_bucket", values[-2], endpoint=endpoint, method=method, le="+Inf")
+        out.sample("eira_request_duration_seconds_sum", values[-1], endpoint=endpoint, method=method)
+        out.sample("eira_request_duration_seconds_count", values[-2], endpoint=endpoint, method=method)
+
+    out.metric("eira_responses_total", "counter", "Responses by route and status.")
+    for (endpoint, method, status), count in sorted(responses.items()):
+        out.sample("eira_responses_total", count, endpoint=endpoint, method=method, status=status)
+
+    for index, (name, help_text) in enumerate([
+        ("eira_route_sql_seconds_total", "Time in SQL on the request's own connection, per route."),
+        ("eira_route_sql_queries_total", "Statements executed on the request's own connection, per route."),
+        ("eira_route_write_wait_seconds_total", "Time spent waiting for the write queue, per route."),
+        ("eira_route_writes_total", "Write queue jobs submitted, per route."),
+        ("eira_route_template_seconds_total", "Time rendering templates, per route."),
+    ]):
+        out.metric(name, "counter", help_text)
+        for endpoint, values in sorted(route_totals.items()):
+            out.sample(name, values[index], endpoint=endpoint)
+
+    out.metric("eira_sql_statement_executions_total", "counter", "Executions per SQL statement (all threads).")
+    for label, (count, _) in sorted(statements.items()):
+        out.sample("eira_sql_statement_executions_total", count, statement=label)
+    out.metric("eira_sql_statement_seconds_total", "counter", "Execute and fetch time per SQL statement.")
+    for label, (_, seconds) in sorted(statements.items()):
+        out.sample("eira_sql_statement_seconds_total", seconds, statement=label)
+
+    out.metric("eira_template_renders_total", "counter", "Renders per template.")
+    for name, (count, _) in sorted(templates.items()):
+        out.sample("eira_template_renders_total", count, template=name)
+    out.metric("eira_template_seconds_total", "counter", "Render time per template.")
+    for name, (_, seconds) in sorted(templates.items()):
+        out.sample("eira_template_seconds_total", seconds, template=name)
+
+    _component_metrics(app, out)
+    return out.text()
+
+
+def _component_metrics(app, out):
+    pool = app.extensions["db_pool"].stats()
+    out.metric("eira_db_pool_connections", "gauge", "Pooled connections by state.")
+    for state in ("open", "idle", "in_use"):
+        out.sample("eira_db_pool_connections", pool[state], state=state)
+    out.metric("eira_db_pool_acquired_total", "counter", "Connection checkouts.")
+    out.sample("eira_db_pool_acquired_total", pool["acquired"])
+    out.metric("eira_db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection.")
+    out.sample("eira_db_pool_wait_seconds_total", pool["wait_total_ms"] / 1000)
+    out.metric("eira_db_pool_timeouts_total", "counter", "Checkouts that gave up waiting.")
+    out.sample("eira_db_pool_timeouts_total", pool["timeouts"])
+
+    queue = app.extensions["db_write_queue"].stats()
+    out.metric("eira_db_write_jobs_total", "counter", "Write jobs by outcome.")
+    out.sample("eira_db_write_jobs_total", queue["jobs"], outcome="committed")
+    out.sample("eira_db_write_jobs_total", queue["failed"], outcome="failed")
+    out.metric("eira_db_write_batches_total", "counter", "Write batches committed.")
+    out.sample("eira_db_write_batches_total", queue["batches"])
+
+    cache = app.extensions["summary_cache"].stats()
+    out.metric("eira_summary_cache_lookups_total", "counter", "Dashboard summary cache lookups.")
+    out.sample("eira_summary_cache_lookups_total", cache["hits"], result="hit")
+    out.sample("eira_summary_cache_lookups_total", cache["misses"], result="miss")
+    out.metric("eira_summary_cache_entries", "gauge", "Cached dashboard summaries.")
+    out.sample("eira_summary_cache_entries", cache["size"])
+
+    fragments = app.extensions["fragment_cache"].stats()
+    out.metric("eira_fragment_cache_lookups_total", "counter", "Template fragment cache lookups.")
+    out.sample("eira_fragment_cache_lookups_total", fragments["hits"], result="hit")
+    out.sample("eira_fragment_cache_lookups_total", fragments["misses"], result="miss")
+    out.metric("eira_fragment_cache_bytes", "gauge", "Size of the cached template fragments.")
+    out.sample("eira_fragment_cache_bytes", fragments["bytes"])
+
+    store = app.extensions["session_store"]
+    if store is not None:
+        sessions = store.stats()
+        out.metric("eira_session_cache_lookups_total", "counter", "Server-side session cache lookups.")
+        out.sample("eira_session_cache_lookups_total", sessions["cache"]["hits"], result="hit")
+        out.sample("eira_session_cache_lookups_total", sessions["cache"]["misses"], result="miss")
+        out.metric("eira_session_writes_total", "counter", "Session rows written or deleted.")
+        out.sample("eira_session_writes_total", sessions["writes"])
+
+    replies = app.extensions["assistant"].stats()
+    out.metric("eira_assistant_cache_lookups_total", "counter", "Assistant reply cache lookups.")
+    out.sample("eira_assistant_cache_lookups_total", replies["cache"]["hits"], result="hit")
+    out.sample("eira_assistant_cache_lookups_total", replies["cache"]["misses"], result="miss")
+    out.metric("eira_assistant_replies_pending", "gauge", "Assistant replies queued or generating.")
+    out.sample("eira_assistant_replies_pending", replies["pending"])
+    out.metric("eira_assistant_replies_total", "counter", "Generated assistant replies by outcome.")
+    out.sample("eira_assistant_replies_total", replies["replies"], outcome="ok")
+    out.sample("eira_assistant_replies_total", replies["failures"], outcome="error")
+    out.metric("eira_assistant_first_chunk_seconds_total", "counter", "Time to the first generated chunk, summed.")
+    out.sample("eira_assistant_first_chunk_seconds_total", replies["first_chunk_ms_total"] / 1000)
+
+    hasher = app.extensions["password_hasher"].stats()
+    out.metric("eira_password_hashes_pending", "gauge", "Password hashes queued or running.")
+    out.sample("eira_password_hashes_pending", hasher["pending"])
+
+    limiter = app.extensions["rate_limiter"].stats()
+    out.metric("eira_ratelimit_requests_total", "counter", "Rate-limited actions by rule and outcome.")
+    for rule, counts in sorted(limiter.items()):
+        for outcome, count in counts.items():
+            out.sample("eira_ratelimit_requests_total", count, rule=rule, outcome=outcome)
+
+    jobs = app.extensions["maintenance"].stats()
+    out.metric("eira_maintenance_runs_total", "counter", "Maintenance job runs in this process.")
+    for job, stats in sorted(jobs.items()):
+        out.sample("eira_maintenance_runs_total", stats["runs"], job=job)
+    out.metric("eira_maintenance_failures_total", "counter", "Failed maintenance job runs in this process.")
+    for job, stats in sorted(jobs.items()):
+        out.sample("eira_maintenance_failures_total", stats["failures"], job=job)
+    out.metric("eira_maintenance_seconds_total", "counter", "Time spent running maintenance jobs.")
+    for job, stats in sorted(jobs.items()):
+        out.sample("eira_maintenance_seconds_total", stats["total_duration_ms"] / 1000, job=job)
+    out.metric("eira_maintenance_last_run_timestamp_seconds", "gauge", "When this process last started the job.")
+    for job, stats in sorted(jobs.items()):
+        if stats["last_run_at"] is not None:
+            out.sample("eira_maintenance_last_run_timestamp_seconds", stats["last_run_at"], job=job)
+
+    if "asgi" in app.extensions:
+        served = app.extensions["asgi"].stats()
+        out.metric("eira_asgi_requests_total", "counter", "Requests served over ASGI, by async view or WSGI app.")
+        out.sample("eira_asgi_requests_total", served["async"], handler="async")
+        out.sample("eira_asgi_requests_total", served["wsgi"], handler="wsgi")
+        out.metric("eira_asgi_requests_in_flight", "gauge", "ASGI requests being handled.")
+        out.sample("eira_asgi_requests_in_flight", served["in_flight"])
+
+    started = app.extensions["startup"].stats()
+    out.metric("eira_startup_seconds", "gauge", "Cold start phases of this process.")
+    for phase in ("import", "schema_check", "first_request", "first_response"):
+        if started[f"{phase}_ms"] is not None:
+            out.sample("eira_startup_seconds", started[f"{phase}_ms"] / 1000, phase=phase)
+
+
+def metrics_view():
+    _check_access()
+    return Response(render_metrics(current_app), mimetype="text/plain; version=0.0.4")
+
+
+def profile_view():
+    _check_access()
+    profiler = current_app.extensions["profiler"]
+    if request.method == "POST":
+        try:
+            rate = float(request.form.get("rate", request.args.get("rate", "")))
+        except ValueError:
+            abort(400)
+        profiler.rate = max(0.0, min(rate, 1.0))
+        return Response(f"Profiling {profiler.rate:g} of requests in process {os.getpid()}.\n",
+                        mimetype="text/plain")
+    return Response(profiler.report(), mimetype="text/plain")
+
+
+def init_app(app):
+    """
+    Call right after db.init_app: before startup.init_app, so connections
+    opened by DB_INIT=eager are instrumented, and before the other
+    extensions register their hooks, so the timings cover them.
+    """
+    global _metrics
+    app.config.setdefault("INSTRUMENTATION_ENABLED", os.environ.get("INSTRUMENTATION_ENABLED", "0") == "1")
+    app.config.setdefault("INSTRUMENTATION_SERVER_TIMING", os.environ.get("INSTRUMENTATION_SERVER_TIMING", "1") == "1")
+    app.config.setdefault("METRICS_TOKEN", os.environ.get("METRICS_TOKEN", ""))
+    app.config.setdefault("METRICS_ALLOW_LOCAL", os.environ.get("METRICS_ALLOW_LOCAL", "0") == "1")
+    app.config.setdefault("PROFILE_SAMPLE_RATE", float(os.environ.get("PROFILE_SAMPLE_RATE", 0)))
+    app.config.setdefault("PROFILE_DIR", os.environ.get("PROFILE_DIR", os.path.join(app.instance_path, "profiles")))
+    if not app.config["INSTRUMENTATION_ENABLED"]:
+        return
+
+    _metrics = app.extensions["instrumentation"] = Metrics()
+    app.extensions["profiler"] = Profiler(app.config["PROFILE_DIR"], app.config["PROFILE_SAMPLE_RATE"])
+    db.get_pool(app).factory = InstrumentedConnection
+    app.extensions["db_write_queue"].wait_observer = _record_write_wait
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    # Registered before the other extensions' hooks: first before_request
+    # to run, last after_request.
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    app.add_url_rule("/debug/profile", "debug_profile", profile_view, methods=["GET", "POST"])
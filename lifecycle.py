@@ -0,0 +1,164 @@
+"""
+Account deletion and cleanup of data left behind by deleted accounts.
+
+Connections enforce foreign keys (storage.PRAGMAS), so deleting a User
+row cascades to its Journal and PasswordResetTokens rows, and every
+Journal row deleted fires the triggers that keep JournalSearch,
+JournalDaily, JournalTag and UserTagCount in step. Cascading through a
+journal of tens of thousands of entries in one statement would hold the
+write lock long enough to stall everyone else's check-ins. Deletion is
+done in bounded batches instead:
+
+- delete_account() marks the User row deleted (User.deleted_at,
+  migration 13), so the account can no longer sign in or reset its
+  password. It deletes the reset tokens and up to ACCOUNT_PURGE_BATCH_SIZE
+  journal entries in the same write, and the User row too when that was
+  the last of them. Most accounts are gone before the response is sent.
+- the purge_deleted_accounts maintenance job deletes the rest, one batch
+  per write, so writes queued behind it wait for one batch at most. It
+  also deletes orphans: rows of accounts deleted before foreign keys
+  were enforced (the old delete removed only the User row).
+
+UserDataVersion rows are kept. A username registered again keeps
+counting from the old version, so it never gets the ETag of a page
+cached for the deleted account.
+
+`flask --app app lifecycle orphans` reports orphaned rows; run
+`flask --app app maintenance run purge_deleted_accounts --force` to
+delete them now.
+"""
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+import db
+import queries
+import startup
+
+BATCH_SIZE = 200
+
+lifecycle_cli = AppGroup("lifecycle", help="Inspect account data left behind by deletions.")
+
+# Per-user tables with a foreign key to User
+USER_TABLES = {
+    "Journal": "user_username",
+    "PasswordResetTokens": "username",
+}
+
+
+def _delete_journal_batch(conn, username, batch_size):
+    return conn.execute(
+        """
+        DELETE FROM Journal WHERE id IN (
+            SELECT id FROM Journal WHERE user_username = ? LIMIT ?
+        )
+        """,
+        (username, batch_size),
+    ).rowcount
+
+
+def _purge_account(conn, username, batch_size):
+    """Deletes one batch of a deleted account's journal; returns (deleted, finished)."""
+    deleted = _delete_journal_batch(conn, username, batch_size)
+    if deleted < batch_size:
+        # Cascades to anything written since the batch, e.g. by a session
+        # that was still signed in elsewhere.
+        conn.execute("DELETE FROM User WHERE username = ? AND deleted_at IS NOT NULL", (username,))
+        return deleted, True
+    return deleted, False
+
+
+def delete_account(username):
+    """Deletes an account, leaving a large journal to the purge job. Returns True when fully deleted."""
+    batch_size = current_app.config["ACCOUNT_PURGE_BATCH_SIZE"]
+
+    def job(conn):
+        conn.execute(
+            "UPDATE User SET deleted_at = ? WHERE username = ? AND deleted_at IS NULL",
+            (queries.now_timestamp(), username),
+        )
+        conn.execute("DELETE FROM PasswordResetTokens WHERE username = ?", (username,))
+        return _purge_account(conn, username, batch_size)[1]
+
+    return db.write(job)
+
+
+def orphaned_users(conn):
+    """Usernames that own rows in USER_TABLES but have no User row."""
+    users = set()
+    for table, column in USER_TABLES.items():
+        users.update(row[0] for row in conn.execute(
+            f"SELECT DISTINCT {column} FROM {table} WHERE {column} NOT IN (SELECT username FROM User)"
+        ))
+    return sorted(users)
+
+
+def find_orphans(conn):
+    """Counts rows whose foreign key points at a missing parent, by (table, parent)."""
+    counts = {}
+    for table, _, parent, _ in conn.execute("PRAGMA foreign_key_check"):
+        counts[(table, parent)] = counts.get((table, parent), 0) + 1
+    return counts
+
+
+def purge_deleted_accounts(app, conn, stop):
+    """Maintenance job: finishes pending account deletions, then deletes orphans."""
+    batch_size = app.config["ACCOUNT_PURGE_BATCH_SIZE"]
+    batches_left = app.config["MAINTENANCE_MAX_BATCHES"]
+    result = {"accounts": 0, "journal_deleted": 0, "orphaned_users": 0, "orphans_deleted": 0}
+    pending = [row[0] for row in conn.execute(
+        "SELECT username FROM User WHERE deleted_at IS NOT NULL ORDER BY deleted_at"
+    )]
+    with app.app_context():
+        for username in pending:
+            finished = False
+            while not finished and batches_left and not stop.is_set():
+                deleted, finished = db.write(lambda conn: _purge_account(conn, username, batch_size))
+                result["journal_deleted"] += deleted
+                batches_left -= 1
+            result["accounts"] += finished
+
+        orphans = orphaned_users(conn)
+        result["orphaned_users"] = len(orphans)
+        for username in orphans:
+            deleted = batch_size
+            while deleted == batch_size and batches_left and not stop.is_set():
+                deleted = db.write(lambda conn: _delete_journal_batch(conn, username, batch_size))
+                result["orphans_deleted"] += deleted
+                batches_left -= 1
+            if deleted < batch_size:
+                result["orphans_deleted"] += db.write(lambda conn: conn.execute(
+                    "DELETE FROM PasswordResetTokens WHERE username = ?", (username,)
+                ).rowcount)
+    result["pending"] = len(pending) - result["accounts"]
+    return result
+
+
+def init_app(app):
+    app.config.setdefault(
+        "ACCOUNT_PURGE_BATCH_SIZE", int(os.environ.get("ACCOUNT_PURGE_BATCH_SIZE", BATCH_SIZE))
+    )
+    app.cli.add_command(lifecycle_cli)
+
+
+@lifecycle_cli.command("orphans")
+@with_appcontext
+def orphans_command():
+    """Report rows left behind by accounts deleted without their data."""
+    startup.ensure_schema()
+    conn = db.get_db_connection(current_app.config["DATABASE"])
+    try:
+        counts = find_orphans(conn)
+        users = orphaned_users(conn)
+        pending = conn.execute("SELECT COUNT(*) FROM User WHERE deleted_at IS NOT NULL").fetchone()[0]
+    finally:
+        conn.close()
+    if not counts:
+        click.echo("No orphaned rows.")
+    for (table, parent), count in sorted(counts.items()):
+        click.echo(f"{table}: {count} row(s) referencing a missing {parent}")
+    if users:
+        click.echo(f"{len(users)} deleted user(s) still own rows.")
+    click.echo(f"{pending} account deletion(s) pending.")
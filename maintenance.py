@@ -0,0 +1,381 @@
+"""
+Periodic database maintenance, run by a background thread in each worker.
+
+Jobs (interval in seconds, MAINTENANCE_<JOB>_INTERVAL to change, 0 to
+disable):
+
+- purge_reset_tokens: deletes expired password reset tokens (used ones
+  expire too), MAINTENANCE_BATCH_SIZE rows per write so check-ins queued
+  behind it wait for one small batch, never the whole purge
+- purge_rate_limit_buckets: deletes RateLimitBucket rows idle for longer
+  than the longest rate-limit period (they would be full again)
+- purge_deleted_accounts: deletes the journals of deleted accounts and
+  of orphaned users, ACCOUNT_PURGE_BATCH_SIZE entries per write (see
+  lifecycle.py)
+- purge_sessions: deletes expired server-side sessions (see sessions.py)
+- analyze: refreshes the query planner's statistics (sqlite_stat1) with
+  ANALYZE, sampling at most ANALYZE_LIMIT rows per index
+- vacuum: returns up to MAINTENANCE_VACUUM_PAGES free pages to the file
+  system with PRAGMA incremental_vacuum. New databases are created with
+  auto_vacuum=INCREMENTAL (see storage.PRAGMAS); an older database needs
+  one full rewrite first: `flask --app app maintenance vacuum`.
+
+Every gunicorn worker runs a scheduler, and the MaintenanceJob table
+(migration 11) decides which of them runs a job: a worker claims a job
+that is due and not leased with a single conditional UPDATE, so exactly
+one claim succeeds. The lease expires after MAINTENANCE_LEASE seconds
+in case its worker dies mid-job. The table also keeps each job's last
+run, duration and result, shared by all workers
+(`flask --app app maintenance status`); Scheduler.stats() has this
+process's timings.
+
+The thread starts on the first request, so CLI commands and the gunicorn
+master (with --preload) never run jobs. On serverless hosts, where no
+thread outlives a request, set MAINTENANCE_ENABLED=0 and call
+`flask --app app maintenance run` from a cron job instead.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+import db
+import lifecycle
+import queries
+import startup
+
+logger = logging.getLogger(__name__)
+
+# job: default interval in seconds
+JOBS = {
+    "purge_reset_tokens": 3600,
+    "purge_rate_limit_buckets": 3600,
+    "purge_deleted_accounts": 600,
+    "purge_sessions": 3600,
+    "analyze": 24 * 3600,
+    "vacuum": 6 * 3600,
+}
+TICK = 60.0
+LEASE = 600.0
+BATCH_SIZE = 500
+MAX_BATCHES = 200
+ANALYZE_LIMIT = 1000
+VACUUM_PAGES = 2048
+
+maintenance_cli = AppGroup("maintenance", help="Run and inspect database maintenance jobs.")
+
+
+# --- Jobs ---
+
+def _purge_in_batches(app, sql, params, stop):
+    """Runs a DELETE ... LIMIT-style statement until it deletes no more rows."""
+    deleted = 0
+    with app.app_context():
+        for _ in range(app.config["MAINTENANCE_MAX_BATCHES"]):
+            count = db.write(lambda conn: conn.execute(
+                sql, (*params, app.config["MAINTENANCE_BATCH_SIZE"])
+            ).rowcount)
+            deleted += count
+            if count < app.config["MAINTENANCE_BATCH_SIZE"] or stop.is_set():
+                break
+    return {"deleted": deleted}
+
+
+def purge_reset_tokens(app, conn, stop):
+    # New tokens store expiry as 'YYYY-MM-DD HH:MM:SS' and older ones with
+    # microseconds added; both compare correctly as strings.
+    return _purge_in_batches(
+        app,
+        """
+        DELETE FROM PasswordResetTokens WHERE id IN (
+            SELECT id FROM PasswordResetTokens WHERE expiry < ? LIMIT ?
+        )
+        """,
+        (queries.now_timestamp(),),
+        stop,
+    )
+
+
+def purge_rate_limit_buckets(app, conn, stop):
+    limiter = app.extensions.get("rate_limiter")
+    if limiter is None:
+        return {"deleted": 0}
+    max_period = max(limit.period for limit in limiter.rules.values())
+    return _purge_in_batches(
+        app,
+        """
+        DELETE FROM RateLimitBucket WHERE key IN (
+            SELECT key FROM RateLimitBucket WHERE updated_at < ? LIMIT ?
+        )
+        """,
+        (time.time() - max_period,),
+        stop,
+    )
+
+
+def purge_sessions(app, conn, stop):
+    return _purge_in_batches(
+        app,
+        """
+        DELETE FROM Session WHERE id IN (
+            SELECT id FROM Session WHERE expires_at < ? LIMIT ?
+        )
+        """,
+        (time.time(),),
+        stop,
+    )
+
+
+def analyze(app, conn, stop):
+    conn.execute(f"PRAGMA analysis_limit = {int(app.config['MAINTENANCE_ANALYZE_LIMIT'])}")
+    conn.execute("ANALYZE")
+    return {"tables": conn.execute("SELECT count(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]}
+
+
+def vacuum(app, conn, stop):
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return {"free_pages": free, "freed_pages": 0, "note": "auto_vacuum is not INCREMENTAL"}
+    pages = min(free, app.config["MAINTENANCE_VACUUM_PAGES"])
+    if pages:
+        # execute() steps the pragma once, which frees a single page;
+        # executescript() runs it to completion.
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {"free_pages": left, "freed_pages": free - left}
+
+
+JOB_FUNCTIONS = {
+    "purge_reset_tokens": purge_reset_tokens,
+    "purge_rate_limit_buckets": purge_rate_limit_buckets,
+    "purge_deleted_accounts": lifecycle.purge_deleted_accounts,
+    "purge_sessions": purge_sessions,
+    "analyze": analyze,
+    "vacuum": vacuum,
+}
+
+
+# --- Scheduling ---
+
+CLAIM_SQL = """
+    UPDATE MaintenanceJob
+    SET lease_owner = :owner, lease_expires_at = :now + :lease
+    WHERE name = :name
+      AND (lease_expires_at IS NULL OR lease_expires_at < :now)
+      AND (:force OR last_finished_at IS NULL OR last_finished_at + :interval <= :now)
+    RETURNING name
+"""
+
+FINISH_SQL = """
+    UPDATE MaintenanceJob
+    SET lease_owner = NULL,
+        lease_expires_at = NULL,
+        last_started_at = :started,
+        last_finished_at = :finished,
+        last_duration_ms = :duration_ms,
+        last_result = :result,
+        runs = runs + 1,
+        failures = failures + :failed
+    WHERE name = :name AND lease_owner = :owner
+"""
+
+
+class Scheduler:
+    def __init__(self, app, intervals, tick=TICK, lease=LEASE):
+        self.app = app
+        self.intervals = intervals
+        self.tick = tick
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {
+            name: {
+                "runs": 0, "failures": 0, "skipped": 0,
+                "last_run_at": None, "last_duration_ms": None,
+                "total_duration_ms": 0.0, "max_duration_ms": 0.0, "last_result": None,
+            }
+            for name in intervals
+        }
+
+    def ensure_started(self):
+        # Started lazily, and again after a fork, like the write queue.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            thread = threading.Thread(target=self._loop, name="eira-maintenance", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+    def _owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def _loop(self):
+        # Spread the workers' ticks out so they don't all race for each claim.
+        self._stop.wait(random.uniform(0, self.tick))
+        conn = db.get_db_connection(self.app.config["DATABASE"])
+        conn.isolation_level = None  # each statement commits on its own
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run_pending(conn)
+                except Exception:
+                    logger.exception("Maintenance tick failed")
+                self._stop.wait(self.tick * random.uniform(0.9, 1.1))
+        finally:
+            conn.close()
+
+    def run_pending(self, conn, only=None, force=False):
+        """Runs every due job (or just `only`) that no other worker holds; returns their results."""
+        results = {}
+        for name, interval in self.intervals.items():
+            if (only and name != only) or (not interval and not force):
+                continue
+            if self._stop.is_set():
+                break
+            owner = self._owner()
+            conn.execute("INSERT INTO MaintenanceJob (name) VALUES (?) ON CONFLICT DO NOTHING", (name,))
+            claimed = conn.execute(CLAIM_SQL, {
+                "owner": owner, "name": name, "now": time.time(),
+                "lease": self.lease, "interval": interval, "force": force,
+            }).fetchall()  # read to the end so the UPDATE commits now
+            if not claimed:
+                with self._lock:
+                    self._stats[name]["skipped"] += 1
+                continue
+            results[name] = self._run(conn, name, owner)
+        return results
+
+    def _run(self, conn, name, owner):
+        started = time.time()
+        start = time.perf_counter()
+        failed = False
+        try:
+            result = JOB_FUNCTIONS[name](self.app, conn, self._stop)
+        except Exception as exc:
+            logger.exception("Maintenance job %s failed", name)
+            failed = True
+            result = {"error": repr(exc)}
+        duration_ms = (time.perf_counter() - start) * 1000
+        conn.execute(FINISH_SQL, {
+            "name": name, "owner": owner, "started": started, "finished": time.time(),
+            "duration_ms": duration_ms, "result": json.dumps(result), "failed": failed,
+        })
+        with self._lock:
+            stats = self._stats[name]
+            stats["runs"] += 1
+            stats["failures"] += failed
+            stats["last_run_at"] = started
+            stats["last_duration_ms"] = duration_ms
+            stats["total_duration_ms"] += duration_ms
+            stats["max_duration_ms"] = max(stats["max_duration_ms"], duration_ms)
+            stats["last_result"] = result
+        logger.info("Maintenance job %s took %.1f ms: %s", name, duration_ms, result)
+        return result
+
+    def stats(self):
+        """This process's job timings, keyed by job name."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+def init_app(app):
+    app.config.setdefault("MAINTENANCE_ENABLED", os.environ.get("MAINTENANCE_ENABLED", "1") == "1")
+    app.config.setdefault("MAINTENANCE_TICK", float(os.environ.get("MAINTENANCE_TICK", TICK)))
+    app.config.setdefault("MAINTENANCE_LEASE", float(os.environ.get("MAINTENANCE_LEASE", LEASE)))
+    app.config.setdefault("MAINTENANCE_BATCH_SIZE", int(os.environ.get("MAINTENANCE_BATCH_SIZE", BATCH_SIZE)))
+    app.config.setdefault("MAINTENANCE_MAX_BATCHES", int(os.environ.get("MAINTENANCE_MAX_BATCHES", MAX_BATCHES)))
+    app.config.setdefault("MAINTENANCE_ANALYZE_LIMIT", int(os.environ.get("MAINTENANCE_ANALYZE_LIMIT", ANALYZE_LIMIT)))
+    app.config.setdefault("MAINTENANCE_VACUUM_PAGES", int(os.environ.get("MAINTENANCE_VACUUM_PAGES", VACUUM_PAGES)))
+    intervals = {}
+    for name, default in JOBS.items():
+        key = f"MAINTENANCE_{name.upper()}_INTERVAL"
+        app.config.setdefault(key, float(os.environ.get(key, default)))
+        intervals[name] = app.config[key]
+
+    scheduler = Scheduler(app, intervals, app.config["MAINTENANCE_TICK"], app.config["MAINTENANCE_LEASE"])
+    app.extensions["maintenance"] = scheduler
+    app.cli.add_command(maintenance_cli)
+    if app.config["MAINTENANCE_ENABLED"]:
+        app.before_request(_start_scheduler)
+
+
+def _start_scheduler():
+    current_app.extensions["maintenance"].ensure_started()
+
+
+# --- CLI ---
+
+@maintenance_cli.command("run")
+@click.argument("job", required=False, type=click.Choice(list(JOBS)))
+@click.option("--force", is_flag=True, help="Run even if the job is not due yet.")
+@with_appcontext
+def run_command(job, force):
+    """Run the jobs that are due (for cron on hosts without a background thread)."""
+    startup.ensure_schema()
+    conn = db.get_db_connection(current_app.config["DATABASE"])
+    conn.isolation_level = None
+    try:
+        results = current_app.extensions["maintenance"].run_pending(conn, only=job, force=force)
+    finally:
+        conn.close()
+    if not results:
+        click.echo("Nothing due (or another worker holds the lease).")
+    for name, result in results.items():
+        click.echo(f"{name}: {result}")
+
+
+@maintenance_cli.command("status")
+@with_appcontext
+def status_command():
+    """Show every job's last run, as recorded by whichever worker ran it."""
+    startup.ensure_schema()
+    conn = db.get_db_connection(current_app.config["DATABASE"])
+    try:
+        rows = {row["name"]: row for row in conn.execute("SELECT * FROM MaintenanceJob")}
+    finally:
+        conn.close()
+    intervals = current_app.extensions["maintenance"].intervals
+    click.echo(f"{'job':<26} {'every':>7} {'last run':<19} {'ms':>8} {'runs':>5} {'fail':>4}  result")
+    for name in JOBS:
+        row = rows.get(name)
+        every = f"{intervals[name] / 3600:g}h" if intervals[name] else "off"
+        if row is None or row["last_started_at"] is None:
+            click.echo(f"{name:<26} {every:>7} {'never':<19}")
+            continue
+        last = datetime.fromtimestamp(row["last_started_at"]).strftime(queries.TIMESTAMP_FORMAT)
+        click.echo(
+            f"{name:<26} {every:>7} {last:<19} {row['last_duration_ms']:>8.1f} "
+            f"{row['runs']:>5} {row['failures']:>4}  {row['last_result']}"
+        )
+
+
+@maintenance_cli.command("vacuum")
+@with_appcontext
+def vacuum_command():
+    """Switch to incremental auto-vacuum and rewrite the database once (blocks writers)."""
+    conn = db.get_db_connection(current_app.config["DATABASE"])
+    conn.isolation_level = None
+    try:
+        before = os.path.getsize(current_app.config["DATABASE"])
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # so the file size is current
+        after = os.path.getsize(current_app.config["DATABASE"])
+    finally:
+        conn.close()
+    click.echo(f"Vacuumed: {before:,} -> {after:,} bytes; auto_vacuum is now INCREMENTAL.")
@@ -0,0 +1,660 @@
+"""
+Versioned schema migrations for userdata.db.
+
+The schema version lives in SQLite's `PRAGMA user_version`. Each migration
+runs in its own IMMEDIATE transaction together with the version bump, so
+two gunicorn workers starting at once can't apply the same step twice, and
+a failed step leaves the database at the previous version.
+
+To change the schema, append a new function decorated with @migration and
+the next version number. Never edit a migration that has already shipped.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] == version - 1, "migrations must be sequential"
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Applies every pending migration up to `target` (default: latest)."""
+    target = latest_version() if target is None else target
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, fn in MIGRATIONS:
+            if version > target or version <= current_version(conn):
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have got here first while we waited.
+                if version <= current_version(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+                fn(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info("Applied migration %d: %s", version, description)
+    finally:
+        conn.isolation_level = isolation_level
+    return current_version(conn)
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+@migration(1, "Create User, Journal, Resources and PasswordResetTokens tables")
+def create_base_tables(conn):
+    # IF NOT EXISTS because databases created before migrations existed
+    # already have these tables but are still at version 0.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS User
+        (
+            username VARCHAR(20) NOT NULL PRIMARY KEY,
+            password VARCHAR(128) NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_username VARCHAR(20) NOT NULL,
+            title VARCHAR(100) NOT NULL,
+            content TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sleep_hours FLOAT,
+            mood TEXT,
+            mood_rating REAL,
+            tags TEXT,
+            FOREIGN KEY (user_username) REFERENCES User(username) ON DELETE CASCADE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Resources
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            description TEXT,
+            tags TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS PasswordResetTokens
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(20) NOT NULL,
+            token TEXT NOT NULL UNIQUE,
+            expiry TIMESTAMP NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (username) REFERENCES User(username) ON DELETE CASCADE
+        )
+        """
+    )
+
+
+@migration(2, "Add Journal.updated_at, written by daily check-in updates")
+def add_journal_updated_at(conn):
+    if "updated_at" not in _columns(conn, "Journal"):
+        conn.execute("ALTER TABLE Journal ADD COLUMN updated_at TIMESTAMP")
+
+
+@migration(3, "Index Journal by user and time, tokens by user, resources by category")
+def add_lookup_indexes(conn):
+    # Every per-user page filters on user_username and sorts or compares on
+    # timestamp. Carrying mood_rating makes the dashboard and calendar
+    # queries index-only.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_journal_user_timestamp
+        ON Journal (user_username, timestamp, mood_rating)
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reset_tokens_username ON PasswordResetTokens (username)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_resources_category ON Resources (category)"
+    )
+
+
+@migration(4, "Store every Journal.timestamp as 'YYYY-MM-DD HH:MM:SS'")
+def normalize_journal_timestamps(conn):
+    # Check-ins used to be stored as a bare 'YYYY-MM-DD', which sorts before
+    # that day's midnight and breaks range filters. strftime() turns them
+    # into midnight of the same day and leaves well-formed rows unchanged.
+    conn.execute(
+        """
+        UPDATE Journal
+        SET timestamp = strftime('%Y-%m-%d %H:%M:%S', timestamp)
+        WHERE strftime('%Y-%m-%d %H:%M:%S', timestamp) IS NOT NULL
+          AND timestamp <> strftime('%Y-%m-%d %H:%M:%S', timestamp)
+        """
+    )
+
+
+@migration(5, "Track a version number for Resources, bumped by triggers")
+def add_table_versions(conn):
+    # Lets in-memory copies of mostly static tables notice a change with a
+    # primary-key lookup instead of re-reading the whole table.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS TableVersion
+        (
+            name TEXT NOT NULL PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO TableVersion (name, version) VALUES ('Resources', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_resources_version_{event.lower()}
+            AFTER {event} ON Resources
+            BEGIN
+                UPDATE TableVersion SET version = version + 1 WHERE name = 'Resources';
+            END
+            """
+        )
+
+
+@migration(6, "Add JournalDaily per-user, per-day rollup maintained by triggers")
+def add_journal_daily_rollup(conn):
+    # Sums and counts rather than averages, so every Journal write can be
+    # applied (and undone) incrementally without rescanning the day.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS JournalDaily
+        (
+            user_username VARCHAR(20) NOT NULL,
+            day TEXT NOT NULL,
+            entry_count INTEGER NOT NULL DEFAULT 0,
+            mood_count INTEGER NOT NULL DEFAULT 0,
+            mood_sum REAL NOT NULL DEFAULT 0,
+            sleep_count INTEGER NOT NULL DEFAULT 0,
+            sleep_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_username, day)
+        ) WITHOUT ROWID
+        """
+    )
+    add_entry = """
+        INSERT INTO JournalDaily
+            (user_username, day, entry_count, mood_count, mood_sum, sleep_count, sleep_sum)
+        VALUES (
+            new.user_username, substr(new.timestamp, 1, 10), 1,
+            new.mood_rating IS NOT NULL, coalesce(new.mood_rating, 0),
+            new.sleep_hours IS NOT NULL, coalesce(new.sleep_hours, 0)
+        )
+        ON CONFLICT (user_username, day) DO UPDATE SET
+            entry_count = entry_count + 1,
+            mood_count = mood_count + excluded.mood_count,
+            mood_sum = mood_sum + excluded.mood_sum,
+            sleep_count = sleep_count + excluded.sleep_count,
+            sleep_sum = sleep_sum + excluded.sleep_sum;
+    """
+    remove_entry = """
+        UPDATE JournalDaily SET
+            entry_count = entry_count - 1,
+            mood_count = mood_count - (old.mood_rating IS NOT NULL),
+            mood_sum = mood_sum - coalesce(old.mood_rating, 0),
+            sleep_count = sleep_count - (old.sleep_hours IS NOT NULL),
+            sleep_sum = sleep_sum - coalesce(old.sleep_hours, 0)
+        WHERE user_username = old.user_username AND day = substr(old.timestamp, 1, 10);
+        DELETE FROM JournalDaily
+        WHERE user_username = old.user_username AND day = substr(old.timestamp, 1, 10)
+          AND entry_count <= 0;
+    """
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_daily_insert
+        AFTER INSERT ON Journal WHEN new.timestamp IS NOT NULL
+        BEGIN {add_entry} END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_daily_delete
+        AFTER DELETE ON Journal WHEN old.timestamp IS NOT NULL
+        BEGIN {remove_entry} END
+        """
+    )
+    # An update is undone for the old row and re-applied for the new one;
+    # either side may lack a timestamp.
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_daily_update_old
+        AFTER UPDATE OF user_username, timestamp, mood_rating, sleep_hours ON Journal
+        WHEN old.timestamp IS NOT NULL
+        BEGIN {remove_entry} END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_daily_update_new
+        AFTER UPDATE OF user_username, timestamp, mood_rating, sleep_hours ON Journal
+        WHEN new.timestamp IS NOT NULL
+        BEGIN {add_entry} END
+        """
+    )
+    conn.execute("DELETE FROM JournalDaily")
+    conn.execute(
+        """
+        INSERT INTO JournalDaily
+            (user_username, day, entry_count, mood_count, mood_sum, sleep_count, sleep_sum)
+        SELECT user_username, substr(timestamp, 1, 10), COUNT(*),
+               COUNT(mood_rating), coalesce(SUM(mood_rating), 0),
+               COUNT(sleep_hours), coalesce(SUM(sleep_hours), 0)
+        FROM Journal
+        WHERE timestamp IS NOT NULL
+        GROUP BY user_username, substr(timestamp, 1, 10)
+        """
+    )
+
+
+@migration(7, "Add JournalSearch FTS5 index over Journal, kept in sync by triggers")
+def add_journal_search(conn):
+    # External-content table: the text lives only in Journal. user_username
+    # is indexed too, but searches no longer match on it (a username can
+    # have no tokens); they join on Journal.user_username instead.
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS JournalSearch USING fts5(
+            user_username, title, content, tags,
+            content='Journal', content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        """
+    )
+    insert_new = """
+        INSERT INTO JournalSearch (rowid, user_username, title, content, tags)
+        VALUES (new.id, new.user_username, new.title, new.content, new.tags);
+    """
+    delete_old = """
+        INSERT INTO JournalSearch (JournalSearch, rowid, user_username, title, content, tags)
+        VALUES ('delete', old.id, old.user_username, old.title, old.content, old.tags);
+    """
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS trg_journal_search_insert AFTER INSERT ON Journal BEGIN {insert_new} END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS trg_journal_search_delete AFTER DELETE ON Journal BEGIN {delete_old} END"
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_search_update
+        AFTER UPDATE OF user_username, title, content, tags ON Journal
+        BEGIN {delete_old} {insert_new} END
+        """
+    )
+    conn.execute("INSERT INTO JournalSearch (JournalSearch) VALUES ('rebuild')")
+
+
+def _split_tags(column):
+    """
+    Table-valued SQL yielding one `value` per comma-separated tag in
+    `column`. Triggers can't use a recursive CTE, so the list is rewritten
+    as a JSON array for json_each; a list that still isn't valid JSON
+    (control characters) yields no tags rather than failing the write.
+    """
+    escaped = rf"""replace(replace({column}, '\', '\\'), '"', '\"')"""
+    as_json = f"""'["' || replace({escaped}, ',', '","') || '"]'"""
+    return f"json_each(CASE WHEN json_valid({as_json}) THEN {as_json} ELSE '[]' END)"
+
+
+@migration(8, "Normalize Journal and Resources tags into Tag, JournalTag and ResourceTag with per-user counts")
+def add_tag_tables(conn):
+    # Journal.tags and Resources.tags stay as the display/export strings;
+    # these tables are derived from them by triggers. Tag names are the
+    # trimmed, lower-cased list items. JournalTag carries user_username so
+    # "my entries tagged X" is one index range, and UserTagCount makes
+    # "my top tags" a lookup.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Tag (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS JournalTag (
+            journal_id INTEGER NOT NULL REFERENCES Journal(id) ON DELETE CASCADE,
+            tag_id INTEGER NOT NULL REFERENCES Tag(id),
+            user_username TEXT NOT NULL,
+            PRIMARY KEY (journal_id, tag_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_journal_tag_user_tag ON JournalTag (user_username, tag_id, journal_id)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS UserTagCount (
+            user_username TEXT NOT NULL,
+            tag_id INTEGER NOT NULL REFERENCES Tag(id),
+            entry_count INTEGER NOT NULL,
+            PRIMARY KEY (user_username, tag_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_tag_count_top ON UserTagCount (user_username, entry_count)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ResourceTag (
+            resource_id INTEGER NOT NULL REFERENCES Resources(id) ON DELETE CASCADE,
+            tag_id INTEGER NOT NULL REFERENCES Tag(id),
+            PRIMARY KEY (resource_id, tag_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_resource_tag_tag ON ResourceTag (tag_id, resource_id)")
+
+    def insert_tags(row, column):
+        return f"""
+            INSERT OR IGNORE INTO Tag (name)
+            SELECT lower(trim(value)) FROM {row}{_split_tags(column)}
+            WHERE {column} IS NOT NULL AND trim(value) != ''
+        """
+
+    def matching_tags(row, column):
+        return f"FROM {row}{_split_tags(column)} JOIN Tag ON Tag.name = lower(trim(value))"
+
+    link_journal = f"""
+        INSERT OR IGNORE INTO JournalTag (journal_id, tag_id, user_username)
+        SELECT new.id, Tag.id, new.user_username {matching_tags("", "new.tags")}
+    """
+    link_resource = f"""
+        INSERT OR IGNORE INTO ResourceTag (resource_id, tag_id)
+        SELECT new.id, Tag.id {matching_tags("", "new.tags")}
+    """
+
+    # Backfill before the triggers exist, then count in one pass.
+    conn.execute(insert_tags("Journal, ", "Journal.tags"))
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO JournalTag (journal_id, tag_id, user_username)
+        SELECT Journal.id, Tag.id, Journal.user_username {matching_tags("Journal, ", "Journal.tags")}
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO UserTagCount (user_username, tag_id, entry_count)
+        SELECT user_username, tag_id, COUNT(*) FROM JournalTag GROUP BY user_username, tag_id
+        """
+    )
+    conn.execute(insert_tags("Resources, ", "Resources.tags"))
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO ResourceTag (resource_id, tag_id)
+        SELECT Resources.id, Tag.id {matching_tags("Resources, ", "Resources.tags")}
+        """
+    )
+
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_tags_insert AFTER INSERT ON Journal BEGIN
+            {insert_tags("", "new.tags")};
+            {link_journal};
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_journal_tags_delete AFTER DELETE ON Journal BEGIN
+            DELETE FROM JournalTag WHERE journal_id = old.id;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_journal_tags_update
+        AFTER UPDATE OF tags, user_username ON Journal BEGIN
+            DELETE FROM JournalTag WHERE journal_id = old.id;
+            {insert_tags("", "new.tags")};
+            {link_journal};
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_journal_tag_count_insert AFTER INSERT ON JournalTag BEGIN
+            INSERT INTO UserTagCount (user_username, tag_id, entry_count)
+            VALUES (new.user_username, new.tag_id, 1)
+            ON CONFLICT (user_username, tag_id) DO UPDATE SET entry_count = entry_count + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_journal_tag_count_delete AFTER DELETE ON JournalTag BEGIN
+            UPDATE UserTagCount SET entry_count = entry_count - 1
+            WHERE user_username = old.user_username AND tag_id = old.tag_id;
+            DELETE FROM UserTagCount
+            WHERE user_username = old.user_username AND tag_id = old.tag_id AND entry_count <= 0;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resource_tags_insert AFTER INSERT ON Resources BEGIN
+            {insert_tags("", "new.tags")};
+            {link_resource};
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_resource_tags_delete AFTER DELETE ON Resources BEGIN
+            DELETE FROM ResourceTag WHERE resource_id = old.id;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resource_tags_update AFTER UPDATE OF tags ON Resources BEGIN
+            DELETE FROM ResourceTag WHERE resource_id = old.id;
+            {insert_tags("", "new.tags")};
+            {link_resource};
+        END
+        """
+    )
+
+
+@migration(9, "Add UserDataVersion, bumped by triggers on every Journal write")
+def add_user_data_version(conn):
+    # A per-user counter that changes whenever anything derived from the
+    # user's journal may have changed; http_cache builds ETags from it.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS UserDataVersion
+        (
+            user_username VARCHAR(20) NOT NULL PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+
+    def bump(row, condition="true"):
+        # An upsert from a SELECT needs a WHERE clause to parse.
+        return f"""
+            INSERT INTO UserDataVersion (user_username, version)
+            SELECT {row}.user_username, 1 WHERE {condition}
+            ON CONFLICT (user_username) DO UPDATE SET version = version + 1;
+        """
+
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS trg_user_data_version_insert AFTER INSERT ON Journal BEGIN {bump('new')} END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS trg_user_data_version_delete AFTER DELETE ON Journal BEGIN {bump('old')} END"
+    )
+    # An update may move an entry between users; bump both sides.
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_user_data_version_update AFTER UPDATE ON Journal BEGIN
+            {bump('new')}
+            {bump('old', 'old.user_username IS NOT new.user_username')}
+        END
+        """
+    )
+
+
+@migration(10, "Add RateLimitBucket for the shared (multi-worker) rate limiter store")
+def add_rate_limit_buckets(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS RateLimitBucket
+        (
+            key TEXT NOT NULL PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_bucket_updated ON RateLimitBucket (updated_at)")
+
+
+@migration(11, "Add MaintenanceJob for scheduled jobs and index reset tokens by expiry")
+def add_maintenance_jobs(conn):
+    # One row per maintenance job: the lease that keeps two workers from
+    # running it at once, and its last run for `flask maintenance status`.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS MaintenanceJob
+        (
+            name TEXT NOT NULL PRIMARY KEY,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            last_started_at REAL,
+            last_finished_at REAL,
+            last_duration_ms REAL,
+            last_result TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+    # The token purge deletes by expiry.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reset_tokens_expiry ON PasswordResetTokens (expiry)"
+    )
+
+
+@migration(12, "Seed Resources with the sample resources")
+def seed_resources(conn):
+    # Used to run in app.py on every import; as a migration it runs once,
+    # and only into an empty table so an edited list is never duplicated.
+    if conn.execute("SELECT COUNT(*) FROM Resources").fetchone()[0]:
+        return
+    resources = [
+        # Depression support resources
+        ("depression_support", "National Suicide Prevention Lifeline", "https://988lifeline.org/", "24/7 crisis support", "crisis,depression"),
+        ("depression_support", "SAMHSA National Helpline", "https://www.samhsa.gov/find-help/national-helpline", "Free, confidential, 24/7 treatment referral", "support,depression"),
+
+        # Crisis helpline
+        ("crisis_helpline", "Crisis Text Line", "https://www.crisistextline.org/", "Text HOME to 741741 for 24/7 crisis support", "crisis,text"),
+        ("crisis_helpline", "988 Suicide & Crisis Lifeline", "https://988lifeline.org/", "Call or text 988 for immediate help", "crisis,suicide"),
+
+        # Stress management
+        ("stress_management", "Headspace: Stress Management", "https://www.headspace.com/stress", "Guided meditation for stress relief", "stress,meditation"),
+        ("stress_management", "Mayo Clinic: Stress Relief", "https://www.mayoclinic.org/healthy-lifestyle/stress-management", "Science-based stress reduction techniques", "stress,health"),
+        ("stress_management", "APA: Stress Management Tips", "https://www.apa.org/topics/stress/tips", "Psychological tips for managing stress", "stress,psychology"),
+
+        # Motivation
+        ("motivation", "TED: How to Stay Motivated", "https://www.ted.com/topics/motivation", "Inspiring talks on motivation", "motivation,inspiration"),
+        ("motivation", "Tiny Habits by BJ Fogg", "https://tinyhabits.com/", "Build motivation through small wins", "motivation,habits"),
+
+        # Sleep hygiene
+        ("sleep_hygiene", "Sleep Foundation", "https://www.sleepfoundation.org/sleep-hygiene", "Evidence-based sleep improvement tips", "sleep,health"),
+        ("sleep_hygiene", "CDC: Sleep Hygiene Tips", "https://www.cdc.gov/sleep/about_sleep/sleep_hygiene.html", "Healthy sleep habits", "sleep,hygiene"),
+        ("sleep_hygiene", "Calm: Sleep Stories", "https://www.calm.com/sleep-stories", "Relaxing bedtime stories", "sleep,meditation"),
+
+        # Relaxation techniques
+        ("relaxation_techniques", "4-7-8 Breathing Exercise", "https://www.drweil.com/health-wellness/body-mind-spirit/stress-anxiety/breathing-three-exercises/", "Simple breathing for relaxation", "breathing,relaxation"),
+        ("relaxation_techniques", "Progressive Muscle Relaxation", "https://www.anxietycanada.com/articles/progressive-muscle-relaxation/", "Physical relaxation technique", "relaxation,anxiety"),
+
+        # General wellness
+        ("general_wellness", "MindTools: Wellbeing Resources", "https://www.mindtools.com/pages/main/newMN_TCS.htm", "Mental wellness strategies", "wellness,mental-health"),
+        ("general_wellness", "Mental Health America", "https://www.mhanational.org/", "Mental health information and support", "wellness,support"),
+
+        # Gratitude exercises
+        ("gratitude_exercises", "Greater Good Science Center: Gratitude", "https://greatergood.berkeley.edu/topic/gratitude", "Science of gratitude", "gratitude,positive"),
+        ("gratitude_exercises", "5-Minute Gratitude Journal", "https://www.intelligentchange.com/blogs/read/gratitude-journal-prompts", "Daily gratitude prompts", "gratitude,journal"),
+
+        # Positive psychology
+        ("positive_psychology", "Positive Psychology Center", "https://ppc.sas.upenn.edu/", "Research-based positive psychology", "positive,psychology"),
+        ("positive_psychology", "Action for Happiness", "https://actionforhappiness.org/", "Evidence-based actions for happiness", "positive,happiness"),
+
+        # Energy boosting
+        ("energy_boosting", "Natural Energy Boosters", "https://www.health.harvard.edu/staying-healthy/9-tips-to-boost-your-energy-naturally", "Science-backed energy tips", "energy,health"),
+        ("energy_boosting", "Movement for Energy", "https://www.mayoclinic.org/healthy-lifestyle/fitness/in-depth/exercise/art-20048389", "Exercise for better energy", "energy,exercise"),
+    ]
+    conn.executemany(
+        "INSERT INTO Resources (category, title, url, description, tags) VALUES (?, ?, ?, ?, ?)",
+        resources,
+    )
+
+
+@migration(13, "Add User.deleted_at for accounts whose data is still being purged")
+def add_user_deleted_at(conn):
+    if "deleted_at" not in _columns(conn, "User"):
+        conn.execute("ALTER TABLE User ADD COLUMN deleted_at TIMESTAMP")
+    # Only pending deletions are indexed, for lifecycle.purge_deleted_accounts.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_deleted_at ON User (deleted_at) WHERE deleted_at IS NOT NULL"
+    )
+
+
+@migration(14, "Add Session for server-side sessions")
+def add_sessions(conn):
+    # id is the SHA-256 of the cookie token; data is Flask's tagged JSON.
+    # username is NULL for anonymous sessions (flash messages only).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Session
+        (
+            id TEXT NOT NULL PRIMARY KEY,
+            username VARCHAR(20) REFERENCES User(username) ON DELETE CASCADE,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_username ON Session (username)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_expires_at ON Session (expires_at)")
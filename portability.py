@@ -0,0 +1,202 @@
+"""
+Bulk journal export and import (NDJSON and CSV).
+
+Export streams rows straight from a fetchmany cursor, so memory use does
+not depend on how many entries a user has. Import parses the upload as a
+stream, validates each row with the same rules as the daily check-in, and
+inserts valid rows with executemany in batches. Each batch is one
+write-queue job, which means one transaction, so a large import never
+holds the write lock for long.
+"""
+import csv
+import io
+import json
+from datetime import datetime, time
+
+import db
+import queries
+import tags
+import validation
+
+FIELDS = ("timestamp", "title", "content", "mood", "mood_rating", "sleep_hours", "tags")
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+MAX_TITLE_LENGTH = 100
+
+EXPORT_SQL = f"""
+    SELECT {", ".join(FIELDS)}
+    FROM Journal
+    WHERE user_username = ?
+    ORDER BY Journal.timestamp, Journal.id
+"""
+
+
+def detect_format(requested, filename=None, mimetype=None):
+    """Picks 'ndjson' or 'csv' from an explicit choice, file extension or type."""
+    if requested in FORMATS:
+        return requested
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    if mimetype and "csv" in mimetype:
+        return "csv"
+    return "ndjson"
+
+
+# --- Export ---
+
+def export_rows(username):
+    return db.stream_query(EXPORT_SQL, (username,))
+
+
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n"
+
+
+def export_csv(rows, rows_per_chunk=200):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(["" if value is None else value for value in row])
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export(username, fmt):
+    """Returns a generator of text chunks; safe to iterate after the request ends."""
+    rows = export_rows(username)
+    return export_csv(rows) if fmt == "csv" else export_ndjson(rows)
+
+
+# --- Import ---
+
+def parse_timestamp(value):
+    """
+    Accepts 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM[:SS]' and ISO 8601 with a zone.
+
+    Check-ins are the entries at midnight (queries.checkin_timestamp), so
+    imported entries are kept off it: a bare date is stored at noon and
+    midnight as 00:00:01. Otherwise the day's check-in would overwrite
+    them, and the calendar and streaks would count them as check-ins.
+    """
+    if not value:
+        raise validation.ValidationError("timestamp is required")
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise validation.ValidationError(f"Unrecognised timestamp: {value!r}") from None
+    if parsed.tzinfo is not None:
+        # Stored timestamps are naive local time, like the rest of the app
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    parsed = parsed.replace(microsecond=0)
+    if "T" not in text.upper() and " " not in text:  # a date without a time
+        parsed = parsed.replace(hour=12)
+    elif parsed.time() == time():
+        parsed = parsed.replace(second=1)
+    return queries.format_timestamp(parsed)
+
+
+def _optional(record, key):
+    value = record.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return value
+
+
+def validate_record(record):
+    """Turns one imported record into a Journal row tuple, or raises ValidationError."""
+    if not isinstance(record, dict):
+        raise validation.ValidationError("Each record must be an object")
+
+    timestamp = parse_timestamp(_optional(record, "timestamp"))
+    title = str(_optional(record, "title") or "Imported entry").strip()
+    if len(title) > MAX_TITLE_LENGTH:
+        raise validation.ValidationError(f"Title is longer than {MAX_TITLE_LENGTH} characters")
+    content = str(_optional(record, "content") or "")
+
+    mood_rating = _optional(record, "mood_rating")
+    if mood_rating is not None:
+        mood_rating = validation.validate_mood_rating(mood_rating)
+    sleep_hours = _optional(record, "sleep_hours")
+    if sleep_hours is not None:
+        sleep_hours = validation.validate_sleep_hours(sleep_hours)
+
+    mood = _optional(record, "mood")
+    entry_tags = _optional(record, "tags")
+    if isinstance(entry_tags, list):
+        entry_tags = ",".join(str(tag) for tag in entry_tags)
+
+    return (
+        timestamp,
+        title,
+        content,
+        str(mood) if mood is not None else None,
+        mood_rating,
+        sleep_hours,
+        tags.parse_tags(str(entry_tags)) if entry_tags is not None else None,
+    )
+
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8-sig"), 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, validation.ValidationError(f"Invalid JSON: {e.msg}")
+
+
+def read_csv(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for record in reader:
+        # line_num is the physical line the record ended on (header is line 1)
+        yield reader.line_num, record
+
+
+def import_entries(username, stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports records from a binary stream for one user. Invalid rows are
+    skipped and reported by line number; valid rows are inserted.
+    """
+    reader = read_csv(stream) if fmt == "csv" else read_ndjson(stream)
+    report = {"imported": 0, "skipped": 0, "errors": []}
+    batch = []
+
+    def flush():
+        rows = [(username, *row) for row in batch]
+        db.write(lambda conn: conn.executemany(
+            f"INSERT INTO Journal (user_username, {', '.join(FIELDS)}) "
+            f"VALUES (?, {', '.join('?' for _ in FIELDS)})",
+            rows,
+        ))
+        report["imported"] += len(rows)
+        batch.clear()
+
+    try:
+        for line_number, record in reader:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(validate_record(record))
+            except validation.ValidationError as e:
+                report["skipped"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"line": line_number, "error": str(e)})
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        report["errors"].append({"line": None, "error": f"Could not read file: {e}"})
+    if batch:
+        flush()
+    return report
@@ -0,0 +1,110 @@
+"""
+Helpers for building Journal queries.
+
+Journal.timestamp is stored as text in one fixed format,
+'YYYY-MM-DD HH:MM:SS', so timestamps sort and compare correctly as plain
+strings. Date filters are therefore written as half-open ranges on the raw
+column (`timestamp >= ? AND timestamp < ?`), which SQLite can answer from
+idx_journal_user_timestamp, instead of wrapping the column in strftime().
+"""
+import base64
+import binascii
+from datetime import date, datetime, timedelta
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# SQLite integers are signed 64-bit; binding anything larger overflows
+MAX_ID = 2 ** 63 - 1
+
+
+def format_timestamp(value):
+    """Formats a date or datetime the way Journal.timestamp stores it."""
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def now_timestamp():
+    return format_timestamp(datetime.now())
+
+
+def checkin_timestamp(day=None):
+    """
+    Timestamp of a day's check-in. Check-ins are stored at midnight of the
+    day they belong to, so "today's check-in" is a single equality seek.
+    """
+    return format_timestamp(day or date.today())
+
+
+def parse_day(value):
+    """Parses 'YYYY-MM-DD', returning None if it isn't a valid date."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value):
+    """Parses a timestamp in exactly TIMESTAMP_FORMAT, returning None otherwise."""
+    try:
+        parsed = datetime.strptime(value, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return parsed if format_timestamp(parsed) == value else None
+
+
+def day_range(day):
+    """[start, end) bounds covering one calendar day."""
+    return format_timestamp(day), format_timestamp(day + timedelta(days=1))
+
+
+def month_range(year, month):
+    """[start, end) bounds covering one calendar month."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return format_timestamp(start), format_timestamp(end)
+
+
+def year_range(year):
+    """[start, end) bounds covering one calendar year."""
+    return format_timestamp(date(year, 1, 1)), format_timestamp(date(year + 1, 1, 1))
+
+
+def range_filter(bounds, column="timestamp"):
+    """
+    Returns an SQL fragment and its parameters for a half-open range, e.g.
+    range_filter(month_range(2026, 2)) ->
+        ("timestamp >= ? AND timestamp < ?", ["2026-02-01 00:00:00", "2026-03-01 00:00:00"])
+    """
+    start, end = bounds
+    return f"{column} >= ? AND {column} < ?", [start, end]
+
+
+def encode_cursor(timestamp, entry_id):
+    """Opaque page cursor pointing just past the entry (timestamp, id)."""
+    raw = f"{timestamp}|{entry_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    """Returns (timestamp, id) from encode_cursor(), or None if malformed."""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        timestamp, entry_id = raw.rsplit("|", 1)
+        entry_id = int(entry_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not -MAX_ID - 1 <= entry_id <= MAX_ID or parse_timestamp(timestamp) is None:
+        return None
+    return timestamp, entry_id
+
+
+def keyset_filter(cursor, table="Journal"):
+    """
+    SQL fragment for "entries older than the cursor" in newest-first order.
+    Paired with ORDER BY timestamp DESC, id DESC it continues from an index
+    seek instead of skipping OFFSET rows.
+    """
+    timestamp, entry_id = cursor
+    return f"({table}.timestamp, {table}.id) < (?, ?)", [timestamp, entry_id]
@@ -0,0 +1,215 @@
+"""
+Token-bucket rate limiting for the sign-in, password reset and assistant
+endpoints.
+
+Each rule (e.g. "login_ip") gives every key (a client IP or a username)
+a bucket of `capacity` tokens, refilled evenly over `period` seconds and
+configured as "capacity/period", e.g. RATELIMIT_LOGIN_IP="20/60". A
+request spends a token; once the bucket holds less than one, requests
+are rejected with RateLimited, which says how long until the next token
+(the Retry-After value). Rejections cost a dictionary lookup or one small
+write, never a password hash.
+
+Two stores:
+
+- MemoryStore (default) lives in the worker. It is split into shards,
+  each with its own lock, so concurrent requests rarely wait on each
+  other. Buckets that have refilled are dropped, so memory is bounded by
+  the keys active within one period. With N gunicorn workers a client
+  can get up to N times the configured rate.
+- SQLiteStore (RATELIMIT_STORAGE=sqlite) is shared by all workers through
+  the RateLimitBucket table (migration 10). A take is one
+  INSERT ... ON CONFLICT DO UPDATE ... RETURNING through the write queue.
+"""
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+import db
+
+# rule: "capacity/period in seconds"
+RULES = {
+    "login_ip": "20/60",
+    "login_user": "10/300",  # failed logins per username
+    "forgot_ip": "5/300",
+    "forgot_user": "3/900",
+    "reset_ip": "10/300",
+    "assistant_user": "30/60",
+}
+
+
+class RateLimited(Exception):
+    """Raised when a rate-limit bucket is empty."""
+
+    status_code = 429
+
+    def __init__(self, rule, retry_after):
+        super().__init__(f"Rate limit {rule!r} exceeded; retry in {retry_after:.0f}s")
+        self.rule = rule
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Limit(namedtuple("Limit", "capacity period")):
+    @property
+    def rate(self):
+        """Tokens added per second."""
+        return self.capacity / self.period
+
+
+def parse_limit(value):
+    """'20/60' -> Limit(capacity=20, period=60.0)"""
+    capacity, period = str(value).split("/", 1)
+    limit = Limit(int(capacity), float(period))
+    if limit.capacity < 1 or limit.period <= 0:
+        raise ValueError(f"Invalid rate limit {value!r}")
+    return limit
+
+
+def _refill(tokens, updated_at, limit, now):
+    return min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.rate)
+
+
+class MemoryStore:
+    def __init__(self, shards=16, prune_at=10_000):
+        self.prune_at = prune_at
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._next_prune = [prune_at] * shards
+
+    def take(self, key, limit, cost, now):
+        """Spends `cost` tokens; returns None, or seconds until one is available."""
+        index = hash(key) % len(self._shards)
+        lock, buckets = self._shards[index]
+        with lock:
+            tokens, updated_at, _ = buckets.get(key, (limit.capacity, now, limit))
+            tokens = _refill(tokens, updated_at, limit, now)
+            if tokens < 1:
+                buckets[key] = (tokens, now, limit)
+                return (1 - tokens) / limit.rate
+            buckets[key] = (tokens - cost, now, limit)
+            if len(buckets) >= self._next_prune[index]:
+                self._prune(index, now)
+            return None
+
+    def _prune(self, index, now):
+        # Called with the shard's lock held; a full bucket is the same as none.
+        _, buckets = self._shards[index]
+        for key, (tokens, updated_at, limit) in list(buckets.items()):
+            if _refill(tokens, updated_at, limit, now) >= limit.capacity:
+                del buckets[key]
+        self._next_prune[index] = max(self.prune_at, 2 * len(buckets))
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+
+class SQLiteStore:
+    TAKE_SQL = """
+        INSERT INTO RateLimitBucket (key, tokens, updated_at)
+        VALUES (:key, :capacity - :cost, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:capacity, tokens + max(0, :now - updated_at) * :rate) - :cost,
+            updated_at = :now
+        WHERE min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= 1
+        RETURNING tokens
+    """
+    PURGE_EVERY = 1000
+
+    def __init__(self, max_period):
+        self.max_period = max_period
+        self._takes = 0
+
+    def take(self, key, limit, cost, now):
+        self._takes += 1
+        purge = self._takes % self.PURGE_EVERY == 0
+        params = {"key": key, "capacity": limit.capacity, "rate": limit.rate, "cost": cost, "now": now}
+
+        def job(conn):
+            if purge:
+                # Untouched for a whole period means the bucket is full again.
+                conn.execute(
+                    "DELETE FROM RateLimitBucket WHERE updated_at < ?", (now - self.max_period,)
+                )
+            if conn.execute(self.TAKE_SQL, params).fetchone() is not None:
+                return None
+            tokens, updated_at = conn.execute(
+                "SELECT tokens, updated_at FROM RateLimitBucket WHERE key = ?", (key,)
+            ).fetchone()
+            return (1 - _refill(tokens, updated_at, limit, now)) / limit.rate
+
+        return db.write(job)
+
+
+class RateLimiter:
+    def __init__(self, store, rules, enabled=True):
+        self.store = store
+        self.rules = rules
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counts = {rule: [0, 0] for rule in rules}  # allowed, limited
+
+    def take(self, rule, key, cost=1):
+        """Spends tokens from key's bucket for rule; returns None or seconds to wait."""
+        if not self.enabled or not key:
+            return None
+        retry_after = self.store.take(f"{rule}:{key}", self.rules[rule], cost, time.time())
+        with self._lock:
+            self._counts[rule][retry_after is not None] += 1
+        return retry_after
+
+    def check(self, rule, key, cost=1):
+        """Like take(), but raises RateLimited when the bucket is empty."""
+        retry_after = self.take(rule, key, cost)
+        if retry_after is not None:
+            raise RateLimited(rule, retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {
+                rule: {"allowed": allowed, "limited": limited}
+                for rule, (allowed, limited) in self._counts.items()
+            }
+
+
+def init_app(app):
+    app.config.setdefault("RATELIMIT_ENABLED", os.environ.get("RATELIMIT_ENABLED", "1") == "1")
+    app.config.setdefault("RATELIMIT_STORAGE", os.environ.get("RATELIMIT_STORAGE", "memory"))
+    app.config.setdefault("RATELIMIT_SHARDS", int(os.environ.get("RATELIMIT_SHARDS", 16)))
+    rules = {}
+    for rule, default in RULES.items():
+        name = f"RATELIMIT_{rule.upper()}"
+        app.config.setdefault(name, os.environ.get(name, default))
+        rules[rule] = parse_limit(app.config[name])
+
+    if app.config["RATELIMIT_STORAGE"] == "sqlite":
+        store = SQLiteStore(max_period=max(limit.period for limit in rules.values()))
+    elif app.config["RATELIMIT_STORAGE"] == "memory":
+        store = MemoryStore(shards=app.config["RATELIMIT_SHARDS"])
+    else:
+        raise ValueError(f"Unknown RATELIMIT_STORAGE {app.config['RATELIMIT_STORAGE']!r}")
+    app.extensions["rate_limiter"] = RateLimiter(store, rules, app.config["RATELIMIT_ENABLED"])
+
+
+def get_limiter():
+    return current_app.extensions["rate_limiter"]
+
+
+def username_key(username):
+    """Usernames differing only in case or spaces share a bucket."""
+    return (username or "").strip().lower() or None
+
+
+def check(rule, key, cost=1):
+    get_limiter().check(rule, key, cost)
+
+
+def spend(rule, key):
+    """Spends a token without raising, e.g. after a failed login."""
+    get_limiter().take(rule, key)
@@ -0,0 +1,142 @@
+"""
+Resource recommendations for the check-in complete page.
+
+Resources is seed data that almost never changes, so it is loaded once per
+process into an index keyed by category. The rule table below is resolved
+ahead of time into a candidate list per (mood band, sleep band), and a
+recommendation is just random sampling in memory.
+
+The index is rebuilt only when TableVersion('Resources') changes; triggers
+bump it on every insert, update or delete. That version is checked at most
+once every RELOAD_CHECK_INTERVAL seconds.
+"""
+import random
+import threading
+import time
+
+from flask import current_app
+
+from db import get_db
+
+RELOAD_CHECK_INTERVAL = 60.0
+PER_CATEGORY = 2
+MAX_RECOMMENDATIONS = 6
+
+MOOD_BANDS = ("low", "mid", "okay", "high")
+SLEEP_BANDS = ("short", "normal", "long")
+
+MOOD_CATEGORIES = {
+    "low": ("depression_support", "crisis_helpline"),
+    "mid": ("stress_management", "motivation"),
+    "okay": ("general_wellness",),
+    "high": ("gratitude_exercises", "positive_psychology"),
+}
+SLEEP_CATEGORIES = {
+    "short": ("sleep_hygiene", "relaxation_techniques"),
+    "normal": (),
+    "long": ("energy_boosting", "sleep_hygiene"),
+}
+
+
+def mood_band(mood_rating):
+    if mood_rating <= 3:
+        return "low"
+    if mood_rating <= 5:
+        return "mid"
+    if mood_rating <= 7:
+        return "okay"
+    return "high"
+
+
+def sleep_band(sleep_hours):
+    if sleep_hours < 5:
+        return "short"
+    if sleep_hours > 10:
+        return "long"
+    return "normal"
+
+
+class ResourceIndex:
+    """Immutable snapshot of Resources, grouped for each band combination."""
+
+    def __init__(self, rows, version):
+        self.version = version
+        by_category = {}
+        for row in rows:
+            by_category.setdefault(row["category"], []).append({
+                "title": row["title"],
+                "url": row["url"],
+                "description": row["description"],
+                "category": row["category"],
+            })
+        self.by_category = by_category
+        # (mood band, sleep band) -> candidate lists for each category
+        self.candidates = {}
+        for mood in MOOD_BANDS:
+            for sleep in SLEEP_BANDS:
+                categories = dict.fromkeys(MOOD_CATEGORIES[mood] + SLEEP_CATEGORIES[sleep])
+                self.candidates[(mood, sleep)] = [
+                    by_category[category] for category in categories if category in by_category
+                ]
+
+    def recommend(self, mood_rating, sleep_hours, rng=random):
+        resources = []
+        for candidates in self.candidates[(mood_band(mood_rating), sleep_band(sleep_hours))]:
+            resources.extend(rng.sample(candidates, min(PER_CATEGORY, len(candidates))))
+        if len(resources) > MAX_RECOMMENDATIONS:
+            resources = rng.sample(resources, MAX_RECOMMENDATIONS)
+        return resources
+
+
+class RecommendationEngine:
+    """Holds the current ResourceIndex and swaps in a new one on change."""
+
+    def __init__(self, check_interval=RELOAD_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.index = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_index(self, get_conn):
+        """Returns the current index; `get_conn` is only called to check or reload."""
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < self.check_interval:
+            return self.index
+        with self._lock:
+            if self.index is None or now - self.checked_at >= self.check_interval:
+                conn = get_conn()
+                version = resources_version(conn)
+                if self.index is None or self.index.version != version:
+                    self.index = load_index(conn, version)
+                self.checked_at = now
+        return self.index
+
+    def invalidate(self):
+        self.checked_at = 0.0
+
+
+def resources_version(conn):
+    row = conn.execute("SELECT version FROM TableVersion WHERE name = 'Resources'").fetchone()
+    return row["version"] if row else 0
+
+
+def load_index(conn, version=None):
+    if version is None:
+        version = resources_version(conn)
+    rows = conn.execute(
+        "SELECT title, url, description, category FROM Resources ORDER BY id"
+    ).fetchall()
+    return ResourceIndex(rows, version)
+
+
+def init_app(app):
+    app.extensions["recommendations"] = RecommendationEngine()
+
+
+def get_resource_recommendations(mood_rating, sleep_hours):
+    """
+    Rule-based recommendation system.
+    Returns up to 6 resources based on mood and sleep, 2 per category.
+    """
+    engine = current_app.extensions["recommendations"]
+    return engine.get_index(get_db).recommend(mood_rating, sleep_hours)
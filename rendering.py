@@ -0,0 +1,162 @@
+"""
+Template compilation and fragment caching.
+
+Compiling a template to Python is most of the cost of its first render,
+and every worker used to pay it for every template it served. Compiled
+templates are now kept in a Jinja bytecode cache on disk
+(TEMPLATE_CACHE_DIR, default instance/jinja-cache), and every template
+is loaded while the app is set up (TEMPLATE_WARM=1), so workers start
+with them compiled; `flask --app app templates compile` fills the cache
+ahead of time, e.g. in a build step. Loading all of them from the
+cache takes a few milliseconds, compiling them over a hundred, so
+without a writable directory they aren't warmed but compiled on first
+use, as before.
+
+{% cache "name", key, ... %}...{% endcache %} keeps the rendered HTML of
+a block in a per-process LRU of at most TEMPLATE_FRAGMENT_CACHE_BYTES.
+The key is the template, the block, the signed-in user and their
+UserDataVersion (see http_cache), plus the listed values, so a journal
+write makes every fragment of that user stale and nothing else does.
+Blocks are rendered normally when nobody is signed in. Anything a block
+shows that isn't derived from the journal (today's date, query
+arguments) must be part of its key.
+
+A cached block is only cheaper than a render if its data isn't loaded
+either, so views pass it as deferred(fn) and templates call it inside
+the block: the query runs on a miss only. A block is rendered to a string
+before it is sent, so don't wrap streamed rows in one.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import cache
+
+import click
+from flask import current_app, has_request_context
+from flask.cli import AppGroup, with_appcontext
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+import sessions
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_CACHE_BYTES = 16 * 1024 * 1024
+
+templates_cli = AppGroup("templates", help="Compile templates into the bytecode cache.")
+
+
+def deferred(fn):
+    """Calls fn once, on first use; for data only needed when a fragment isn't cached."""
+    return cache(fn)
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, bounded by their total size."""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = html
+            self.size += len(html)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache %} tag."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        block = nodes.Const(f"{parser.name}:{lineno}")
+        return nodes.CallBlock(
+            self.call_method("_render", [block, nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, block, parts, caller):
+        cache = current_app.extensions["fragment_cache"] if has_request_context() else None
+        user = sessions.current_user() if cache is not None else None
+        if user is None:
+            return caller()
+        key = (block, user.username, user.data_version, repr(parts))
+        html = cache.get(key)
+        if html is None:
+            html = caller()
+            cache.put(key, str(html))
+            return html
+        return Markup(html)
+
+
+def compile_templates(app):
+    """Loads every template, compiling (and caching) any that aren't yet."""
+    env = app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def init_app(app):
+    app.config.setdefault(
+        "TEMPLATE_CACHE_DIR", os.environ.get("TEMPLATE_CACHE_DIR", os.path.join(app.instance_path, "jinja-cache"))
+    )
+    app.config.setdefault("TEMPLATE_WARM", os.environ.get("TEMPLATE_WARM", "1") == "1")
+    app.config.setdefault(
+        "TEMPLATE_FRAGMENT_CACHE_BYTES",
+        int(os.environ.get("TEMPLATE_FRAGMENT_CACHE_BYTES", FRAGMENT_CACHE_BYTES)),
+    )
+    env = app.jinja_env
+    env.add_extension(FragmentCacheExtension)
+    try:
+        os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
+    except OSError as e:
+        # e.g. a read-only file system on a serverless host
+        logger.warning("Template bytecode cache disabled: %s", e)
+    app.extensions["fragment_cache"] = FragmentCache(app.config["TEMPLATE_FRAGMENT_CACHE_BYTES"])
+    app.cli.add_command(templates_cli)
+    if app.config["TEMPLATE_WARM"] and env.bytecode_cache is not None:
+        compile_templates(app)
+
+
+@templates_cli.command("compile")
+@with_appcontext
+def compile_command():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+    count = compile_templates(current_app)
+    click.echo(f"Compiled {count} templates into {current_app.config['TEMPLATE_CACHE_DIR']}.")
@@ -0,0 +1,131 @@
+"""
+Full-text search over a user's journal entries.
+
+Backed by the JournalSearch FTS5 table (see migration 7), which triggers
+keep in sync with Journal. User input is never passed to MATCH as-is: it
+is reduced to quoted terms, so punctuation can't produce FTS syntax
+errors. With prefix=True (search-as-you-type) the last term is a prefix
+match; that roughly doubles the cost of a common term, so it is opt-in.
+A tag without a query doesn't use the index at all (TAG_SQL).
+"""
+import re
+
+from markupsafe import escape
+
+import tags
+
+PER_PAGE = 20
+MAX_PER_PAGE = 100
+MAX_PAGE = 1000
+SNIPPET_TOKENS = 16
+
+# Control characters can't appear in entries, so they are safe markers for
+# the highlighted ranges until the text has been HTML-escaped.
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+SEARCH_SQL = f"""
+    SELECT Journal.id, Journal.timestamp, Journal.mood, Journal.mood_rating, Journal.tags,
+           highlight(JournalSearch, 1, '{_MARK_START}', '{_MARK_END}') AS title_html,
+           snippet(JournalSearch, 2, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_TOKENS}) AS snippet_html
+    FROM JournalSearch
+    JOIN Journal ON Journal.id = JournalSearch.rowid
+    WHERE JournalSearch MATCH ? AND Journal.user_username = ? {{tag_filter}}
+    ORDER BY bm25(JournalSearch, 0.0, 10.0, 1.0, 5.0)
+    LIMIT ? OFFSET ?
+"""
+
+# Without search terms there is nothing to rank or highlight: newest first.
+TAG_SQL = """
+    SELECT Journal.id, Journal.timestamp, Journal.mood, Journal.mood_rating, Journal.tags,
+           Journal.title AS title_html, Journal.content AS snippet_html
+    FROM Journal
+    WHERE Journal.user_username = ? AND {tag_filter}
+    ORDER BY Journal.timestamp DESC, Journal.id DESC
+    LIMIT ? OFFSET ?
+"""
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def build_match(query, prefix=False):
+    """
+    Turns free text into an FTS5 MATCH expression over the text columns,
+    or None when the query has no searchable terms.
+
+    The owner is not part of the match: a username can have no FTS tokens
+    at all (e.g. "___"), which would match nothing. The join on
+    Journal.user_username in SEARCH_SQL limits results to the user.
+    """
+    terms = _TERM_RE.findall(query or "")
+    if not terms:
+        return None
+    phrases = [_phrase(term) for term in terms[:-1]]
+    phrases.append(_phrase(terms[-1]) + ("*" if prefix else ""))
+    return f"{{title content tags}} : ({' AND '.join(phrases)})"
+
+
+def _render_marks(text):
+    """HTML-escapes text and turns the highlight markers into <mark> tags."""
+    if text is None:
+        return ""
+    return (
+        str(escape(text))
+        .replace(_MARK_START, "<mark>")
+        .replace(_MARK_END, "</mark>")
+    )
+
+
+def _plain_snippet(text):
+    """The first SNIPPET_TOKENS words of an entry, like snippet() without a match."""
+    words = (text or "").split()
+    return " ".join(words[:SNIPPET_TOKENS]) + ("…" if len(words) > SNIPPET_TOKENS else "")
+
+
+def search_entries(conn, username, query, tag=None, page=1, per_page=PER_PAGE, prefix=False):
+    """
+    Returns one page of ranked results, fetching one extra row to know
+    whether another page exists. `tag` limits results to entries with that
+    exact tag; a tag without a query lists all of them.
+    """
+    match = build_match(query, prefix)
+    page = max(1, min(page, MAX_PAGE))
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    if match is None and not tag:
+        return {"query": query or "", "tag": tag, "page": page, "results": [], "has_more": False}
+
+    limit = [per_page + 1, (page - 1) * per_page]
+    if match is None:
+        tag_sql, tag_params = tags.tag_filter(username, tag)
+        rows = conn.execute(TAG_SQL.format(tag_filter=tag_sql), [username, *tag_params, *limit]).fetchall()
+    else:
+        params = [match, username]
+        tag_sql = ""
+        if tag:
+            tag_sql, tag_params = tags.tag_filter(username, tag)
+            tag_sql = "AND " + tag_sql
+            params += tag_params
+        rows = conn.execute(SEARCH_SQL.format(tag_filter=tag_sql), [*params, *limit]).fetchall()
+    results = [
+        {
+            "id": row["id"],
+            "timestamp": row["timestamp"],
+            "mood": row["mood"],
+            "mood_rating": row["mood_rating"],
+            "tags": row["tags"],
+            "title_html": _render_marks(row["title_html"]),
+            "snippet_html": _render_marks(row["snippet_html"] if match else _plain_snippet(row["snippet_html"])),
+        }
+        for row in rows[:per_page]
+    ]
+    return {
+        "query": query or "",
+        "tag": tag,
+        "page": page,
+        "results": results,
+        "has_more": len(rows) > per_page,
+    }
@@ -0,0 +1,297 @@
+"""
+Server-side sessions and the signed-in user of the current request.
+
+With SESSION_BACKEND=sqlite (the default) the session cookie holds only a
+random token. The session itself is a row of the Session table
+(migration 14), keyed by the token's SHA-256 so the table alone can't be
+used to sign in. SESSION_BACKEND=cookie keeps Flask's signed cookie
+sessions, which can't be revoked.
+
+Reading a session normally costs no query: each worker keeps an LRU of
+SESSION_CACHE_SIZE sessions, trusted for SESSION_CACHE_TTL seconds. A
+miss is one primary-key lookup, which also drops sessions whose account
+is gone or being deleted. A session is written (through the write queue)
+only when it changed, or at most once per SESSION_REFRESH_INTERVAL to
+push its expiry back. Signed-in sessions last app.permanent_session_lifetime
+after their last write and anonymous ones (just flash messages)
+SESSION_ANONYMOUS_LIFETIME; the purge_sessions maintenance job deletes
+expired rows.
+
+Signing in or out issues a new token and deletes the old session.
+revoke_user() deletes every session of a user. It is called after a
+password reset and an account deletion. This worker forgets them at once;
+another worker stops accepting a cached copy within SESSION_CACHE_TTL.
+
+current_user() returns a UserContext for the signed-in user, built once
+per request. Its data is loaded on first use and shared by everything
+that asks during the request (the ETag check and the view).
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+
+from flask import current_app, g, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import db
+import http_cache
+import queries
+import startup
+import summary
+from db import get_db
+
+CACHE_SIZE = 10000
+CACHE_TTL = 10.0
+REFRESH_INTERVAL = 3600.0
+ANONYMOUS_LIFETIME = 3600.0
+
+serializer = TaggedJSONSerializer()
+
+
+def _session_id(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, token=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.expires_at = expires_at
+        self.username = self.get("Username")
+        self.modified = False
+
+
+class SessionCache:
+    """Thread-safe LRU of serialized sessions keyed by session id."""
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sid)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, sid, username, data, expires_at):
+        with self._lock:
+            self._entries[sid] = (time.monotonic(), username, data, expires_at)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def pop_user(self, username):
+        with self._lock:
+            for sid in [sid for sid, entry in self._entries.items() if entry[1] == username]:
+                del self._entries[sid]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteSessionStore:
+    def __init__(self, cache):
+        self.cache = cache
+        self.writes = 0
+
+    def load(self, sid):
+        """Returns (username, serialized data, expires_at) or None."""
+        entry = self.cache.get(sid)
+        if entry is None:
+            entry = get_db().execute(
+                """
+                SELECT s.username, s.data, s.expires_at FROM Session s
+                WHERE s.id = ? AND (s.username IS NULL OR EXISTS (
+                    SELECT 1 FROM User u WHERE u.username = s.username AND u.deleted_at IS NULL
+                ))
+                """,
+                (sid,),
+            ).fetchone()
+            if entry is None:
+                return None
+            entry = tuple(entry)
+            self.cache.put(sid, *entry)
+        if entry[2] < time.time():
+            return None
+        return entry
+
+    def save(self, sid, username, data, expires_at):
+        self.writes += 1
+        db.write(lambda conn: conn.execute(
+            """
+            INSERT INTO Session (id, username, data, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                username = excluded.username, data = excluded.data, expires_at = excluded.expires_at
+            """,
+            (sid, username, data, expires_at),
+        ))
+        self.cache.put(sid, username, data, expires_at)
+
+    def delete(self, sid):
+        self.cache.pop(sid)
+        self.writes += 1
+        db.write(lambda conn: conn.execute("DELETE FROM Session WHERE id = ?", (sid,)))
+
+    def revoke_user(self, username):
+        self.cache.pop_user(username)
+        self.writes += 1
+        return db.write(lambda conn: conn.execute(
+            "DELETE FROM Session WHERE username = ?", (username,)
+        ).rowcount)
+
+    def stats(self):
+        return {"cache": self.cache.stats(), "writes": self.writes}
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store, refresh_interval=REFRESH_INTERVAL, anonymous_lifetime=ANONYMOUS_LIFETIME):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.anonymous_lifetime = anonymous_lifetime
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            # Sessions open before startup's before_request hook migrates.
+            startup.lazy_schema(app)
+            entry = self.store.load(_session_id(token))
+            if entry is not None:
+                return ServerSession(serializer.loads(entry[1]), token, entry[2])
+        return ServerSession()
+
+    def _lifetime(self, app, session):
+        if session.get("Username") is None:
+            return self.anonymous_lifetime
+        return app.permanent_session_lifetime.total_seconds()
+
+    def save_session(self, app, session, response):
+        if session is None:
+            # open_session failed; the error response has nothing to save.
+            return
+        name = self.get_cookie_name(app)
+        cookie = {
+            "domain": self.get_cookie_domain(app),
+            "path": self.get_cookie_path(app),
+            "secure": self.get_cookie_secure(app),
+            "samesite": self.get_cookie_samesite(app),
+            "httponly": self.get_cookie_httponly(app),
+        }
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        username = session.get("Username")
+        if not session or username != session.username:
+            # Emptied, or signed in or out: the old token must stop working.
+            if session.token is not None:
+                self.store.delete(_session_id(session.token))
+            if not session:
+                if session.token is not None:
+                    response.delete_cookie(name, **cookie)
+                return
+            session.token = None
+
+        now = time.time()
+        lifetime = self._lifetime(app, session)
+        if (
+            session.token is not None
+            and not session.modified
+            and session.expires_at - now > lifetime - self.refresh_interval
+        ):
+            return
+        token = session.token or secrets.token_urlsafe(32)
+        try:
+            self.store.save(_session_id(token), username, serializer.dumps(dict(session)), now + lifetime)
+        except sqlite3.IntegrityError:
+            # The account was deleted since this session was cached.
+            response.delete_cookie(name, **cookie)
+            return
+        response.set_cookie(name, token, expires=self.get_expiration_time(app, session), **cookie)
+        response.vary.add("Cookie")
+
+
+class UserContext:
+    """The signed-in user of one request; each attribute is loaded on first use."""
+
+    def __init__(self, username):
+        self.username = username
+
+    @cached_property
+    def data_version(self):
+        return http_cache.data_version(get_db(), self.username)
+
+    @cached_property
+    def summary(self):
+        # Checked against the version the ETag uses, so a summary cached
+        # before another worker's write isn't sent under the new ETag.
+        return summary.get_dashboard_summary(self.username, self.data_version)
+
+    @cached_property
+    def todays_checkin(self):
+        # The (usually cached) summary knows whether there is one at all.
+        if not self.summary["checkin_complete"]:
+            return None
+        return get_db().execute(
+            "SELECT mood_rating, sleep_hours, title FROM Journal WHERE user_username = ? AND timestamp = ?",
+            (self.username, queries.checkin_timestamp()),
+        ).fetchone()
+
+
+def current_user():
+    """The request's UserContext, or None when nobody is signed in."""
+    if "user" not in g:
+        username = session.get("Username")
+        g.user = UserContext(username) if username else None
+    return g.user
+
+
+def revoke_user(username):
+    """Signs the user out everywhere; returns the number of sessions deleted."""
+    store = current_app.extensions["session_store"]
+    return store.revoke_user(username) if store is not None else 0
+
+
+def init_app(app):
+    app.config.setdefault("SESSION_BACKEND", os.environ.get("SESSION_BACKEND", "sqlite"))
+    app.config.setdefault("SESSION_CACHE_SIZE", int(os.environ.get("SESSION_CACHE_SIZE", CACHE_SIZE)))
+    app.config.setdefault("SESSION_CACHE_TTL", float(os.environ.get("SESSION_CACHE_TTL", CACHE_TTL)))
+    app.config.setdefault(
+        "SESSION_REFRESH_INTERVAL", float(os.environ.get("SESSION_REFRESH_INTERVAL", REFRESH_INTERVAL))
+    )
+    app.config.setdefault(
+        "SESSION_ANONYMOUS_LIFETIME", float(os.environ.get("SESSION_ANONYMOUS_LIFETIME", ANONYMOUS_LIFETIME))
+    )
+    if app.config["SESSION_BACKEND"] == "cookie":
+        app.extensions["session_store"] = None
+        return
+    if app.config["SESSION_BACKEND"] != "sqlite":
+        raise ValueError(f"Unknown SESSION_BACKEND {app.config['SESSION_BACKEND']!r}")
+    store = app.extensions["session_store"] = SQLiteSessionStore(
+        SessionCache(app.config["SESSION_CACHE_SIZE"], app.config["SESSION_CACHE_TTL"])
+    )
+    app.session_interface = ServerSessionInterface(
+        store, app.config["SESSION_REFRESH_INTERVAL"], app.config["SESSION_ANONYMOUS_LIFETIME"]
+    )
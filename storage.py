@@ -0,0 +1,145 @@
+"""
+Storage configuration for userdata.db.
+
+Every connection (pooled, standalone and the writer's) gets the same
+PRAGMAs, and WAL mode lets readers in other gunicorn workers keep going
+while one of them writes. Writes made by request threads of one worker
+are funnelled through a single writer thread that commits them in batches.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Applied in this order on every new connection. Values can be overridden
+# with SQLITE_<NAME> environment variables, e.g. SQLITE_BUSY_TIMEOUT=10000.
+PRAGMAS = {
+    # Only takes effect on a new, empty database; see maintenance.vacuum
+    "auto_vacuum": "INCREMENTAL",
+    # Off by default in SQLite; the ON DELETE CASCADE clauses need it
+    "foreign_keys": "ON",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms to wait on another worker's write lock
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,  # negative means KiB, so ~16 MB per connection
+}
+
+
+def get_pragmas():
+    return {
+        name: os.environ.get(f"SQLITE_{name.upper()}", default)
+        for name, default in PRAGMAS.items()
+    }
+
+
+def apply_pragmas(conn):
+    """Applies the storage PRAGMAs to a freshly opened connection."""
+    for name, value in get_pragmas().items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class WriteQueue:
+    """
+    Serializes this process's writes onto one connection.
+
+    Jobs are callables taking a connection. The writer thread takes every
+    job that is waiting, runs each inside its own SAVEPOINT and commits the
+    whole batch once, so concurrent check-ins share a single fsync instead
+    of fighting over the database lock. A job that raises is rolled back on
+    its own and its exception is re-raised in the submitting thread.
+    """
+
+    def __init__(self, connect, max_batch=64, timeout=30.0):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.timeout = timeout
+        # Called with the seconds run() waited (queueing plus commit), if set
+        self.wait_observer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "batches": 0, "failed": 0, "max_batch": 0}
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so each gunicorn worker
+        # has its own writer thread.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            thread = threading.Thread(target=self._run, name="eira-db-writer", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, job):
+        """Queues a write job and returns a Future for its result."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job):
+        """Queues a write job and waits until it has been committed."""
+        if self.wait_observer is None:
+            return self.submit(job).result(timeout=self.timeout)
+        start = time.perf_counter()
+        try:
+            return self.submit(job).result(timeout=self.timeout)
+        finally:
+            self.wait_observer(time.perf_counter() - start)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self):
+        conn = self.connect()
+        conn.isolation_level = None  # transactions are managed explicitly below
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_batch(conn, batch)
+
+    def _run_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, job(conn), None))
+                    conn.execute("RELEASE job")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, exc))
+            conn.execute("COMMIT")
+        except Exception as exc:
+            logger.exception("Write batch of %d jobs failed", len(batch))
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job, future in batch:
+                future.set_exception(exc)
+            with self._lock:
+                self._stats["failed"] += len(batch)
+            return
+
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+        with self._lock:
+            self._stats["jobs"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
@@ -0,0 +1,137 @@
+"""
+Per-user dashboard summary.
+
+Everything the dashboard shows (mood chart, current mood, whether today's
+check-in is done) comes from one query, and the result is kept in a small
+in-memory LRU cache until that user's journal changes.
+
+The cache is per process. Routes that write a user's Journal call
+invalidate() so this worker never serves stale data. Entries also record
+the user's UserDataVersion (see http_cache), and a caller that passes the
+current version never gets a summary from an older one, even from a
+worker that didn't handle the write: the dashboard's body always matches
+the version its ETag was built from. The TTL bounds staleness for
+callers that don't pass one.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+import queries
+from db import get_db
+
+SUMMARY_SQL = """
+    SELECT strftime('%Y-%m-%d', timestamp) AS entry_date,
+           mood_rating,
+           EXISTS (
+               SELECT 1 FROM Journal WHERE user_username = :username AND timestamp = :today
+           ) AS checked_in_today
+    FROM Journal
+    WHERE user_username = :username
+    ORDER BY Journal.timestamp DESC
+    LIMIT 10
+"""
+
+
+class SummaryCache:
+    """Thread-safe LRU of dashboard summaries keyed by username."""
+
+    def __init__(self, max_size=1024, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped on every invalidation. A summary read before a concurrent
+        # write committed must not be stored after that write's invalidate().
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username, today, version=None):
+        with self._lock:
+            entry = self._entries.get(username)
+            # A summary is only valid for the day it was built on, because
+            # "checked in today" flips at midnight.
+            if (
+                entry is None
+                or entry[0] != today
+                or time.monotonic() - entry[1] > self.ttl
+                or (version is not None and entry[2] != version)
+            ):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, username, today, summary, generation, version=None):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[username] = (today, time.monotonic(), version, summary)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def init_app(app):
+    app.config.setdefault("SUMMARY_CACHE_SIZE", int(os.environ.get("SUMMARY_CACHE_SIZE", 1024)))
+    app.config.setdefault("SUMMARY_CACHE_TTL", float(os.environ.get("SUMMARY_CACHE_TTL", 30)))
+    app.extensions["summary_cache"] = SummaryCache(
+        app.config["SUMMARY_CACHE_SIZE"], app.config["SUMMARY_CACHE_TTL"]
+    )
+
+
+def load_dashboard_summary(conn, username, today):
+    """Builds the dashboard data for one user with a single query."""
+    rows = conn.execute(SUMMARY_SQL, {"username": username, "today": today}).fetchall()
+    latest = rows[0] if rows else None
+    return {
+        "recent_dates": [row["entry_date"] for row in rows],
+        "recent_moods": [
+            float(row["mood_rating"]) if row["mood_rating"] else 5.0
+            for row in rows
+        ],
+        "current_mood": (
+            float(latest["mood_rating"])
+            if latest and latest["mood_rating"] is not None
+            else None
+        ),
+        "checkin_complete": bool(latest and latest["checked_in_today"]),
+    }
+
+
+def get_dashboard_summary(username, version=None):
+    """
+    Returns the cached summary, querying the database only on a miss.
+    `version`, the user's UserDataVersion read before this call, rejects
+    entries built from older data.
+    """
+    cache = current_app.extensions["summary_cache"]
+    today = queries.checkin_timestamp()
+    summary = cache.get(username, today, version)
+    if summary is None:
+        generation = cache.generation
+        summary = load_dashboard_summary(get_db(), username, today)
+        cache.put(username, today, summary, generation, version)
+    return summary
+
+
+def invalidate(username):
+    current_app.extensions["summary_cache"].invalidate(username)
@@ -0,0 +1,72 @@
+"""
+Tag lookups over the normalized tag tables.
+
+Journal.tags keeps the comma-separated string the user typed. Triggers
+(migration 8) split it into Tag / JournalTag rows and keep UserTagCount,
+the number of each user's entries per tag, up to date, so nothing here
+ever splits strings across rows. Tag names are trimmed and lower-cased by
+SQLite's lower(), so lookups normalize the same way in SQL.
+"""
+TOP_TAGS_LIMIT = 10
+MAX_TAGS_LIMIT = 100
+
+TOP_TAGS_SQL = """
+    SELECT Tag.name, UserTagCount.entry_count
+    FROM UserTagCount
+    JOIN Tag ON Tag.id = UserTagCount.tag_id
+    WHERE UserTagCount.user_username = ?
+    ORDER BY UserTagCount.entry_count DESC, Tag.name
+    LIMIT ?
+"""
+
+
+def parse_tags(value):
+    """
+    Cleans a comma-separated tag string for storage: trims each tag, drops
+    empty ones and repeats. Returns None when no tags are left.
+    """
+    cleaned = []
+    seen = set()
+    for tag in (value or "").split(","):
+        tag = "".join(ch for ch in tag if ch.isprintable()).strip()
+        if tag and tag.lower() not in seen:
+            seen.add(tag.lower())
+            cleaned.append(tag)
+    return ",".join(cleaned) or None
+
+
+def top_tags(conn, username, limit=TOP_TAGS_LIMIT):
+    """The user's most used tags as [{"name", "count"}], most used first."""
+    limit = max(1, min(limit, MAX_TAGS_LIMIT))
+    return [
+        {"name": row["name"], "count": row["entry_count"]}
+        for row in conn.execute(TOP_TAGS_SQL, (username, limit))
+    ]
+
+
+def tag_count(conn, username, name):
+    """How many of the user's entries carry the tag."""
+    row = conn.execute(
+        """
+        SELECT UserTagCount.entry_count
+        FROM Tag JOIN UserTagCount ON UserTagCount.tag_id = Tag.id
+        WHERE Tag.name = lower(trim(?)) AND UserTagCount.user_username = ?
+        """,
+        (name, username),
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def tag_filter(username, name, table="Journal"):
+    """
+    SQL fragment and parameters limiting `table` to the user's entries
+    tagged `name`, answered from idx_journal_tag_user_tag.
+    """
+    return (
+        f"""{table}.id IN (
+            SELECT JournalTag.journal_id FROM JournalTag
+            WHERE JournalTag.user_username = ?
+              AND JournalTag.tag_id = (SELECT id FROM Tag WHERE name = lower(trim(?)))
+        )""",
+        [username, name],
+    )
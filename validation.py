@@ -0,0 +1,36 @@
+"""
+Validation rules for journal data, shared by the check-in form and the
+bulk import so both accept exactly the same values.
+"""
+
+
+class ValidationError(ValueError):
+    """Raised with a message that can be shown to the user as-is."""
+
+
+def _number(value, message):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValidationError(message) from None
+    if number != number:  # NaN
+        raise ValidationError(message)
+    return int(number) if number.is_integer() else number
+
+
+def validate_mood_rating(value):
+    """Mood rating must be a number from 1 to 10."""
+    message = "Mood rating must be between 1 and 10"
+    rating = _number(value, message)
+    if not (1 <= rating <= 10):
+        raise ValidationError(message)
+    return float(rating)
+
+
+def validate_sleep_hours(value):
+    """Sleep hours must be a number from 0 to 24."""
+    message = "Sleep hours must be between 0 and 24"
+    hours = _number(value, message)
+    if not (0 <= hours <= 24):
+        raise ValidationError(message)
+    return hours